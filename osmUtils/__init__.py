@@ -1,9 +1,32 @@
 #from .vizzuality import Vizz
-from .collectionOsm import CollectionOsm
-from .osmDownload import OsmDownload
-from .osmVisualize import OsmVisualize
+import logging
+import importlib
 from ._version import __version__
 
+# the package logs its progress (see logging.basicConfig), and is silent if logging is not configured
+logging.getLogger(__name__).addHandler(logging.NullHandler())
+
+# the classes are imported on first access (PEP 562), so importing the package or one of
+# its utils does not load geopandas, pandas or folium
+_LAZY_ATTRIBUTES = {
+    'CollectionOsm': 'collectionOsm',
+    'OsmDownload': 'osmDownload',
+    'OsmVisualize': 'osmVisualize',
+}
+
+__all__ = list(_LAZY_ATTRIBUTES) + ['__version__']
+
+
+def __getattr__(name):
+    if name not in _LAZY_ATTRIBUTES:
+        raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
+    value = getattr(importlib.import_module(f'.{_LAZY_ATTRIBUTES[name]}', __name__), name)
+    globals()[name] = value
+    return value
+
+def __dir__():
+    return sorted(set(globals()) | set(_LAZY_ATTRIBUTES))
+
 
 #from pkg_resources import get_distribution
 
@@ -1,20 +1,299 @@
+"""Command line interface to plan and run the collection of the OSM data of a geometry
+
+Usage
+-----
+osmutils plan boundary.geojson --zoom 8 --manifest manifest.sqlite
+osmutils download --manifest manifest.sqlite --osm-type all_roads --driver GeoParquet --workers 8
+osmutils resume --manifest manifest.sqlite
+osmutils status --manifest manifest.sqlite
+
+The metrics of a download can be sent to StatsD as they are recorded with --statsd and written
+for the textfile collector of the Prometheus node exporter with --prometheus.
+"""
 # Standard library imports
+import os
 import sys
+import json
+import time
+import logging
+import argparse
+
+# osmUtils imports
+from osmUtils import __version__
+from osmUtils.settings import DEFAULT_CRS, DEFAULT_PATH, DEFAULT_DRIVER, DEFAULT_WORKERS, DEFAULT_TIMEOUT, \
+    DEFAULT_OVERPASS_ENDPOINT, DEFAULT_OUTPUT, DEFAULT_FILE_EXTENSIONS, OUTPUT_PROFILES, DEFAULT_STATSD_PORT
+from osmUtils.utils_metrics import get_metrics, StatsdExporter
+
+# seconds between two throughput reports
+DEFAULT_REPORT_INTERVAL = 10
+# manifest metadata key of the download parameters, so a run can be resumed with the same ones
+DOWNLOAD_METADATA = 'download'
+DOWNLOAD_DEFAULTS = {
+    'osm_filter': None,
+    'path': DEFAULT_PATH,
+    'driver': DEFAULT_DRIVER,
+    'workers': DEFAULT_WORKERS,
+    'timeout': DEFAULT_TIMEOUT,
+    'overpass_endpoint': [DEFAULT_OVERPASS_ENDPOINT],
+    'output': DEFAULT_OUTPUT,
+    'max_vertices': None,
+    'clip': False,
+    'stream': False,
+    'cache': True,
+    'parse_workers': None,
+}
+
+
+class ThroughputReport:
+    """
+    Callback of utils_collection.retrieve_osmData that prints the throughput of the download
+    in tiles, OSM elements, features and MB per second every interval seconds. The elements
+    are the ones received from the server, before they are parsed into features.
+
+    Parameters
+    ----------
+    total: int
+        number of tiles to download
+    interval: float
+        seconds between two reports
+    prometheus: string
+        if not None, path of a file where the metrics are written in the Prometheus text
+        format with every report
+    """
+    def __init__(self, total, interval=DEFAULT_REPORT_INTERVAL, prometheus=None):
+
+        self.total = total
+        self.interval = interval
+        self.prometheus = prometheus
+        self.start = self.last = time.time()
+        self.tiles = 0
+        self.failed = 0
+        self.features = 0
+        self.elements = 0
+        self.bytes = 0
+
+    def __call__(self, tile_id, result):
+        self.tiles += 1
+        self.failed += bool(result['error'])
+        self.features += result['features']
+        self.elements += result['elements']
+        self.bytes += result['bytes']
+        now = time.time()
+        if now - self.last >= self.interval:
+            self.last = now
+            print(self.format())
+            if self.prometheus is not None:
+                get_metrics().write_prometheus(self.prometheus)
+
+    def format(self):
+        elapsed = max(time.time() - self.start, 1e-9)
+        return (
+            f'{self.tiles}/{self.total} tiles ({self.failed} failed) in {elapsed:.0f}s: '
+            f'{self.tiles / elapsed:.2f} tiles/s, {self.elements / elapsed:.0f} elements/s, '
+            f'{self.features / elapsed:.0f} features/s, {self.bytes / elapsed / 1024 ** 2:.2f} MB/s'
+        )
+
+def read_geometry(path, crs=None):
+    """
+    Read the union of the features of a vector file in EPSG:4326.
+
+    Parameters
+    ----------
+    path: string
+        any vector file readable by geopandas (GeoJSON, Shapefile, GeoPackage, GeoParquet...)
+    crs: string
+        CRS of the file if it does not define one
+
+    Returns
+    -------
+    geometry: shapely.geometry.Polygon or shapely.geometry.MultiPolygon
+    """
+    import shapely
+    import geopandas as gpd
+    gdf = gpd.read_parquet(path) if path.endswith('.parquet') else gpd.read_file(path)
+    if gdf.crs is None:
+        gdf = gdf.set_crs(crs or DEFAULT_CRS)
+    # GeoDataFrame.union_all needs geopandas>=1.0
+    return shapely.union_all(gdf.to_crs(DEFAULT_CRS).geometry.values)
+
+def get_download_parameters(args, store):
+    """
+    Merge the download parameters given in the command line with the ones saved in the
+    manifest by the previous run, and save them for the next one.
+    """
+    from osmUtils.utils_osm import generate_filter
+
+    saved = json.loads(store.get_metadata(DOWNLOAD_METADATA) or '{}')
+    given = {
+        'path': args.path,
+        'driver': args.driver,
+        'workers': args.workers,
+        'timeout': args.timeout,
+        'overpass_endpoint': args.endpoint,
+        'output': args.output,
+        'max_vertices': args.max_vertices,
+        'clip': args.clip,
+        'stream': args.stream,
+        'cache': args.cache,
+        'parse_workers': args.parse_workers,
+    }
+    if args.filter:
+        given['osm_filter'] = args.filter
+    elif args.osm_type:
+        given['osm_filter'] = generate_filter(args.osm_type)
+    parameters = {**DOWNLOAD_DEFAULTS, **saved, **{key: value for key, value in given.items() if value is not None}}
+    if parameters['osm_filter'] is None:
+        raise ValueError('No filter to download, use --osm-type or --filter.')
+    store.set_metadata(DOWNLOAD_METADATA, json.dumps(parameters))
+    return parameters
+
+def plan(args):
+    from osmUtils.collectionOsm import CollectionOsm
+
+    collection = CollectionOsm(
+        geometry=read_geometry(args.geometry, args.crs),
+        zoom=args.zoom,
+        geom_tiles=not args.input_geometry,
+        manifest_path=args.manifest
+    )
+    manifest = collection.plan()
+    interior = int(manifest.interior.sum()) if 'interior' in manifest else 0
+    print(f'{len(manifest)} tiles ({interior} interior) at zoom {args.zoom} in {args.manifest}')
+    return 0
+
+def download(args):
+    from osmUtils.collectionOsm import CollectionOsm
+    from osmUtils.utils_manifest import ManifestStore
+
+    if args.resume and not os.path.exists(args.manifest):
+        raise ValueError(f'There is no manifest to resume in {args.manifest}.')
+    with ManifestStore(args.manifest) as store:
+        planned = len(store) > 0
+        if args.resume and not planned:
+            raise ValueError(f'There is no manifest to resume in {args.manifest}.')
+        parameters = get_download_parameters(args, store)
+        pending = len(store.get_pending())
+    if not planned:
+        if args.geometry is None or args.zoom is None:
+            raise ValueError(f'There is no manifest in {args.manifest}, plan it with --geometry and --zoom.')
+        plan(args)
+
+    metrics = get_metrics()
+    exporter = None
+    if args.statsd:
+        host, _, port = args.statsd.partition(':')
+        exporter = StatsdExporter(host, int(port or DEFAULT_STATSD_PORT))
+        metrics.add_callback(exporter)
+
+    collection = CollectionOsm(manifest_path=args.manifest)
+    report = ThroughputReport(pending if planned else len(collection.plan()), args.report_interval, args.prometheus)
+    parameters = dict(parameters)
+    osm_filter = parameters.pop('osm_filter')
+    parameters['cache'] = None if parameters['cache'] else False
+    try:
+        manifest = collection.download_tiles(custom_filter=osm_filter, callback=report, **parameters)
+    finally:
+        if exporter is not None:
+            metrics.remove_callback(exporter)
+            exporter.close()
+        if args.prometheus:
+            metrics.write_prometheus(args.prometheus)
+    print(report.format())
+    print(metrics.report())
+    remaining = int(((manifest.exclude == 0) & (manifest.exported == 0)).sum())
+    print(f'{int(manifest.exported.sum())} tiles exported, {int(manifest.exclude.sum())} empty and {remaining} pending')
+    return 1 if report.failed else 0
+
+def status(args):
+    from osmUtils.utils_manifest import ManifestStore
+
+    if not os.path.exists(args.manifest):
+        raise ValueError(f'There is no manifest in {args.manifest}.')
+    with ManifestStore(args.manifest) as store:
+        summary = store.get_summary()
+        print(f'{len(store)} tiles, {len(store.get_pending())} pending')
+    for tile_status, totals in summary.items():
+        print(f'{tile_status}: {totals["tiles"]} tiles, {totals["elements"]} elements, {totals["features"]} features, '
+              f'{totals["bytes"] / 1024 ** 2:.2f} MB in {totals["elapsed"]:.0f}s')
+    return 0
+
+def get_parser():
+    parser = argparse.ArgumentParser(prog='osmutils', description='Collect OSM data from the Overpass API by tiles.')
+    parser.add_argument('--version', action='version', version=f'osmUtils {__version__}')
+    parser.add_argument('--log-level', default='INFO', choices=['DEBUG', 'INFO', 'WARNING', 'ERROR'],
+                        help='level of the log messages (default: INFO), DEBUG logs the full queries')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    def add_plan_arguments(subparser, required):
+        subparser.add_argument('--zoom', type=int, required=required, help='zoom level of the tiles')
+        subparser.add_argument('--crs', help='CRS of the geometry file if it does not define one')
+        subparser.add_argument('--input-geometry', action='store_true',
+                               help='manifest of the geometry parts instead of its tile cover')
+
+    def add_download_arguments(subparser):
+        subparser.add_argument('--manifest', required=True, help='SQLite manifest of the collection')
+        subparser.add_argument('--osm-type', help='predefined filter (e.g. all_roads, buildings, parks)')
+        subparser.add_argument('--filter', action='append', help='overpass filter, can be repeated')
+        subparser.add_argument('--path', help=f'output directory (default: {DEFAULT_PATH})')
+        subparser.add_argument('--driver', choices=list(DEFAULT_FILE_EXTENSIONS),
+                               help=f'output format (default: {DEFAULT_DRIVER})')
+        subparser.add_argument('--workers', type=int,
+                               help=f'concurrent queries per endpoint (default: {DEFAULT_WORKERS})')
+        subparser.add_argument('--timeout', type=int, help=f'query timeout in seconds (default: {DEFAULT_TIMEOUT})')
+        subparser.add_argument('--endpoint', action='append',
+                               help=f'overpass endpoint, can be repeated (default: {DEFAULT_OVERPASS_ENDPOINT})')
+        subparser.add_argument('--output', choices=list(OUTPUT_PROFILES),
+                               help=f'output profile of the queries (default: {DEFAULT_OUTPUT})')
+        subparser.add_argument('--max-vertices', type=int, help='vertex budget of the query geometries')
+        subparser.add_argument('--clip', action='store_true', default=None, help='clip the features to the tiles')
+        subparser.add_argument('--stream', action='store_true', default=None,
+                               help='parse the responses while they are downloaded (requires ijson)')
+        subparser.add_argument('--parse-workers', type=int,
+                               help='parse the responses in a pool of this many processes')
+        subparser.add_argument('--no-cache', dest='cache', action='store_false', default=None,
+                               help='do not use the on-disk cache of the responses')
+        subparser.add_argument('--report-interval', type=float, default=DEFAULT_REPORT_INTERVAL,
+                               help='seconds between two throughput reports')
+        subparser.add_argument('--statsd', metavar='HOST[:PORT]', help='send the metrics to a StatsD server')
+        subparser.add_argument('--prometheus', metavar='PATH',
+                               help='write the metrics to a file for the Prometheus node exporter')
+
+    plan_parser = subparsers.add_parser('plan', help='generate the manifest of a geometry file')
+    plan_parser.add_argument('geometry', help='vector file with the geometry to collect')
+    plan_parser.add_argument('--manifest', required=True, help='SQLite manifest to create')
+    add_plan_arguments(plan_parser, required=True)
+    plan_parser.set_defaults(func=plan)
+
+    download_parser = subparsers.add_parser(
+        'download', help='download the tiles of a manifest, planning it first if it does not exist'
+    )
+    download_parser.add_argument('--geometry', help='vector file with the geometry to collect')
+    add_plan_arguments(download_parser, required=False)
+    add_download_arguments(download_parser)
+    download_parser.set_defaults(func=download, resume=False)
 
-# osmUtilstemplate imports
-from osmUtils import vizzuality
-from osmUtils import viewer
+    resume_parser = subparsers.add_parser(
+        'resume', help='download the pending tiles of a manifest with the parameters of its last run'
+    )
+    add_download_arguments(resume_parser)
+    resume_parser.set_defaults(func=download, resume=True, geometry=None, zoom=None)
 
+    status_parser = subparsers.add_parser('status', help='summary of the tiles of a manifest')
+    status_parser.add_argument('--manifest', required=True, help='SQLite manifest of the collection')
+    status_parser.set_defaults(func=status)
+    return parser
 
-def main():
+def main(argv=None):
     """
     This runs from the CLI
     """
-    if len(sys.argv) > 1:
-        vizz = vizzuality.Vizz(sys.argv[1])
-        viewer.show(vizz.name)
-    else:
-        viewer.show('')
+    parser = get_parser()
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=args.log_level, format='%(asctime)s %(levelname)s %(name)s: %(message)s')
+    try:
+        return args.func(args)
+    except ValueError as e:
+        parser.exit(2, f'osmutils: error: {e}\n')
 
 if __name__ == "__main__":
-    main()
+    sys.exit(main())
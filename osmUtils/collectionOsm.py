@@ -1,9 +1,12 @@
 #import requests
-import geopandas as gpd
-import pandas as pd
-from .utils_geo import generate_tiles, geometry_to_gdf, generate_manifest, generate_folium_choropleth_map, get_html_iframe
-from shapely.geometry import shape, MultiPolygon, Polygon
-from .settings import DEFAULT_CRS, DEFAULT_COORDS
+from functools import cached_property
+from .utils_geo import generate_tiles, generate_tile_cover, geometry_to_gdf, generate_manifest, generate_folium_choropleth_map, get_html_iframe
+from shapely.geometry import Polygon
+from .utils_osm import generate_filter
+from .utils_collection import retrieve_osmData
+from .utils_manifest import ManifestStore
+from .settings import DEFAULT_CRS, DEFAULT_COORDS, DEFAULT_PATH, DEFAULT_DRIVER, DEFAULT_WORKERS, DEFAULT_TIMEOUT, \
+    DEFAULT_OVERPASS_ENDPOINT, DEFAULT_OUTPUT
 
 #save manifest as wkt to reduce size of manifest
 
@@ -24,32 +27,64 @@ class CollectionOsm:
     geom_tiles: bool
         if True the manifest will be generated for the tile geometry. False will provide the
         manifest for the input geometry.
+    manifest_path: string
+        path of a SQLite file to persist the manifest. If the file already holds a manifest
+        it is loaded instead of generated, so an interrupted collection can be resumed.
     Returns
     ----------
     manifest: geopandas.GeoDataFrame
             manifest geodataframe.
 
+    The tiles, the manifest and the map are not generated when the object is created but on
+    their first access, or with plan() for the manifest.
+
+    Usage
+    -----
+    collection = CollectionOsm(geometry, zoom=8, manifest_path='manifest.sqlite')
+    manifest = collection.plan()
+    collection.download_tiles(osm_type='all_roads', driver='GeoParquet')
     """
-    def __init__(self, geometry=None, zoom=5, crs=None, geom_tiles=True):
+    def __init__(self, geometry=None, zoom=5, crs=None, geom_tiles=True, manifest_path=None):
         
         self.zoom = zoom
         self.crs = crs or DEFAULT_CRS 
         self.tiles = None
         self.geometry = geometry or Polygon(DEFAULT_COORDS)
         self.geom_tiles = geom_tiles
-
-        #generate geometry gdf
-        self.geometry_gdf = self.get_geom_gdf()
-        self.tiles_gdf = self.get_tiles_gdf()
-            
-        #generate manifest
-        self.manifest = self.get_manifest()
-        self.vizzualise = self.get_choropleth_map()
+        self.manifest_path = manifest_path
 
         #methods
     def _repr_html_(self):
         return get_html_iframe(self.vizzualise)
-        
+
+    @cached_property
+    def geometry_gdf(self):
+        return self.get_geom_gdf()
+
+    @cached_property
+    def tiles_gdf(self):
+        return self.get_tiles_gdf()
+
+    @cached_property
+    def manifest(self):
+        return self.get_manifest()
+
+    @cached_property
+    def vizzualise(self):
+        return self.get_choropleth_map()
+
+    def plan(self):
+        """
+        Generate the manifest of the collection, or load it from manifest_path, if it was
+        not already. The manifest is persisted to manifest_path if it is set.
+
+        Returns
+        -------
+        manifest: geopandas.GeoDataFrame
+            manifest with the tiles to download
+        """
+        return self.manifest
+
     def get_tiles_gdf(self):
         """
         Generate tiles for a determined zoom level.
@@ -60,12 +95,18 @@ class CollectionOsm:
             coordinate system for the output tiles
         zoom: int
             zoom level for the generation of tiles
+        bounds: list of floats
+            only the tiles covering the bounds of the input geometry are generated
 
         Returns
         --------
         gdf: geopandas.GeoDataFrame
+            exact tile cover of the input geometry (see utils_geo.generate_tile_cover) if the
+            manifest is generated for the tile geometry
         """
-        gdf = generate_tiles(crs=self.crs, zoom=self.zoom)
+        if self.geom_tiles:
+            return generate_tile_cover(geometry=self.geometry_gdf, crs=self.crs, zoom=self.zoom)
+        gdf = generate_tiles(crs=self.crs, zoom=self.zoom, bounds=self.geometry_gdf.total_bounds)
         return gdf
     
     def get_geom_gdf(self):
@@ -105,10 +146,127 @@ class CollectionOsm:
         --------
         manifest: geopandas.GeoDataFrame
             """
-        manifest = generate_manifest(geometry=self.geometry_gdf, tiles=self.tiles_gdf, geom_tiles=self.geom_tiles)
+        if self.manifest_path is None:
+            return generate_manifest(geometry=self.geometry_gdf, tiles=self.tiles_gdf, geom_tiles=self.geom_tiles)
+
+        with ManifestStore(self.manifest_path) as store:
+            if not len(store):
+                manifest = generate_manifest(geometry=self.geometry_gdf, tiles=self.tiles_gdf, geom_tiles=self.geom_tiles)
+                store.save_manifest(manifest)
+            manifest = store.load_manifest()
         return manifest
 
     def get_choropleth_map(self):
         folium_map = generate_folium_choropleth_map(gdf=self.manifest)
         return folium_map
-        
\ No newline at end of file
+
+    def download_tiles(
+        self,
+        osm_type='none',
+        custom_filter=None,
+        path=DEFAULT_PATH,
+        driver=DEFAULT_DRIVER,
+        workers=DEFAULT_WORKERS,
+        timeout=DEFAULT_TIMEOUT,
+        overpass_endpoint=DEFAULT_OVERPASS_ENDPOINT,
+        endpoint_slots=None,
+        session=None,
+        cache=None,
+        stream=False,
+        output=DEFAULT_OUTPUT,
+        max_vertices=None,
+        clip=False,
+        callback=None,
+        parse_workers=None
+    ):
+        """
+        Download the OSM data of the manifest tiles concurrently, exporting every tile
+        to a local file as soon as it is retrieved.
+
+        Parameters
+        ----------
+        osm_type: string
+            type of filter to retieve if custom_filter is None (e.g 'all_roads', 'river', 'water_features',
+            'coastline', 'forest', 'buildings', 'parks', 'none')
+        custom_filter: list of strings
+            a custom filter to be used instead of the already defined in the osm_type
+        path: string
+            directory to export the tiles. Default: osm_data
+        driver : string, default: 'ESRI Shapefile'
+            The OGR format driver used to write the tiles. 'GeoParquet' and 'FlatGeobuf' append
+            every tile to a file in path as soon as it is retrieved, in parts of
+            settings.DEFAULT_TILES_PER_PART tiles.
+        workers: int
+            maximum number of concurrent queries per endpoint, capped by the endpoint slot limit
+        overpass_endpoint: string or list of strings
+            API endpoint(s) to use for the overpass queries
+        endpoint_slots: dict
+            slot limit for each endpoint. If None, it is read from the status endpoint.
+        stream: bool
+            if True the responses are parsed while they are downloaded (requires ijson)
+        output: string or dict
+            output profile of the queries (see utils_osm.get_output_profile)
+        max_vertices: int
+            if not None, the tiles clipped to a detailed geometry are queried with their geometry
+            simplified to this number of vertices and the features are filtered with the tile
+        clip: bool
+            if True the features are clipped to their tile, otherwise the features crossing
+            several tiles are written once to the streaming drivers
+        callback: callable
+            called as callback(tile_id, result) when every tile is finished (see
+            utils_collection.retrieve_osmData)
+        parse_workers: int
+            if not None, the responses are parsed in a pool of this many processes instead of
+            the download threads (see utils_parse.ParserPool)
+
+        Returns
+        -------
+        manifest: geopandas.GeoDataFrame
+            manifest with the exclude and exported flags updated
+        """
+        osm_filter = custom_filter if custom_filter is not None else generate_filter(osm_type=osm_type)
+        kwargs = dict(
+            driver=driver,
+            workers=workers,
+            timeout=timeout,
+            overpass_endpoint=overpass_endpoint,
+            endpoint_slots=endpoint_slots,
+            session=session,
+            cache=cache,
+            stream=stream,
+            output=output,
+            max_vertices=max_vertices,
+            clip=clip,
+            callback=callback,
+            parse_workers=parse_workers
+        )
+        if self.manifest_path is None:
+            self.manifest = retrieve_osmData(self.manifest, osm_filter, path, **kwargs)
+        else:
+            with ManifestStore(self.manifest_path) as store:
+                retrieve_osmData(self.manifest, osm_filter, path, store=store, **kwargs)
+                self.manifest = store.load_manifest()
+        # the map is rendered again with the updated manifest
+        self.__dict__.pop('vizzualise', None)
+        return self.manifest
+
+    def resume(self, **kwargs):
+        """
+        Resume the download of a persisted manifest. The manifest is reloaded from
+        manifest_path and only the tiles not yet exported or excluded are queried.
+
+        Parameters
+        ----------
+        **kwargs
+            parameters of download_tiles
+
+        Returns
+        -------
+        manifest: geopandas.GeoDataFrame
+            manifest with the download record of every tile
+        """
+        if self.manifest_path is None:
+            raise ValueError('The collection has no manifest_path to resume from.')
+        with ManifestStore(self.manifest_path) as store:
+            self.manifest = store.load_manifest()
+        return self.download_tiles(**kwargs)
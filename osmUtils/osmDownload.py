@@ -1,6 +1,8 @@
+from functools import cached_property
 from .utils_osm import generate_filter, retrieve_osm, generate_osm_gdf, _to_file
 from .utils_map import html_box
-from .settings import DEFAULT_TIMEOUT, DEFAULT_OVERPASS_ENDPOINT, DEFAULT_PATH, DEFAULT_DRIVER
+from .settings import DEFAULT_TIMEOUT, DEFAULT_OVERPASS_ENDPOINT, DEFAULT_PATH, DEFAULT_DRIVER, DEFAULT_OUTPUT, \
+    DEFAULT_FILE_EXTENSIONS, DEFAULT_OUTPUT_DIR
 
 
 class OsmDownload:
@@ -15,16 +17,49 @@ class OsmDownload:
         type of filter to retieve if custom_filter is None (e.g 'all_roads', 'river', 'water_features', 'coastline', 'forest', 'buildings', 'parks', 'none')
     custom_filter: list of strings
         a custom filter to be used instead of the already defined in the osm_type
+    session: requests.Session
+        pooled session (see utils_http.create_session) used for the requests. If None, the
+        default session of the thread is used.
+    cache: utils_cache.ResponseCache or bool
+        on-disk cache of the responses. If None, the default cache is used (see
+        settings.DEFAULT_CACHE_PATH). False always queries the overpass API.
+    output: string or dict
+        output profile of the queries (see utils_osm.get_output_profile): 'body', 'skel',
+        'geom', 'geom_skel', 'center' or 'csv'. Default: 'body'
+    max_vertices: int
+        if not None, the geometry is simplified to this number of vertices for the queries,
+        covering the original geometry, and the features are then filtered with the original
+        geometry. Useful for detailed boundaries with tens of thousands of vertices.
+    clip: bool
+        if True, the features are clipped to the geometry instead of keeping the whole
+        ways and relations that cross its boundary.
+    stream: bool
+        if True, the responses are parsed into geometries while they are downloaded (see
+        utils_osm.stream_OSM), so the whole response is never held in memory. Requires ijson.
         
     Returns
     -------
     osmData: geopandas.GeoDataFrame
         response retrieved from overpass api in a geopandas.GeoDataFrame
-    
+
+    The data is not retrieved when the object is created but on the first access to
+    osm_json or osm_gdf, or with fetch().
+
+    Usage
+    -----
+    osm_data = OsmDownload(geometry, osm_type='all_roads')
+    gdf = osm_data.fetch()
     """
-    def __init__(self, geometry,  osm_type='none', custom_filter=None):
+    def __init__(self, geometry,  osm_type='none', custom_filter=None, session=None, cache=None, output=DEFAULT_OUTPUT,
+                 max_vertices=None, clip=False, stream=False):
 
         self.geometry = geometry
+        self.session = session
+        self.cache = cache
+        self.output = output
+        self.max_vertices = max_vertices
+        self.clip = clip
+        self.stream = stream
 
         self.osm_type = None
         if custom_filter is None:
@@ -32,13 +67,34 @@ class OsmDownload:
             self.filter = self.get_filter()
         else:
             self.filter = custom_filter
-        self.osm_json = self.get_osm_json()
-        self.osm_gdf = self.get_osm_gdf()
 
         #methods
     def _repr_html_(self):
         return html_box(item=self)
 
+    @cached_property
+    def osm_json(self):
+        return self.get_osm_json()
+
+    @cached_property
+    def osm_gdf(self):
+        return self.get_osm_gdf()
+
+    @property
+    def fetched(self):
+        return 'osm_gdf' in self.__dict__
+
+    def fetch(self):
+        """
+        Retrieve the OSM data from the Overpass API and parse it, if it was not already.
+
+        Returns
+        -------
+        osm_gdf: geopandas.GeoDataFrame
+            response from overpass API in geopandas.GeoDataFrame format
+        """
+        return self.osm_gdf
+
     def get_filter(self):
         """
         Create a filter to retrieve osm data
@@ -75,8 +131,7 @@ class OsmDownload:
         osmData: geojson
                 response retrieved from overpass API
                 """
-        osm_json = retrieve_osm(geometry=self.geometry, osm_filter=self.filter, timeout=DEFAULT_TIMEOUT, overpass_endpoint=DEFAULT_OVERPASS_ENDPOINT)
-        #note:we could add the format output. ATM i'm working with csv
+        osm_json = retrieve_osm(geometry=self.geometry, osm_filter=self.filter, timeout=DEFAULT_TIMEOUT, overpass_endpoint=DEFAULT_OVERPASS_ENDPOINT, session=self.session, cache=self.cache, output=self.output, max_vertices=self.max_vertices, stream=self.stream)
         return osm_json
 
     def get_osm_gdf(self):
@@ -94,10 +149,11 @@ class OsmDownload:
             response from overpass API in geopandas.GeoDataFrame format
         
         """
-        gdf = generate_osm_gdf(response_json=self.osm_json)
+        gdf = generate_osm_gdf(response_json=self.osm_json, output=self.output,
+                               geometry=self.geometry if self.clip else None)
         return gdf
 
-    def save_gdf_to_file(self, filename=DEFAULT_PATH, driver=DEFAULT_DRIVER):
+    def save_gdf_to_file(self, filename=DEFAULT_PATH, driver=DEFAULT_DRIVER, path=DEFAULT_OUTPUT_DIR):
         """
         Save response geogapdas.GeoDataFrame to local file
         
@@ -108,24 +164,21 @@ class OsmDownload:
         filename: string
             File path or file handle to write to. Default: osm_data
         driver : string, default: 'ESRI Shapefile'
-            The OGR format driver used to write the vector file.
+            The format used to write the vector file: 'ESRI Shapefile', 'GeoJSON',
+            'GeoParquet' or 'FlatGeobuf'.
+        path: string
+            output directory. Default: ./data
         """         
-        if driver == "ESRI Shapefile":
-            filename += ".shp"
-
-        elif driver == "GeoJSON":
-            filename += ".geojson"
-        
-        else:
-            raise ValueError(f'driver {driver} is not supported. Try with "ESRI Shapefile" or ""GeoJSON"')
+        if driver not in DEFAULT_FILE_EXTENSIONS:
+            raise ValueError(f'driver {driver} is not supported. Try with {list(DEFAULT_FILE_EXTENSIONS)}')
+        filename += f'.{DEFAULT_FILE_EXTENSIONS[driver]}'
             
         if not self.osm_gdf.empty:
             try:
-                _to_file(gdf=self.osm_gdf, filename=filename, driver=driver)
+                _to_file(gdf=self.osm_gdf, filename=filename, driver=driver, path=path)
                 self.filename = filename
             except:
                 raise ValueError('Export gdf to file failed!')
             
         else:
             raise ValueError('gdf does not exist. Try to generate gdf before saving.')
-
@@ -11,6 +11,95 @@ DEFAULT_PATH = 'osm_data'
 DEFAULT_DRIVER = 'ESRI Shapefile'
 DEFAULT_TIMEOUT=180
 DEFAULT_OVERPASS_ENDPOINT='http://overpass-api.de/api'
+DEFAULT_STATUS_TIMEOUT = 30
+DEFAULT_PAUSE = 5
+DEFAULT_MAX_RETRIES = 3
+#seconds before the first retry of a query, doubled on every attempt
+DEFAULT_BACKOFF = 1
+DEFAULT_TAIL_SIZE = 16 * 1024
+
+#output profiles of the overpass queries: 'recurse' adds the nodes of the ways with `>;`,
+#'geometry' is the kind of geometry built from the response (lines or points) and 'batch'
+#sends all the filters and polygon parts in a single union query
+DEFAULT_OUTPUT = 'body'
+OUTPUT_PROFILES = {
+    'body': {'format': 'json', 'recurse': True, 'out': 'out;', 'geometry': 'lines', 'batch': True},
+    'skel': {'format': 'json', 'recurse': True, 'out': 'out skel qt;', 'geometry': 'lines', 'batch': True},
+    'geom': {'format': 'json', 'recurse': False, 'out': 'out geom qt;', 'geometry': 'lines', 'batch': True},
+    'geom_skel': {'format': 'json', 'recurse': False, 'out': 'out skel geom qt;', 'geometry': 'lines', 'batch': True},
+    'center': {'format': 'json', 'recurse': False, 'out': 'out center qt;', 'geometry': 'points', 'batch': True},
+    'csv': {'format': 'csv', 'recurse': False, 'out': 'out center qt;', 'geometry': 'points', 'batch': True},
+}
+
+#tags that make a closed way an area (unless area=no): None for any value, otherwise the
+#values that do ('include') or do not ('exclude'), as in the OSM wiki
+DEFAULT_AREA_TAGS = {
+    'building': None,
+    'building:part': None,
+    'landuse': None,
+    'amenity': None,
+    'shop': None,
+    'office': None,
+    'tourism': None,
+    'historic': None,
+    'military': None,
+    'place': None,
+    'boundary': None,
+    'water': None,
+    'wetland': None,
+    'area:highway': None,
+    'leisure': {'exclude': ['track', 'slipway']},
+    'natural': {'exclude': ['coastline', 'cliff', 'ridge', 'arete', 'tree_row']},
+    'man_made': {'exclude': ['cutline', 'embankment', 'pipeline']},
+    'aeroway': {'exclude': ['taxiway']},
+    'power': {'include': ['plant', 'substation', 'generator', 'transformer']},
+    'waterway': {'include': ['riverbank', 'dock', 'boatyard', 'dam']},
+    'railway': {'include': ['station', 'turntable', 'roundhouse', 'platform']},
+    'highway': {'include': ['services', 'rest_area', 'escape', 'elevator']},
+    'barrier': {'include': ['city_wall', 'ditch', 'hedge', 'retaining_wall', 'spikes']},
+}
+DEFAULT_AREA_RELATIONS = ['multipolygon', 'boundary']
+
+#columns of the feature tables, the osm_type column holds the code of the element type
+ELEMENT_TYPE_CODES = {'node': 0, 'way': 1, 'relation': 2}
+FEATURE_COLUMNS = ['osm_id', 'osm_type', 'geometry']
+
+#default settings for the concurrent download of the manifest tiles
+DEFAULT_WORKERS = 4
+DEFAULT_SLOTS = 2
+DEFAULT_ENDPOINT_SLOTS = {}
+#processes parsing the responses, None for one per CPU (see utils_parse.ParserPool)
+DEFAULT_PARSE_WORKERS = None
+DEFAULT_FILE_EXTENSIONS = {'ESRI Shapefile': 'shp', 'GeoJSON': 'geojson', 'GeoParquet': 'parquet', 'FlatGeobuf': 'fgb'}
+
+#default settings for the exported files, the streaming drivers append every tile to a single file
+DEFAULT_OUTPUT_DIR = './data'
+STREAMING_DRIVERS = ['GeoParquet', 'FlatGeobuf']
+#tiles of every part of a streaming file, a part is only readable (and its tiles done) once closed
+DEFAULT_TILES_PER_PART = 50
+
+#default settings for the pooled http session
+DEFAULT_POOL_CONNECTIONS = 10
+DEFAULT_POOL_MAXSIZE = 10
+DEFAULT_KEEP_ALIVE = True
+DEFAULT_GZIP = True
+
+#default settings for the on-disk response cache
+DEFAULT_CACHE_PATH = '.osm_cache'
+DEFAULT_CACHE_TTL = 7 * 24 * 3600
+DEFAULT_CACHE_MAX_SIZE = 1024 ** 3
+
+#default settings for splitting geometries too dense for a single query
+DEFAULT_MAX_ELEMENTS = 100000
+DEFAULT_MAX_DEPTH = 6
+DEFAULT_MAX_SPLIT = 4
+DEFAULT_MAX_PARTS = 1024
+DEFAULT_PARTITION_DIR = 'partitions'
+
+#default settings for the metrics of the download pipeline (see utils_metrics)
+DEFAULT_METRICS_PREFIX = 'osmutils'
+DEFAULT_STATSD_HOST = 'localhost'
+DEFAULT_STATSD_PORT = 8125
 
 #default setting for the folium visualization
 DEFAULT_ZOOM_START = 10
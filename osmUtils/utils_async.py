@@ -0,0 +1,372 @@
+"""Asyncio client to query the Overpass API as soon as a server slot is free"""
+import time
+import random
+import asyncio
+import logging
+import datetime as dt
+from ._version import __version__
+from .utils_osm import parse_status, get_query_strings, is_csv_query, parse_csv_response, get_output_profile, \
+    split_batch_response
+from .utils_cache import get_cache
+from .utils_metrics import get_metrics
+from .settings import DEFAULT_TIMEOUT, DEFAULT_OVERPASS_ENDPOINT, DEFAULT_SLOTS, DEFAULT_STATUS_TIMEOUT, \
+    DEFAULT_POOL_MAXSIZE, DEFAULT_MAX_RETRIES, DEFAULT_ENDPOINT_SLOTS, DEFAULT_PAUSE, DEFAULT_OUTPUT, DEFAULT_BACKOFF
+
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+logger = logging.getLogger(__name__)
+
+
+class EndpointState:
+    """
+    Slot bookkeeping of an overpass endpoint.
+
+    Parameters
+    ----------
+    endpoint: string
+        API endpoint to use for the overpass queries
+    slots: int
+        fixed slot limit of the endpoint. If None, it is read from the status endpoint.
+    """
+    def __init__(self, endpoint, slots=None):
+
+        self.endpoint = endpoint.rstrip('/')
+        self.fixed_slots = slots
+        self.rate_limit = slots if slots is not None else DEFAULT_SLOTS
+        self.available = self.rate_limit
+        self.slot_times = []
+        self.running = 0
+
+    def update(self, status):
+        """
+        Update the slots from a parsed status (see utils_osm.parse_status).
+        """
+        if self.fixed_slots is not None:
+            return
+        if status['rate_limit'] is not None:
+            self.rate_limit = status['rate_limit']
+        self.available = status['available_slots']
+        self.slot_times = sorted(status['slot_times'])
+
+    def is_free(self):
+        # a rate limit of 0 means the endpoint is not rate limited
+        if self.rate_limit == 0:
+            return True
+        if self.fixed_slots is not None:
+            return self.running < self.fixed_slots
+        # a status read while a query is on its way does not count it yet, so the running
+        # queries are capped by the rate limit too
+        return self.available > 0 and self.running < self.rate_limit
+
+    def get_wait(self):
+        """
+        Seconds until the next slot of the endpoint is released, None if unknown.
+        """
+        if not self.slot_times:
+            return None
+        return max((self.slot_times[0] - dt.datetime.utcnow()).total_seconds(), 0)
+
+
+class AsyncOverpassClient:
+    """
+    Asyncio client for the Overpass API.
+
+    The client keeps track of the free slots and the "Slot available after" times of every
+    endpoint from its status page and dispatches each query as soon as a slot is free on any
+    of them, so no fixed pause is needed between requests. It must be used as an async
+    context manager.
+
+    Parameters
+    ----------
+    overpass_endpoint: string or list of strings
+        API endpoint(s) to use for the overpass queries. Queries are fanned out across them.
+    timeout: int
+        the timeout interval for the HTTP requests
+    endpoint_slots: dict
+        fixed slot limit for each endpoint. Endpoints not in the dict are tracked from
+        their status endpoint.
+    cache: utils_cache.ResponseCache or bool
+        on-disk cache of responses. If None, the default cache is used. False disables it.
+    max_retries: int
+        number of times a query is retried after a 429 or 504 response or a failed request.
+        A query rejected by the server (any other 4xx response) is not retried.
+    backoff: float
+        seconds to wait before the first retry of a query, doubled on every attempt and
+        randomized so the retries of concurrent queries are spread out
+    pool_size: int
+        maximum number of open connections
+    """
+    def __init__(
+        self,
+        overpass_endpoint=DEFAULT_OVERPASS_ENDPOINT,
+        timeout=DEFAULT_TIMEOUT,
+        endpoint_slots=None,
+        cache=None,
+        max_retries=DEFAULT_MAX_RETRIES,
+        backoff=DEFAULT_BACKOFF,
+        pool_size=DEFAULT_POOL_MAXSIZE
+    ):
+        if aiohttp is None:
+            raise ImportError('AsyncOverpassClient requires aiohttp. Install it with `pip install aiohttp`.')
+
+        overpass_endpoints = [overpass_endpoint] if isinstance(overpass_endpoint, str) else list(overpass_endpoint)
+        endpoint_slots = {**DEFAULT_ENDPOINT_SLOTS, **(endpoint_slots or {})}
+        self.endpoints = [EndpointState(endpoint, endpoint_slots.get(endpoint)) for endpoint in overpass_endpoints]
+        self.timeout = timeout
+        self.cache = get_cache(cache)
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.pool_size = pool_size
+        self.session = None
+        self._condition = None
+
+    async def __aenter__(self):
+        self.session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=self.pool_size),
+            headers={'User-Agent': f'osmUtils/{__version__}', 'Accept-Encoding': 'gzip, deflate'}
+        )
+        self._condition = asyncio.Condition()
+        await asyncio.gather(*[self.update_status(state) for state in self.endpoints])
+        return self
+
+    async def __aexit__(self, *args):
+        await self.session.close()
+
+    async def get_status(self, state):
+        """
+        Query the status endpoint of an endpoint.
+
+        Returns
+        -------
+        status: dict
+            parsed status (see utils_osm.parse_status), None if it could not be queried or parsed
+        """
+        try:
+            async with self.session.get(
+                f'{state.endpoint}/status',
+                timeout=aiohttp.ClientTimeout(total=DEFAULT_STATUS_TIMEOUT)
+            ) as response:
+                return parse_status(await response.text())
+        except Exception as e:
+            logger.warning('Unable to query the status of %s: %r', state.endpoint, e)
+            return None
+
+    async def update_status(self, state):
+        """
+        Query the status endpoint of an endpoint and update its slots.
+
+        Returns
+        -------
+        updated: bool
+            False if the status could not be queried or parsed
+        """
+        if state.fixed_slots is not None:
+            return True
+        status = await self.get_status(state)
+        if status is None:
+            return False
+        state.update(status)
+        return True
+
+    async def acquire(self):
+        """
+        Wait until a slot is free on any endpoint and reserve it.
+
+        Returns
+        -------
+        state: EndpointState
+            endpoint with the reserved slot
+        """
+        while True:
+            async with self._condition:
+                free = [state for state in self.endpoints if state.is_free()]
+                if free:
+                    state = min(free, key=lambda state: state.running)
+                    state.available -= 1
+                    state.running += 1
+                    return state
+
+                # sleep until the first slot is released or a running query finishes
+                waits = [wait for wait in (state.get_wait() for state in self.endpoints) if wait is not None]
+                if waits:
+                    wait = min(waits)
+                else:
+                    wait = None if any(state.running for state in self.endpoints) else DEFAULT_PAUSE
+                try:
+                    await asyncio.wait_for(self._condition.wait(), timeout=wait)
+                    continue
+                except asyncio.TimeoutError:
+                    now = dt.datetime.utcnow()
+                    released = [
+                        state for state in self.endpoints
+                        if state.fixed_slots is None and (not state.slot_times or state.slot_times[0] <= now)
+                    ]
+
+            # the status requests are sent without the lock, so they do not block release()
+            # and the other queries waiting for a slot
+            statuses = await asyncio.gather(*[self.get_status(state) for state in released])
+            async with self._condition:
+                for state, status in zip(released, statuses):
+                    if status is not None:
+                        state.update(status)
+                    # the server may report the slot a moment after its release time
+                    if not state.is_free() and state.slot_times and state.slot_times[0] <= now:
+                        state.slot_times.pop(0)
+                        state.available += 1
+
+    async def release(self, state):
+        """
+        Free the slot reserved in an endpoint and wake up the waiting queries.
+
+        The status of the endpoint is only queried again when none of its slots is known to
+        be free or its slot times have expired, so the status endpoint is not queried after
+        every query.
+        """
+        async with self._condition:
+            state.running -= 1
+            now = dt.datetime.utcnow()
+            refresh = state.fixed_slots is None and (
+                not state.is_free() or (state.slot_times and state.slot_times[0] <= now)
+            )
+            if not refresh:
+                self._condition.notify_all()
+                return
+        # the status request is sent without the lock, as in acquire()
+        status = await self.get_status(state)
+        async with self._condition:
+            if status is not None:
+                state.update(status)
+            self._condition.notify_all()
+
+    async def request(self, query_string):
+        """
+        Send a query to the first endpoint with a free slot and return the JSON response.
+
+        Parameters
+        ----------
+        query_string : str
+            Overpass API query string
+        Returns
+        -------
+        response_json: dict
+        """
+        metrics = get_metrics()
+        if self.cache is not None:
+            for state in self.endpoints:
+                response_json = self.cache.get(query_string, state.endpoint)
+                if response_json is not None:
+                    metrics.increment('cache_hits')
+                    return response_json
+
+        for attempt in range(self.max_retries + 1):
+            if attempt:
+                # exponential backoff with jitter, the slot of the endpoint may be free already
+                await asyncio.sleep(self.backoff * 2 ** (attempt - 1) * random.uniform(0.5, 1.5))
+            start = time.perf_counter()
+            state = await self.acquire()
+            metrics.observe('request_pause_seconds', time.perf_counter() - start)
+            response_json = None
+            try:
+                start = time.perf_counter()
+                async with self.session.post(
+                    f'{state.endpoint}/interpreter',
+                    data={'data': query_string},
+                    timeout=aiohttp.ClientTimeout(total=self.timeout)
+                ) as response:
+                    metrics.increment('requests', status=response.status)
+                    metrics.observe('request_server_seconds', time.perf_counter() - start)
+                    start = time.perf_counter()
+                    if response.status in [429, 504]:
+                        logger.warning('Server %s returned status %s, retrying.', state.endpoint, response.status)
+                        metrics.increment('request_retries', status=response.status)
+                    elif 400 <= response.status < 500:
+                        response.raise_for_status()
+                    elif is_csv_query(query_string):
+                        response.raise_for_status()
+                        response_json = parse_csv_response(await response.text())
+                    else:
+                        response_json = await response.json(content_type=None)
+                    if response_json is not None:
+                        metrics.observe('request_transfer_seconds', time.perf_counter() - start)
+                        metrics.observe('request_elements', len(response_json.get('elements', [])))
+                        logger.info('Query answered by %s', state.endpoint)
+            except (aiohttp.ClientError, asyncio.TimeoutError, ValueError) as e:
+                if isinstance(e, aiohttp.ClientResponseError) and 400 <= e.status < 500:
+                    # the query itself is wrong (e.g. a syntax error), it would fail again
+                    logger.error('Server %s rejected the query: %r', state.endpoint, e)
+                    return None
+                logger.warning('Request to %s failed: %r, retrying.', state.endpoint, e)
+                metrics.increment('request_retries', status='error')
+            finally:
+                await self.release(state)
+
+            if response_json is None:
+                continue
+
+            if 'remark' in response_json:
+                logger.warning('Server remark: "%s"', response_json['remark'])
+                metrics.increment('request_remarks')
+            elif self.cache is not None:
+                self.cache.put(query_string, state.endpoint, response_json)
+            return response_json
+
+        logger.error('Query failed after %d attempts', self.max_retries + 1)
+        return None
+
+    async def request_many(self, query_strings):
+        """
+        Send all the queries concurrently, each one as soon as a slot is free.
+
+        Returns
+        -------
+        responses: list of dict
+            responses in the same order as the queries
+        """
+        return await asyncio.gather(*[self.request(query_string) for query_string in query_strings])
+
+    async def download_OSM(self, geometry, filters='', output=DEFAULT_OUTPUT):
+        """
+        Request to Overpass API the data of every filter within a geometry.
+
+        Parameters
+        ----------
+        geometry: shapely.geometry.Polygon or shapely.geometry.MultiPolygon
+            geographic boundaries to fetch geometries within
+        filters: list of strings
+            filters to be used in the query for retrieving osm data from the overpass API
+        output: string or dict
+            output profile of the queries (see utils_osm.get_output_profile)
+        Returns
+        -------
+        response_json: list of dict
+            responses retrieved from the overpass API, one per filter
+        """
+        responses = await self.request_many(get_query_strings(geometry, filters, self.timeout, output))
+        if not get_output_profile(output)['batch']:
+            return responses
+        return [response for response_j in responses for response in split_batch_response(response_j, filters, output)]
+
+
+def run_queries(query_strings, **kwargs):
+    """
+    Run a list of queries with an AsyncOverpassClient from synchronous code.
+
+    Parameters
+    ----------
+    query_strings: list of strings
+        Overpass API query strings
+    **kwargs
+        parameters of AsyncOverpassClient
+
+    Returns
+    -------
+    responses: list of dict
+        responses in the same order as the queries
+    """
+    async def _run():
+        async with AsyncOverpassClient(**kwargs) as client:
+            return await client.request_many(query_strings)
+    return asyncio.run(_run())
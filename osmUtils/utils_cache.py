@@ -0,0 +1,198 @@
+"""General util functions to cache Overpass API responses on disk"""
+import os
+import gzip
+import json
+import time
+import hashlib
+import threading
+from .settings import DEFAULT_CACHE_PATH, DEFAULT_CACHE_TTL, DEFAULT_CACHE_MAX_SIZE
+
+_default_cache = None
+
+class ResponseCache:
+    """
+    Persistent, content-addressed cache of Overpass API responses.
+
+    Responses are stored gzip compressed under the hash of the normalized query
+    (endpoint + query string, which already holds settings, filter and polygon).
+    Entries older than ttl are ignored and the least recently used entries are
+    evicted once the cache grows over max_size.
+
+    Parameters
+    ----------
+    path: string
+        directory to store the cached responses. Default: .osm_cache
+    ttl: int
+        time to live of the cached responses in seconds. If None, entries never expire.
+    max_size: int
+        maximum size of the cache in bytes. If None, the cache is unbounded.
+    """
+    def __init__(self, path=DEFAULT_CACHE_PATH, ttl=DEFAULT_CACHE_TTL, max_size=DEFAULT_CACHE_MAX_SIZE):
+
+        self.path = path
+        self.ttl = ttl
+        self.max_size = max_size
+        self._size = None
+        self._lock = threading.Lock()
+
+    def get_key(self, query_string, overpass_endpoint):
+        """
+        Hash the normalized query into the key of the cache entry.
+
+        Parameters
+        ----------
+        query_string: string
+            Overpass API query string
+        overpass_endpoint: string
+            API endpoint used for the overpass queries
+        Returns
+        -------
+        key: string
+            sha256 hex digest of the query
+        """
+        normalized = f"{overpass_endpoint.rstrip('/')}\n{' '.join(query_string.split())}"
+        return hashlib.sha256(normalized.encode('utf-8')).hexdigest()
+
+    def _get_filename(self, key):
+        return os.path.join(self.path, key[:2], f'{key}.json.gz')
+
+    def get(self, query_string, overpass_endpoint, raw=False):
+        """
+        Return the cached response for a query, or None if missing or expired. If raw is
+        True the JSON is not parsed and its bytes are returned in 'content' (see
+        utils_osm.overpass_request).
+        """
+        filename = self._get_filename(self.get_key(query_string, overpass_endpoint))
+        try:
+            stat = os.stat(filename)
+        except FileNotFoundError:
+            return None
+
+        now = time.time()
+        if self.ttl is not None and now - stat.st_mtime > self.ttl:
+            self._remove(filename)
+            return None
+        try:
+            if raw:
+                with gzip.open(filename, 'rb') as f:
+                    response_json = {'content': f.read()}
+            else:
+                with gzip.open(filename, 'rt', encoding='utf-8') as f:
+                    response_json = json.load(f)
+        except (OSError, ValueError):
+            self._remove(filename)
+            return None
+
+        # keep the write time (ttl) and record the access time (lru)
+        os.utime(filename, (now, stat.st_mtime))
+        return response_json
+
+    def put(self, query_string, overpass_endpoint, response_json):
+        """
+        Store a response in the cache and evict old entries if the cache is full. The
+        response can be a dict or the bytes of its JSON.
+        """
+        filename = self._get_filename(self.get_key(query_string, overpass_endpoint))
+        os.makedirs(os.path.dirname(filename), exist_ok=True)
+
+        tmp_filename = f'{filename}.{os.getpid()}.{threading.get_ident()}.tmp'
+        if isinstance(response_json, bytes):
+            with gzip.open(tmp_filename, 'wb') as f:
+                f.write(response_json)
+        else:
+            with gzip.open(tmp_filename, 'wt', encoding='utf-8') as f:
+                json.dump(response_json, f)
+        os.replace(tmp_filename, filename)
+
+        with self._lock:
+            if self._size is not None:
+                self._size += os.path.getsize(filename)
+        if self.max_size is not None and self.get_size() > self.max_size:
+            self.evict()
+
+    def _remove(self, filename):
+        try:
+            size = os.path.getsize(filename)
+            os.remove(filename)
+        except OSError:
+            return
+        with self._lock:
+            if self._size is not None:
+                self._size -= size
+
+    def _list_entries(self):
+        entries = []
+        if not os.path.exists(self.path):
+            return entries
+        for root, _, files in os.walk(self.path):
+            for name in files:
+                if not name.endswith('.json.gz'):
+                    continue
+                filename = os.path.join(root, name)
+                try:
+                    stat = os.stat(filename)
+                except OSError:
+                    continue
+                entries.append((stat.st_atime, stat.st_mtime, stat.st_size, filename))
+        return entries
+
+    def get_size(self):
+        """
+        Return the size of the cache in bytes.
+        """
+        with self._lock:
+            if self._size is None:
+                self._size = sum(entry[2] for entry in self._list_entries())
+            return self._size
+
+    def evict(self):
+        """
+        Remove expired entries and, if the cache is still over max_size, the least
+        recently used ones.
+        """
+        now = time.time()
+        entries = sorted(self._list_entries())
+        size = sum(entry[2] for entry in entries)
+        for atime, mtime, entry_size, filename in entries:
+            expired = self.ttl is not None and now - mtime > self.ttl
+            if not expired and (self.max_size is None or size <= self.max_size):
+                continue
+            try:
+                os.remove(filename)
+                size -= entry_size
+            except OSError:
+                pass
+        with self._lock:
+            self._size = size
+
+    def clear(self):
+        """
+        Remove all the entries of the cache.
+        """
+        for _, _, _, filename in self._list_entries():
+            self._remove(filename)
+        with self._lock:
+            self._size = 0
+
+def get_cache(cache=None):
+    """
+    Return the cache to use for a request.
+
+    Parameters
+    ----------
+    cache: ResponseCache or bool
+        cache created with ResponseCache. If None or True, the default cache is used.
+        False disables the cache for the call.
+
+    Returns
+    -------
+    cache: ResponseCache or None
+    """
+    global _default_cache
+    if cache is False:
+        return None
+    if isinstance(cache, ResponseCache):
+        return cache
+    if _default_cache is None:
+        _default_cache = ResponseCache()
+    return _default_cache
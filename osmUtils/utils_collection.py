@@ -0,0 +1,394 @@
+"""General util functions for retrieving the osm data of a tile manifest"""
+import os
+import time
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from .utils_osm import retrieve_osm, generate_osm_gdf, get_slot_limit, is_complete_response, get_output_profile, \
+    clip_features
+from .utils_http import pop_transferred_bytes, pop_received_elements
+from .utils_manifest import ManifestStore
+from .utils_writer import get_writer, get_writer_filename, get_written_files
+from .utils_parse import ParserPool
+from .utils_metrics import get_metrics
+from .settings import DEFAULT_CRS, DEFAULT_TIMEOUT, DEFAULT_OVERPASS_ENDPOINT, DEFAULT_DRIVER, DEFAULT_WORKERS, \
+    DEFAULT_ENDPOINT_SLOTS, DEFAULT_FILE_EXTENSIONS, DEFAULT_OUTPUT, DEFAULT_PATH, STREAMING_DRIVERS, \
+    DEFAULT_TILES_PER_PART, DEFAULT_PARTITION_DIR
+
+logger = logging.getLogger(__name__)
+
+class EndpointPool:
+    """
+    Bounded pool of overpass endpoints. Every endpoint can be acquired as many times
+    as concurrent queries it accepts, so a worker never sends a query to a busy endpoint.
+
+    Parameters
+    ----------
+    endpoint_workers: dict
+        number of concurrent queries allowed for each overpass endpoint
+    """
+    def __init__(self, endpoint_workers):
+
+        self.available = dict(endpoint_workers)
+        self.size = sum(endpoint_workers.values())
+        self._condition = threading.Condition()
+
+    def acquire(self):
+        """
+        Block until an endpoint has a free slot and return it.
+        """
+        with self._condition:
+            while True:
+                endpoint = max(self.available, key=self.available.get)
+                if self.available[endpoint] > 0:
+                    self.available[endpoint] -= 1
+                    return endpoint
+                self._condition.wait()
+
+    def release(self, endpoint):
+        """
+        Give back the slot of an endpoint.
+        """
+        with self._condition:
+            self.available[endpoint] += 1
+            self._condition.notify()
+
+def get_endpoint_workers(overpass_endpoints, workers=DEFAULT_WORKERS, endpoint_slots=None, session=None):
+    """
+    Calculate how many concurrent queries can be sent to each endpoint.
+
+    Parameters
+    ----------
+    overpass_endpoints: list of strings
+        API endpoints to use for the overpass queries
+    workers: int
+        maximum number of concurrent queries per endpoint
+    endpoint_slots: dict
+        slot limit for each endpoint. Endpoints not in the dict are asked for their
+        rate limit in the status endpoint.
+    session: requests.Session
+        pooled session used for the requests. If None, the default session is used.
+    Returns
+    -------
+    endpoint_workers: dict
+        number of concurrent queries for each endpoint
+    """
+    endpoint_slots = {**DEFAULT_ENDPOINT_SLOTS, **(endpoint_slots or {})}
+    endpoint_workers = {}
+    for endpoint in overpass_endpoints:
+        slots = endpoint_slots.get(endpoint)
+        if slots is None:
+            slots = get_slot_limit(endpoint, session=session)
+        # a slot limit of 0 means the endpoint is not rate limited
+        endpoint_workers[endpoint] = min(workers, slots) if slots else workers
+    return endpoint_workers
+
+def get_tile_filename(path, tile_id, driver=DEFAULT_DRIVER):
+    """
+    Build the output filename of a tile.
+    """
+    if driver not in DEFAULT_FILE_EXTENSIONS:
+        raise ValueError(f'driver {driver} is not supported. Try with {list(DEFAULT_FILE_EXTENSIONS)}')
+    return os.path.join(path, f'{tile_id}.{DEFAULT_FILE_EXTENSIONS[driver]}')
+
+def response_to_gdf(response_json, output=DEFAULT_OUTPUT, parser=None):
+    """
+    Parse the output of retrieve_osm into a geopandas.GeoDataFrame, in the process pool of
+    parser (see utils_parse.ParserPool) if it is given.
+
+    Returns
+    -------
+    gdf: geopandas.GeoDataFrame or None
+        None if the request failed
+    """
+    import geopandas as gpd
+    if response_json is None or isinstance(response_json, gpd.GeoDataFrame):
+        return response_json
+    if not is_complete_response(response_json):
+        return None
+    gdf = generate_osm_gdf(response_json, output) if parser is None else parser.parse(response_json)
+    if gdf is None:
+        gdf = gpd.GeoDataFrame(geometry=[])
+    return gdf
+
+def process_tile(
+    tile_id,
+    geometry,
+    osm_filter,
+    path,
+    driver=DEFAULT_DRIVER,
+    timeout=DEFAULT_TIMEOUT,
+    overpass_endpoint=DEFAULT_OVERPASS_ENDPOINT,
+    session=None,
+    cache=None,
+    stream=False,
+    output=DEFAULT_OUTPUT,
+    writer=None,
+    max_vertices=None,
+    clip=False,
+    partition_path=None,
+    parser=None
+):
+    """
+    Retrieve the osm data of a tile and export it to a local file as soon as it is ready.
+
+    If a writer is given (see utils_writer.get_writer) the features are appended to its file
+    instead of being exported to a file per tile. If max_vertices is given the tile is queried
+    with its geometry simplified to that budget and the features are filtered with the tile.
+    If clip is True the features are clipped to the tile. If partition_path is given the
+    partition of a tile that times out is recorded there (see utils_osm.retrieve_osm). If a
+    parser is given (see utils_parse.ParserPool) the responses are parsed in its process pool.
+
+    Returns
+    -------
+    result: dict
+        exclude and exported flags of the tile, number of features, OSM elements and bytes
+        downloaded, elapsed seconds and error if any
+    """
+    start = time.time()
+    pop_transferred_bytes()
+    pop_received_elements()
+    result = {'exclude': 0, 'exported': 0, 'features': 0, 'elements': 0, 'bytes': 0, 'elapsed': 0, 'error': None}
+    # the pool keeps the queries within the slots of the endpoint, no need to pause
+    response_json = retrieve_osm(
+        geometry,
+        osm_filter,
+        timeout=timeout,
+        overpass_endpoint=overpass_endpoint,
+        session=session,
+        cache=cache,
+        pause_duration=0,
+        stream=stream,
+        output=output,
+        max_vertices=max_vertices,
+        partition_path=partition_path,
+        raw=parser is not None
+    )
+    gdf = response_to_gdf(response_json, output, parser)
+    if clip:
+        gdf = clip_features(gdf, geometry)
+    if gdf is None:
+        result['error'] = 'request failed'
+    elif gdf.empty:
+        result['exclude'] = 1
+    else:
+        # overpass geometries are always in WGS84
+        if gdf.crs is None:
+            gdf = gdf.set_crs(DEFAULT_CRS)
+        if writer is not None:
+            writer.write(gdf, tile_id)
+        else:
+            gdf.to_file(get_tile_filename(path, tile_id, driver), driver=driver)
+        result['exported'] = 1
+        result['features'] = len(gdf)
+    result['elements'] = pop_received_elements()
+    result['bytes'] = pop_transferred_bytes()
+    result['elapsed'] = time.time() - start
+    return result
+
+def retrieve_osmData(
+    manifest,
+    osm_filter,
+    path,
+    driver=DEFAULT_DRIVER,
+    workers=DEFAULT_WORKERS,
+    timeout=DEFAULT_TIMEOUT,
+    overpass_endpoint=DEFAULT_OVERPASS_ENDPOINT,
+    endpoint_slots=None,
+    session=None,
+    cache=None,
+    store=None,
+    stream=False,
+    output=DEFAULT_OUTPUT,
+    max_vertices=None,
+    clip=False,
+    callback=None,
+    tiles_per_part=DEFAULT_TILES_PER_PART,
+    parse_workers=None
+):
+    """
+    Download OSM data for every tile of the manifest concurrently and export each
+    tile to a local file. The partitions of the tiles that time out are recorded in the
+    partitions directory of path, so a resumed download goes straight to their parts.
+    The metrics registry (see utils_metrics.get_metrics) is reset, so its report covers
+    this download only.
+
+    Parameters
+    ----------
+    manifest: geopandas.GeoDataFrame
+        manifest geodataframe. Tiles flagged as exclude or exported are skipped.
+    osm_filter: list of strings
+        filter to use for retieve data from the overpass API
+    path: string
+        directory to export the tiles
+    driver: string, default: 'ESRI Shapefile'
+        The OGR format driver used to write the tiles. The streaming drivers ('GeoParquet' and
+        'FlatGeobuf') append every tile to a file in path instead, in parts of tiles_per_part
+        tiles (see utils_writer).
+    workers: int
+        maximum number of concurrent queries per endpoint. It is capped by the
+        slot limit of the endpoint.
+    timeout: int
+        the timeout interval for the HTTP request. Set to 180 by default.
+    overpass_endpoint: string or list of strings
+        API endpoint(s) to use for the overpass queries
+    endpoint_slots: dict
+        slot limit for each endpoint. If an endpoint is missing its rate limit is
+        read from the status endpoint.
+    session: requests.Session
+        pooled session used for the requests. If None, the default session is used.
+    cache: utils_cache.ResponseCache or bool
+        on-disk cache of responses. If None, the default cache is used. False disables it.
+    store: utils_manifest.ManifestStore
+        persistent manifest where the outcome of every tile is recorded as soon as it
+        is finished. If None, only the manifest in memory is updated.
+    stream: bool
+        if True the responses are parsed while they are downloaded to bound the memory
+        of every worker (requires ijson).
+    output: string or dict
+        output profile of the queries (see utils_osm.get_output_profile)
+    max_vertices: int
+        if not None, the tiles with more vertices are queried with their geometry simplified
+        to this budget (see utils_osm.simplify_geometry)
+    clip: bool
+        if True the features are clipped to their tile. Otherwise the features crossing several
+        tiles are written only once to a streaming file (see utils_writer.TileWriter).
+    callback: callable
+        called as callback(tile_id, result) as soon as every tile is finished, with the result
+        of process_tile (exclude and exported flags, features, elements, bytes, elapsed and error).
+    tiles_per_part: int
+        number of tiles of every part of a streaming file. A part is only readable once it is
+        closed, so the tiles written to it are recorded in the store when it is closed.
+    parse_workers: int
+        if not None, the responses are parsed in a pool of this many processes (see
+        utils_parse.ParserPool) instead of the download threads. Streamed responses are
+        always parsed while they are downloaded.
+
+    Returns
+    -------
+    manifest: geopandas.GeoDataFrame
+        manifest with the exclude and exported flags updated
+    """
+    if not os.path.exists(path):
+        os.makedirs(path)
+        logger.info('new directory successfully created it %s', path)
+
+    partition_path = os.path.join(path, DEFAULT_PARTITION_DIR)
+
+    tiles_to_process = manifest[(manifest.exclude == 0) & (manifest.exported == 0)]
+    if tiles_to_process.empty:
+        logger.info('All the %d tiles are already processed', len(manifest))
+        return manifest
+
+    writer = None
+    if driver in STREAMING_DRIVERS:
+        profile = get_output_profile(output)
+        writer = get_writer(
+            driver, get_writer_filename(path, DEFAULT_PATH, driver), profile['tags'], unique=not clip,
+            tiles_per_part=tiles_per_part
+        )
+        logger.info('Writing the tiles to %s', writer.path)
+        if writer.unique and (manifest.exported == 1).any():
+            # a resumed download, the features of the files written before are not written again
+            writer.add_seen(get_written_files(path, DEFAULT_PATH, driver))
+    # tiles appended to a streaming file are only recorded once their part is closed and readable
+    exported = {}
+    committed = set()
+
+    def record_committed():
+        committed.update(writer.pop_committed())
+        for tile_id in [tile_id for tile_id in exported if tile_id in committed]:
+            store.update_tile(tile_id, **exported.pop(tile_id))
+
+    overpass_endpoints = [overpass_endpoint] if isinstance(overpass_endpoint, str) else list(overpass_endpoint)
+    endpoint_workers = get_endpoint_workers(overpass_endpoints, workers, endpoint_slots, session)
+    pool = EndpointPool(endpoint_workers)
+    logger.info('Tiles to process: %d of %d with %d workers %s', len(tiles_to_process), len(manifest), pool.size,
+                endpoint_workers)
+    metrics = get_metrics()
+    metrics.reset()
+
+    parser = ParserPool(parse_workers, output) if parse_workers is not None and not stream else None
+
+    def run(tile_id, geometry, submitted):
+        endpoint = pool.acquire()
+        metrics.observe('tile_queue_seconds', time.time() - submitted)
+        try:
+            return process_tile(
+                tile_id, geometry, osm_filter, path, driver, timeout, endpoint, session, cache, stream, output, writer,
+                max_vertices, clip, partition_path, parser
+            )
+        except Exception as e:
+            return {'exclude': 0, 'exported': 0, 'features': 0, 'elements': pop_received_elements(),
+                    'bytes': pop_transferred_bytes(), 'elapsed': 0, 'error': repr(e)}
+        finally:
+            pool.release(endpoint)
+
+    try:
+        with ThreadPoolExecutor(max_workers=pool.size) as executor:
+            futures = {
+                executor.submit(run, entry['id'], entry['geometry'], time.time()): index
+                for index, entry in tiles_to_process.iterrows()
+            }
+            # update the manifest as the tiles are finished
+            for i, future in enumerate(as_completed(futures)):
+                index = futures[future]
+                result = future.result()
+                manifest.at[index, 'exclude'] = result['exclude']
+                manifest.at[index, 'exported'] = result['exported']
+                tile_id = manifest.at[index, 'id']
+                if store is not None:
+                    if writer is not None and result['exported']:
+                        exported[tile_id] = result
+                        record_committed()
+                    else:
+                        store.update_tile(tile_id, **result)
+                status = 'failed' if result['error'] else 'exported' if result['exported'] else 'empty'
+                metrics.increment('tiles', status=status)
+                metrics.observe('tile_seconds', result['elapsed'])
+                metrics.observe('tile_features', result['features'])
+                if result['error']:
+                    logger.warning('%d/%d Tile %s failed: %s', i + 1, len(futures), tile_id, result['error'])
+                else:
+                    logger.info('%d/%d Tile %s: %d features', i + 1, len(futures), tile_id, result['features'])
+                if callback is not None:
+                    callback(tile_id, result)
+    finally:
+        if parser is not None:
+            parser.close()
+        if writer is not None:
+            writer.close()
+            logger.info('%d features of %d tiles written to %s', writer.features, writer.tiles,
+                        ', '.join(writer.paths))
+            if store is not None:
+                record_committed()
+        logger.info(metrics.report())
+
+    return manifest
+
+def resume_osmData(manifest_path, osm_filter, path, **kwargs):
+    """
+    Resume the download of a manifest persisted with utils_manifest.ManifestStore. Tiles
+    already exported or excluded are not queried again.
+
+    Parameters
+    ----------
+    manifest_path: string
+        path of the SQLite manifest
+    osm_filter: list of strings
+        filter to use for retieve data from the overpass API
+    path: string
+        directory to export the tiles
+    **kwargs
+        any other parameter of retrieve_osmData
+
+    Returns
+    -------
+    manifest: geopandas.GeoDataFrame
+        manifest with the download record of every tile
+    """
+    with ManifestStore(manifest_path) as store:
+        manifest = store.load_manifest()
+        retrieve_osmData(manifest, osm_filter, path, store=store, **kwargs)
+        manifest = store.load_manifest()
+    return manifest
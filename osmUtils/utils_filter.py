@@ -0,0 +1,183 @@
+"""General util functions to match Overpass API filters against the elements of a response"""
+import re
+import json
+import logging
+
+ELEMENT_TYPES = {
+    'node': ('node',),
+    'way': ('way',),
+    'relation': ('relation',),
+    'rel': ('relation',),
+    'nw': ('node', 'way'),
+    'nr': ('node', 'relation'),
+    'wr': ('way', 'relation'),
+    'nwr': ('node', 'way', 'relation'),
+}
+
+logger = logging.getLogger(__name__)
+
+_STRING = r'"(?:[^"\\]|\\.)*"|\'(?:[^\'\\]|\\.)*\'|[\w:.-]+'
+_TYPE_RE = re.compile(r'\s*(nwr|nw|nr|wr|node|way|relation|rel)?')
+_CLAUSE_RE = re.compile(
+    rf'\s*\[\s*(?P<negate>!)?\s*(?P<key_regex>~)?\s*(?P<key>{_STRING})\s*'
+    rf'(?:(?P<op>!=|!~|=|~)\s*(?P<value>{_STRING})\s*)?(?P<flags>,\s*i\s*)?\]'
+)
+
+
+def _unquote(text):
+    if text.startswith('"'):
+        try:
+            return json.loads(text)
+        except ValueError:
+            return text[1:-1]
+    if text.startswith("'"):
+        return text[1:-1].replace("\\'", "'")
+    return text
+
+class OverpassFilter:
+    """
+    Matcher of the tag filters of an Overpass API query statement (e.g. 'way["highway"]',
+    'relation["natural"="water"]' or 'way["highway"!~"footway|path"]').
+
+    Only the element type and the tag clauses ([key], [!key], [key=value], [key!=value],
+    [key~regex], [key!~regex], [~keyregex~regex] and the case insensitive ,i flag) are
+    supported. Any other clause raises a ValueError.
+
+    Parameters
+    ----------
+    statement: string
+        filter used in the overpass query
+    """
+    def __init__(self, statement):
+
+        self.statement = statement
+        match = _TYPE_RE.match(statement)
+        self.types = ELEMENT_TYPES[match.group(1)] if match.group(1) else ELEMENT_TYPES['nwr']
+
+        self.clauses = []
+        position = match.end()
+        while position < len(statement.rstrip()):
+            match = _CLAUSE_RE.match(statement, position)
+            if match is None:
+                raise ValueError(f'Unsupported clause in filter {statement!r} at {statement[position:]!r}')
+            self.clauses.append(self._get_clause(match))
+            position = match.end()
+
+    @staticmethod
+    def _get_clause(match):
+        key = _unquote(match.group('key'))
+        op = match.group('op')
+        value = _unquote(match.group('value')) if op else None
+        flags = re.IGNORECASE if match.group('flags') else 0
+        if match.group('key_regex'):
+            if op != '~':
+                raise ValueError('A key regex clause must have a value regex')
+            return ('key_regex', re.compile(key, flags), re.compile(value, flags))
+        if op is None:
+            return ('not_exists' if match.group('negate') else 'exists', key, None)
+        if op in ('~', '!~'):
+            value = re.compile(value, flags)
+        return (op, key, value)
+
+    def match(self, element):
+        """
+        Check whether an element of an overpass response matches the filter.
+        """
+        if element['type'] not in self.types:
+            return False
+        tags = element.get('tags', {})
+        for op, key, value in self.clauses:
+            if op == 'exists' and key not in tags:
+                return False
+            if op == 'not_exists' and key in tags:
+                return False
+            if op == '=' and tags.get(key) != value:
+                return False
+            if op == '!=' and tags.get(key) == value:
+                return False
+            if op == '~' and (key not in tags or not value.search(tags[key])):
+                return False
+            if op == '!~' and key in tags and value.search(tags[key]):
+                return False
+            if op == 'key_regex' and not any(
+                key.search(tag_key) and value.search(tag_value) for tag_key, tag_value in tags.items()
+            ):
+                return False
+        return True
+
+def get_filters(filters):
+    """
+    Build the matchers of a list of filters.
+
+    Returns
+    -------
+    matchers: list of OverpassFilter or None
+        None if any of the filters cannot be matched on the client side
+    """
+    try:
+        return [OverpassFilter(_filter) for _filter in filters]
+    except ValueError as e:
+        logger.info('Filters cannot be split on the client side: %s', e)
+        return None
+
+def get_references(element, index):
+    """
+    Return the elements added by the `>;` recursion of an element: the nodes of a way and
+    the member nodes and ways of a relation with the nodes of those ways.
+    """
+    references = []
+    if element['type'] == 'way':
+        members = [('node', node_id) for node_id in element.get('nodes', [])]
+    elif element['type'] == 'relation':
+        members = [(member['type'], member['ref']) for member in element.get('members', [])
+                   if member['type'] in ('node', 'way')]
+    else:
+        return references
+    for key in members:
+        member = index.get(key)
+        if member is None:
+            continue
+        references.append(member)
+        if member['type'] == 'way':
+            references.extend(
+                index[('node', node_id)] for node_id in member.get('nodes', []) if ('node', node_id) in index
+            )
+    return references
+
+def split_response(response_json, filters):
+    """
+    Split the response of a query with the union of several filters into one response per
+    filter, as if every filter had been queried on its own.
+
+    Each response keeps, in the original order, the elements matching its filter and the
+    elements they reference (i.e. the nodes and members retrieved with `>;`). The elements
+    are shared, not copied.
+
+    Parameters
+    ----------
+    response_json: dict
+        response retrieved from the overpass API with tags
+    filters: list of strings
+        filters of the union query
+    Returns
+    -------
+    responses: list of dict or None
+        one response per filter, None if the filters cannot be matched on the client side
+    """
+    matchers = get_filters(filters)
+    if matchers is None:
+        return None
+    elements = response_json.get('elements', [])
+    index = {(el['type'], el['id']): el for el in elements}
+
+    responses = []
+    for matcher in matchers:
+        selected = set()
+        for el in elements:
+            if matcher.match(el):
+                selected.add(id(el))
+                selected.update(id(member) for member in get_references(el, index))
+        response = {key: value for key, value in response_json.items() if key != 'elements'}
+        response['elements'] = [el for el in elements if id(el) in selected]
+        responses.append(response)
+    return responses
@@ -1,38 +1,201 @@
 
 """General utility functions."""
-import geopandas as gpd
-import pandas as pd
-import mercantile as mt
-import folium
-from shapely.geometry import shape, MultiPolygon, Polygon, box
-from .settings import DEFAULT_CRS, DEFAULT_TILES, DEFAULT_BASEMAP, DEFAULT_ZOOM_START
-
-def generate_tiles(crs, zoom):
+import numpy as np
+import shapely
+from shapely.geometry import MultiPolygon, Polygon, box
+from .settings import DEFAULT_TILES, DEFAULT_BASEMAP, DEFAULT_ZOOM_START
+
+# latitude limit of the web mercator tiles and margin to exclude the tiles that only touch the bounds
+MAX_LATITUDE = 85.0511287798066
+LL_EPSILON = 1e-11
+
+def tile_range(bounds, zoom):
+    """
+    Compute the range of the tiles covering some bounds at a zoom level.
+
+    Parameters
+    ----------
+    bounds: list of floats
+        west, south, east and north of the area in EPSG:4326
+    zoom: int
+        zoom level of the tiles
+    Returns
+    -------
+    x, y: numpy.ndarray
+        column and row of every tile, in the order of mercantile.tiles
+    """
+    n = 2 ** zoom
+    west, south, east, north = bounds
+    lon = np.array([west, east - LL_EPSILON])
+    lat = np.radians(np.clip([north, south + LL_EPSILON], -MAX_LATITUDE, MAX_LATITUDE))
+    x = np.clip(np.floor((lon + 180.0) / 360.0 * n), 0, n - 1).astype(np.int64)
+    y = np.clip(np.floor((1.0 - np.arcsinh(np.tan(lat)) / np.pi) / 2.0 * n), 0, n - 1).astype(np.int64)
+    x, y = np.meshgrid(np.arange(x[0], x[1] + 1), np.arange(y[0], y[1] + 1), indexing='ij')
+    return x.ravel(), y.ravel()
+
+def tile_bounds(x, y, zoom):
+    """
+    Compute the bounds of tiles with the web mercator formulas.
+
+    Parameters
+    ----------
+    x, y: numpy.ndarray
+        column and row of the tiles
+    zoom: int
+        zoom level of the tiles
+    Returns
+    -------
+    west, south, east, north: numpy.ndarray
+        bounds of every tile in EPSG:4326
+    """
+    n = 2.0 ** zoom
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    west = x / n * 360.0 - 180.0
+    east = (x + 1) / n * 360.0 - 180.0
+    north = np.degrees(np.arctan(np.sinh(np.pi * (1 - 2 * y / n))))
+    south = np.degrees(np.arctan(np.sinh(np.pi * (1 - 2 * (y + 1) / n))))
+    return west, south, east, north
+
+def tile_ids(x, y, zoom):
+    """
+    Build the ids of tiles as '{zoom}_{x}_{y}'.
+    """
+    return np.array([f'{zoom}_{i}_{j}' for i, j in zip(x.tolist(), y.tolist())], dtype=object)
+
+def generate_tiles(crs, zoom, bounds=None):
         """
         Generate tiles for the manifest.
+
+        Only the tiles covering the bounds are generated, with their corners computed for
+        all the tiles at once instead of one tile at a time.
+
+        Parameters
+        ----------
+        crs: string
+            coordinate system for the output tiles
+        zoom: int
+            zoom level of the tiles
+        bounds: list of floats
+            west, south, east and north of the area to cover in EPSG:4326.
+            If None, the tiles of settings.DEFAULT_TILES are generated.
+        Returns
+        -------
+        gdf: geopandas.GeoDataFrame
+            tiles with tile_id and geometry columns
         """
+        import geopandas as gpd
+        x, y = tile_range(DEFAULT_TILES if bounds is None else bounds, zoom)
+        geometry = shapely.box(*tile_bounds(x, y, zoom))
 
-        #generate tiles
-        tiles = []
+        # generate geodataframe with tiles
+        gdf = gpd.GeoDataFrame({'tile_id': tile_ids(x, y, zoom)}, geometry=geometry)
         
-        #calculate bbox for input geometry if geom is none:
+        #check projection 
+        if gdf.crs is None:
+            gdf = set_crs(gdf, crs)
 
-        for tile in mt.tiles(*DEFAULT_TILES, zoom, truncate=False):
+        elif gdf.crs != crs:
+            gdf = reproject_gdf(gdf,crs)
+        return gdf
 
-            tile_id = f"{tile.z}_{tile.x}_{tile.y}"
+def tile_cover(geometry, zoom):
+        """
+        Compute the exact tile cover (polyfill) of a geometry at a zoom level.
 
-            geom = mt.feature(tile)['geometry']
-            polygon = shape(geom)
+        The tile pyramid is walked top-down from zoom 0 with a prepared geometry: only the tiles
+        on the boundary of the geometry are split into their four children, the tiles fully
+        inside it are expanded to their descendants at the zoom level without any further test.
 
-            tiles.append({
-                'tile_id': tile_id,
-                'geometry': polygon
-            })
+        Parameters
+        ----------
+        geometry: shapely.geometry.Polygon or shapely.geometry.MultiPolygon
+            geometry to cover, in EPSG:4326
+        zoom: int
+            zoom level of the tiles
+        Returns
+        -------
+        x, y: numpy.ndarray
+            column and row of every tile intersecting the geometry, in the order of mercantile.tiles
+        interior: numpy.ndarray
+            True for the tiles fully inside the geometry, False for the tiles on its boundary
+        """
+        shapely.prepare(geometry)
+        x = np.zeros(1, dtype=np.int64)
+        y = np.zeros(1, dtype=np.int64)
+        cover = []
+        for z in range(zoom + 1):
+            boxes = shapely.box(*tile_bounds(x, y, z))
+            intersects = shapely.intersects(geometry, boxes)
+            x, y, boxes = x[intersects], y[intersects], boxes[intersects]
+            inside = shapely.contains(geometry, boxes)
 
-        # generate geodataframe with tiles
-        gdf = gpd.GeoDataFrame(tiles)
-        
-        #check projection 
+            # descendants of the interior tiles at the zoom level
+            if inside.any():
+                size = 2 ** (zoom - z)
+                offsets = np.arange(size)
+                cover.append((
+                    (x[inside, None] * size + np.repeat(offsets, size)).ravel(),
+                    (y[inside, None] * size + np.tile(offsets, size)).ravel(),
+                    True
+                ))
+            x, y = x[~inside], y[~inside]
+            if z == zoom:
+                cover.append((x, y, False))
+            else:
+                # children of the boundary tiles
+                x = np.repeat(x * 2, 4) + np.tile([0, 0, 1, 1], len(x))
+                y = np.repeat(y * 2, 4) + np.tile([0, 1, 0, 1], len(y))
+
+        x = np.concatenate([tiles[0] for tiles in cover])
+        y = np.concatenate([tiles[1] for tiles in cover])
+        interior = np.concatenate([np.full(len(tiles[0]), tiles[2]) for tiles in cover])
+        order = np.lexsort((y, x))
+        return x[order], y[order], interior[order]
+
+def polygonal(geometry):
+        """
+        Keep only the polygons of a geometry, e.g. of the intersection of a tile with a
+        geometry that it also touches along a line.
+        """
+        if isinstance(geometry, (Polygon, MultiPolygon)):
+            return geometry
+        polygons = [part for part in shapely.get_parts(geometry) if isinstance(part, (Polygon, MultiPolygon))]
+        polygons = [polygon for part in polygons for polygon in shapely.get_parts(part)]
+        return MultiPolygon(polygons) if len(polygons) != 1 else polygons[0]
+
+def generate_tile_cover(geometry, crs, zoom):
+        """
+        Generate the tiles of the manifest from the exact tile cover of a geometry.
+
+        The tiles on the boundary of the geometry are clipped to it, so they are queried only
+        within the geometry, and the ones that just touch it are dropped. The tiles fully inside
+        keep their box, which is queried as a bbox instead of a polygon.
+
+        Parameters
+        ----------
+        geometry: geopandas.GeoDataFrame
+            geometry parsed in a geopandas.GeoDataFrame (see geometry_to_gdf)
+        crs: string
+            coordinate system for the output tiles
+        zoom: int
+            zoom level of the tiles
+        Returns
+        -------
+        gdf: geopandas.GeoDataFrame
+            tiles with tile_id, interior and geometry columns
+        """
+        import geopandas as gpd
+        union = shapely.union_all(geometry.geometry.values)
+        x, y, interior = tile_cover(union, zoom)
+        geoms = shapely.box(*tile_bounds(x, y, zoom))
+        geoms[~interior] = [polygonal(geom) for geom in shapely.intersection(union, geoms[~interior])]
+        keep = interior | (shapely.area(geoms) > 0)
+
+        gdf = gpd.GeoDataFrame(
+            {'tile_id': tile_ids(x[keep], y[keep], zoom), 'interior': interior[keep].astype(int)},
+            geometry=geoms[keep]
+        )
         if gdf.crs is None:
             gdf = set_crs(gdf, crs)
 
@@ -51,6 +214,7 @@ def geometry_to_gdf(geometry, crs):
         -------
         gdf : geopandas.GeoDataFrame
         """
+        import geopandas as gpd
         #check that incomming geometry is valid
         if not geometry.is_valid:
             raise ValueError('The geometry is invalid')
@@ -60,9 +224,8 @@ def geometry_to_gdf(geometry, crs):
     
         #create gdf from the incomming geometry
 
-        gdf = gpd.GeoDataFrame(geometry)
-        gdf = gdf.set_geometry(0)
-        gdf = gdf.rename(columns={0:'geometry'})
+        parts = list(geometry.geoms) if isinstance(geometry, MultiPolygon) else [geometry]
+        gdf = gpd.GeoDataFrame(geometry=parts)
 
         if gdf.crs is None:
             gdf = set_crs(gdf, crs)
@@ -80,29 +243,32 @@ def generate_manifest(geometry, tiles, geom_tiles):
         geometry : geopandas.GeoDataFrame
             the GeoDataFrame to be projected
         tiles : geopandas.GeoDataFrame 
-            tiles geodataframe to be intersected with the incomming geometry.
-            if None, it will produce a manifest just for the incomming geometry.
+            tiles geodataframe to be intersected with the incomming geometry. A tile cover
+            (see generate_tile_cover) is used as is, with its interior column.
+        geom_tiles : bool
+            if True the manifest will be generated for the tiles, otherwise for the incomming geometry.
         Returns
         ----------
         manifest : geopandas.GeoDataFrame
             manifest geodataframe"""
 
-    geom_tiles_gdf = gpd.sjoin(tiles, geometry, how='left', op='intersects',  lsuffix='tiles', rsuffix='geom')
+    ## the tile cover already holds only the intersecting tiles (see generate_tile_cover)
+    if geom_tiles and 'interior' in tiles:
+        manifest = tiles.rename(columns={'tile_id':'id'})[['id', 'interior', 'geometry']].reset_index(drop=True)
+        manifest['exclude'], manifest['exported'], manifest['uploaded'] = [0, 0, 0]
+        return manifest
 
-    ## Keep only intersecting tile geoms
-    manifest = geom_tiles_gdf[pd.notna(geom_tiles_gdf.geometry_geom)]
-    manifest['exclude'], manifest['exported'], manifest['uploaded'] = [0, 0, 0]
+    # pairs of intersecting geometry parts and tiles
+    geom_index, tile_index = tiles.sindex.query(geometry.geometry.values, predicate='intersects')
 
+    ## Keep only intersecting tile geoms
     if geom_tiles:
-        manifest = manifest.drop_duplicates(subset=['geometry_tiles'])
-        manifest = manifest.drop(columns=['geometry_geom', 'index_geom']).rename(columns={'tile_id':'id'})
-        manifest = manifest.rename(columns={'geometry_tiles':'geometry'})
-        manifest = manifest.set_geometry('geometry')
+        manifest = tiles.iloc[np.unique(tile_index)].rename(columns={'tile_id':'id'})
     else:
-        manifest = manifest.drop_duplicates(subset=['geometry_geom'])
-        manifest = manifest.drop(columns=['geometry_tiles', 'tile_id']).rename(columns={'index_geom':'id'})
-        manifest = manifest.rename(columns={'geometry_geom':'geometry'})
-        manifest = manifest.set_geometry('geometry')
+        manifest = geometry.iloc[np.unique(geom_index)]
+        manifest = manifest.rename_axis('id').reset_index()
+    manifest = manifest[['id', 'geometry']].reset_index(drop=True)
+    manifest['exclude'], manifest['exported'], manifest['uploaded'] = [0, 0, 0]
 
     return manifest
 
@@ -150,6 +316,7 @@ def generate_folium_choropleth_map(gdf):
     -------
     folium_map : folium.folium.Map
     """
+    import folium
     bounds = list(gdf.bounds.iloc[0])
     geom = box(bounds[0], bounds[1], bounds[2], bounds[3])
 
@@ -0,0 +1,104 @@
+"""General util functions for the HTTP transport used to query the Overpass API"""
+import threading
+import requests
+from requests.adapters import HTTPAdapter
+from ._version import __version__
+from .utils_metrics import get_metrics
+from .settings import DEFAULT_POOL_CONNECTIONS, DEFAULT_POOL_MAXSIZE, DEFAULT_KEEP_ALIVE, DEFAULT_GZIP
+
+_sessions = threading.local()
+_transfer = threading.local()
+
+def create_session(
+    pool_connections=DEFAULT_POOL_CONNECTIONS,
+    pool_maxsize=DEFAULT_POOL_MAXSIZE,
+    keep_alive=DEFAULT_KEEP_ALIVE,
+    gzip=DEFAULT_GZIP,
+    headers=None
+):
+    """
+    Create a pooled HTTP session to reuse connections between Overpass API requests.
+
+    Parameters
+    ----------
+    pool_connections: int
+        number of connection pools to cache, one per host (i.e. per overpass endpoint)
+    pool_maxsize: int
+        maximum number of connections to keep open in each pool
+    keep_alive: bool
+        if True the connections are kept open between requests. False closes the
+        connection after every request.
+    gzip: bool
+        if True the server is asked for gzip/deflate compressed responses
+    headers: dict
+        extra headers to send with every request
+
+    Returns
+    -------
+    session: requests.Session
+        session to pass to the retrieving functions and classes
+    """
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_connections, pool_maxsize=pool_maxsize)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+
+    session.headers['User-Agent'] = f'osmUtils/{__version__}'
+    session.headers['Connection'] = 'keep-alive' if keep_alive else 'close'
+    session.headers['Accept-Encoding'] = 'gzip, deflate' if gzip else 'identity'
+    if headers:
+        session.headers.update(headers)
+
+    return session
+
+def get_session(session=None):
+    """
+    Return the given session or, if None, the default session of the current thread.
+
+    requests.Session is not thread-safe, so every thread (e.g. every download worker) gets
+    a default session of its own, which still reuses its connections between requests.
+
+    Parameters
+    ----------
+    session: requests.Session
+        session created with create_session. If None, the default session is used.
+
+    Returns
+    -------
+    session: requests.Session
+    """
+    if session is not None:
+        return session
+    default_session = getattr(_sessions, 'session', None)
+    if default_session is None:
+        default_session = _sessions.session = create_session()
+    return default_session
+
+def add_transferred_bytes(size):
+    """
+    Add the size of a response body to the bytes transferred by the current thread.
+    """
+    _transfer.bytes = getattr(_transfer, 'bytes', 0) + size
+    get_metrics().increment('request_bytes', size)
+
+def pop_transferred_bytes():
+    """
+    Return the bytes transferred by the current thread since the last call and reset the count.
+    """
+    size = getattr(_transfer, 'bytes', 0)
+    _transfer.bytes = 0
+    return size
+
+def add_received_elements(count):
+    """
+    Add the number of OSM elements of a response to the elements received by the current thread.
+    """
+    _transfer.elements = getattr(_transfer, 'elements', 0) + count
+
+def pop_received_elements():
+    """
+    Return the OSM elements received by the current thread since the last call and reset the count.
+    """
+    count = getattr(_transfer, 'elements', 0)
+    _transfer.elements = 0
+    return count
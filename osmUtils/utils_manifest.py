@@ -0,0 +1,163 @@
+"""General util functions to persist the manifest of a collection"""
+import time
+import sqlite3
+from shapely import wkt
+from .settings import DEFAULT_CRS
+
+class ManifestStore:
+    """
+    SQLite backed manifest to keep track of the osm retrieving process across runs.
+
+    Every tile is stored with its geometry as WKT, the exclude/exported/uploaded flags,
+    whether it is fully inside the collection geometry (interior) and the outcome of its
+    last download (status, bytes, features, elapsed time, attempts and error). Each update
+    is committed as soon as it is recorded, so a crashed job can be resumed without
+    querying the finished tiles again.
+
+    Parameters
+    ----------
+    path: string
+        path of the SQLite database. It is created if it does not exist.
+    """
+    def __init__(self, path):
+
+        self.path = path
+        self.connection = sqlite3.connect(path)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute('PRAGMA synchronous=NORMAL')
+        self.connection.executescript("""
+            CREATE TABLE IF NOT EXISTS tiles (
+                id TEXT PRIMARY KEY,
+                geometry TEXT NOT NULL,
+                exclude INTEGER DEFAULT 0,
+                exported INTEGER DEFAULT 0,
+                uploaded INTEGER DEFAULT 0,
+                interior INTEGER DEFAULT 0,
+                status TEXT DEFAULT 'pending',
+                bytes INTEGER DEFAULT 0,
+                elements INTEGER DEFAULT 0,
+                features INTEGER DEFAULT 0,
+                elapsed REAL DEFAULT 0,
+                attempts INTEGER DEFAULT 0,
+                error TEXT,
+                updated REAL
+            );
+            CREATE TABLE IF NOT EXISTS metadata (
+                key TEXT PRIMARY KEY,
+                value TEXT
+            );
+        """)
+        # stores created before the tile cover have no interior column, and before the CLI no elements column
+        columns = [row[1] for row in self.connection.execute('PRAGMA table_info(tiles)')]
+        if 'interior' not in columns:
+            self.connection.execute('ALTER TABLE tiles ADD COLUMN interior INTEGER DEFAULT 0')
+        if 'elements' not in columns:
+            self.connection.execute('ALTER TABLE tiles ADD COLUMN elements INTEGER DEFAULT 0')
+        self.connection.commit()
+
+    def __len__(self):
+        return self.connection.execute('SELECT COUNT(*) FROM tiles').fetchone()[0]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        self.connection.close()
+
+    def save_manifest(self, manifest):
+        """
+        Add the tiles of a manifest to the store. Tiles already stored keep their status.
+
+        Parameters
+        ----------
+        manifest: geopandas.GeoDataFrame
+            manifest geodataframe with id, geometry, exclude, exported and uploaded columns and
+            optionally the interior column of the tile cover
+        """
+        if manifest.crs is not None:
+            self.set_metadata('crs', manifest.crs.to_string())
+        interior = manifest['interior'] if 'interior' in manifest else [0] * len(manifest)
+        rows = zip(
+            manifest['id'].astype(str),
+            manifest.geometry.to_wkt(),
+            manifest['exclude'].astype(int).tolist(),
+            manifest['exported'].astype(int).tolist(),
+            manifest['uploaded'].astype(int).tolist(),
+            [int(value) for value in interior]
+        )
+        with self.connection:
+            self.connection.executemany(
+                """INSERT OR IGNORE INTO tiles (id, geometry, exclude, exported, uploaded, interior)
+                   VALUES (?, ?, ?, ?, ?, ?)""",
+                rows
+            )
+
+    def load_manifest(self):
+        """
+        Load the stored tiles into a manifest.
+
+        Returns
+        -------
+        manifest: geopandas.GeoDataFrame
+            manifest geodataframe with the download record of every tile
+        """
+        import geopandas as gpd
+        columns = ['id', 'geometry', 'exclude', 'exported', 'uploaded', 'interior', 'status', 'bytes', 'features',
+                   'elapsed', 'attempts', 'error']
+        rows = self.connection.execute(f'SELECT {", ".join(columns)} FROM tiles ORDER BY rowid').fetchall()
+        records = [dict(zip(columns, row)) for row in rows]
+        for record in records:
+            record['geometry'] = wkt.loads(record['geometry'])
+        crs = self.get_metadata('crs') or DEFAULT_CRS
+        return gpd.GeoDataFrame(records, columns=columns, geometry='geometry', crs=crs)
+
+    def update_tile(self, tile_id, exclude, exported, bytes=0, elements=0, features=0, elapsed=0, error=None):
+        """
+        Record the outcome of a tile download.
+        """
+        if error:
+            status = 'failed'
+        elif exported:
+            status = 'exported'
+        elif exclude:
+            status = 'empty'
+        else:
+            status = 'pending'
+        with self.connection:
+            self.connection.execute(
+                """UPDATE tiles SET exclude = ?, exported = ?, status = ?, bytes = ?, elements = ?, features = ?,
+                   elapsed = ?, attempts = attempts + 1, error = ?, updated = ? WHERE id = ?""",
+                (int(exclude), int(exported), status, int(bytes), int(elements), int(features), float(elapsed),
+                 error, time.time(), str(tile_id))
+            )
+
+    def get_pending(self):
+        """
+        Return the ids of the tiles that still have to be downloaded.
+        """
+        rows = self.connection.execute('SELECT id FROM tiles WHERE exclude = 0 AND exported = 0').fetchall()
+        return [row[0] for row in rows]
+
+    def get_summary(self):
+        """
+        Return the number of tiles, bytes, elements and features for every status.
+        """
+        rows = self.connection.execute(
+            'SELECT status, COUNT(*), SUM(bytes), SUM(elements), SUM(features), SUM(elapsed) FROM tiles GROUP BY status'
+        ).fetchall()
+        return {
+            status: {'tiles': tiles, 'bytes': size or 0, 'elements': elements or 0, 'features': features or 0,
+                     'elapsed': elapsed or 0}
+            for status, tiles, size, elements, features, elapsed in rows
+        }
+
+    def set_metadata(self, key, value):
+        with self.connection:
+            self.connection.execute('INSERT OR REPLACE INTO metadata (key, value) VALUES (?, ?)', (key, value))
+
+    def get_metadata(self, key):
+        row = self.connection.execute('SELECT value FROM metadata WHERE key = ?', (key,)).fetchone()
+        return row[0] if row else None
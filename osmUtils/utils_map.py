@@ -1,5 +1,4 @@
 """General utils function to map the retrieved data with folium"""
-import folium
 import json
 from .utils_geo import set_crs
 from shapely.geometry import box
@@ -27,7 +26,7 @@ def generate_folium_map(gdf, kwargs):
     -------
     folium_map : folium.folium.Map
     """
-
+    import folium
     gdf_projected = set_crs(gdf=gdf, crs='EPSG:3857')
     gjson_str = get_gjson(gdf_projected)
     gjson = json.loads(gjson_str)
@@ -86,7 +85,10 @@ def html_box(item):
     if is_osmSave:
         html_str ='OSM data saved successfully to local file!'
     if is_osmDownload:
-        html_str = 'OSM data retrieved successfully from the overpass API'
+        if item.fetched:
+            html_str = 'OSM data retrieved successfully from the overpass API'
+        else:
+            html_str = 'OSM data not retrieved yet, call fetch() to query the overpass API'
     
     html = ("<div class='item_container' style='height: auto; overflow: hidden; border: 3px solid #2BA4A0;"
         "border-radius: 2px; background: #fff; line-height: 1.21429em; padding: 10px;'>"
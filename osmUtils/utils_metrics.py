@@ -0,0 +1,237 @@
+"""General util functions to record and export the metrics of the download pipeline"""
+import os
+import time
+import socket
+import logging
+import threading
+from contextlib import contextmanager
+from .settings import DEFAULT_METRICS_PREFIX, DEFAULT_STATSD_HOST, DEFAULT_STATSD_PORT
+
+logger = logging.getLogger(__name__)
+
+_default_metrics = None
+
+
+class Metrics:
+    """
+    Thread-safe registry of the metrics of the download pipeline.
+
+    Counters add up values (requests, bytes, retries...) and observations keep the count,
+    sum, minimum and maximum of a value (durations in seconds, elements per response, split
+    depth...). Both can have labels, e.g. the status code of a request. Every record is also
+    passed to the callbacks, so it can be exported as it happens (see StatsdExporter).
+
+    The metrics recorded by osmUtils are:
+    - requests (status), request_retries (status), request_remarks, request_bytes, cache_hits
+    - request_pause_seconds, request_server_seconds, request_transfer_seconds, request_elements
+    - parse_seconds, parse_features
+    - split_depth: depth of every split of a query that timed out or was too dense
+    - tiles (status), tile_queue_seconds, tile_seconds, tile_features
+
+    Usage
+    -----
+    metrics = get_metrics()
+    metrics.add_callback(lambda kind, name, value, labels: ...)
+    print(metrics.report())
+    """
+    def __init__(self):
+
+        self._lock = threading.Lock()
+        self.callbacks = []
+        self.reset()
+
+    def reset(self):
+        """
+        Clear the recorded metrics.
+        """
+        with self._lock:
+            self.counters = {}
+            self.observations = {}
+            self.start = time.time()
+
+    def add_callback(self, callback):
+        """
+        Call callback(kind, name, value, labels) with every record, kind being 'counter' or
+        'observation'.
+        """
+        self.callbacks.append(callback)
+
+    def remove_callback(self, callback):
+        self.callbacks.remove(callback)
+
+    def increment(self, name, value=1, **labels):
+        """
+        Add a value to a counter.
+        """
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+        self._notify('counter', name, value, labels)
+
+    def observe(self, name, value, **labels):
+        """
+        Record an observation of a value.
+        """
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            stats = self.observations.get(key)
+            if stats is None:
+                self.observations[key] = {'count': 1, 'sum': value, 'min': value, 'max': value}
+            else:
+                stats['count'] += 1
+                stats['sum'] += value
+                stats['min'] = min(stats['min'], value)
+                stats['max'] = max(stats['max'], value)
+        self._notify('observation', name, value, labels)
+
+    @contextmanager
+    def timer(self, name, **labels):
+        """
+        Observe the seconds spent in a with block.
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    def _notify(self, kind, name, value, labels):
+        for callback in self.callbacks:
+            try:
+                callback(kind, name, value, labels)
+            except Exception as e:
+                logger.warning('Metrics callback %r failed: %r', callback, e)
+
+    def get_counter(self, name, **labels):
+        """
+        Return the value of a counter, summed over the labels not given.
+        """
+        with self._lock:
+            return sum(
+                value for (key, key_labels), value in self.counters.items()
+                if key == name and set(labels.items()) <= set(key_labels)
+            )
+
+    def get_summary(self):
+        """
+        Return the counters and the observations (count, sum, mean, min and max) by name and labels.
+        """
+        with self._lock:
+            counters = {_format_key(name, labels): value for (name, labels), value in sorted(self.counters.items())}
+            observations = {
+                _format_key(name, labels): {**stats, 'mean': stats['sum'] / stats['count']}
+                for (name, labels), stats in sorted(self.observations.items())
+            }
+            elapsed = time.time() - self.start
+        return {'elapsed': elapsed, 'counters': counters, 'observations': observations}
+
+    def report(self):
+        """
+        Return a human readable summary of the run.
+        """
+        summary = self.get_summary()
+        lines = [f'Metrics of the last {summary["elapsed"]:.1f}s']
+        lines += [f'  {key}: {value:g}' for key, value in summary['counters'].items()]
+        lines += [
+            f'  {key}: count={stats["count"]} mean={stats["mean"]:.3g} min={stats["min"]:.3g} '
+            f'max={stats["max"]:.3g} sum={stats["sum"]:.3g}'
+            for key, stats in summary['observations'].items()
+        ]
+        return '\n'.join(lines)
+
+    def to_prometheus(self, prefix=DEFAULT_METRICS_PREFIX):
+        """
+        Format the metrics in the Prometheus text exposition format: counters as counters
+        and observations as summaries without quantiles.
+        """
+        with self._lock:
+            counters = sorted(self.counters.items())
+            observations = sorted(self.observations.items())
+        lines = []
+        for name in sorted({name for (name, _), _ in counters}):
+            lines.append(f'# TYPE {prefix}_{name}_total counter')
+            lines += [
+                f'{prefix}_{name}_total{_format_labels(labels)} {value}'
+                for (key, labels), value in counters if key == name
+            ]
+        for name in sorted({name for (name, _), _ in observations}):
+            lines.append(f'# TYPE {prefix}_{name} summary')
+            for (key, labels), stats in observations:
+                if key == name:
+                    lines.append(f'{prefix}_{name}_count{_format_labels(labels)} {stats["count"]}')
+                    lines.append(f'{prefix}_{name}_sum{_format_labels(labels)} {stats["sum"]}')
+        return '\n'.join(lines) + '\n'
+
+    def write_prometheus(self, path, prefix=DEFAULT_METRICS_PREFIX):
+        """
+        Write the metrics to a file for the textfile collector of the Prometheus node exporter.
+        The file is replaced atomically, so it is never scraped half written.
+        """
+        tmp_path = f'{path}.{os.getpid()}.tmp'
+        with open(tmp_path, 'w') as f:
+            f.write(self.to_prometheus(prefix))
+        os.replace(tmp_path, path)
+
+class StatsdExporter:
+    """
+    Metrics callback that sends every record to a StatsD server over UDP: counters as
+    counters and observations as timers in milliseconds if their name ends with _seconds,
+    histograms otherwise. Labels are sent as DogStatsD tags.
+
+    Parameters
+    ----------
+    host: string
+        host of the StatsD server
+    port: int
+        UDP port of the StatsD server
+    prefix: string
+        prefix of the metric names
+
+    Usage
+    -----
+    get_metrics().add_callback(StatsdExporter('localhost', 8125))
+    """
+    def __init__(self, host=DEFAULT_STATSD_HOST, port=DEFAULT_STATSD_PORT, prefix=DEFAULT_METRICS_PREFIX):
+
+        self.address = (host, port)
+        self.prefix = prefix
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+
+    def __call__(self, kind, name, value, labels):
+        if kind == 'counter':
+            line = f'{self.prefix}.{name}:{value}|c'
+        elif name.endswith('_seconds'):
+            line = f'{self.prefix}.{name[:-len("_seconds")]}:{value * 1000:.3f}|ms'
+        else:
+            line = f'{self.prefix}.{name}:{value}|h'
+        if labels:
+            line += '|#' + ','.join(f'{key}:{value}' for key, value in sorted(labels.items()))
+        try:
+            self.socket.sendto(line.encode('utf-8'), self.address)
+        except OSError as e:
+            logger.debug('Unable to send metric to %s:%s: %r', *self.address, e)
+
+    def close(self):
+        self.socket.close()
+
+def _format_key(name, labels):
+    if not labels:
+        return name
+    return name + '{' + ','.join(f'{key}={value}' for key, value in labels) + '}'
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{key}="{value}"' for key, value in labels) + '}'
+
+def get_metrics(metrics=None):
+    """
+    Return the metrics to record to: the given ones or the default registry shared by
+    the whole package.
+    """
+    global _default_metrics
+    if metrics is not None:
+        return metrics
+    if _default_metrics is None:
+        _default_metrics = Metrics()
+    return _default_metrics
@@ -1,13 +1,33 @@
 """ General util fucntion for retrieving osm from the Overpass API"""
+import io
 import os
-import requests
+import re
+import csv
 import json
 import time
-import geopandas as gpd
-import pandas as pd
+import logging
+from array import array
+import numpy as np
+import shapely
 import datetime as dt
-from shapely.geometry import LineString,  box, Polygon, MultiPolygon
-from .settings import DEFAULT_PATH, DEFAULT_DRIVER
+from shapely.geometry import box, Polygon, MultiPolygon, GeometryCollection
+from .settings import DEFAULT_SLOTS, DEFAULT_STATUS_TIMEOUT, DEFAULT_MAX_DEPTH, \
+    DEFAULT_TAIL_SIZE, DEFAULT_OUTPUT, OUTPUT_PROFILES, DEFAULT_CRS, ELEMENT_TYPE_CODES, FEATURE_COLUMNS, \
+    DEFAULT_OUTPUT_DIR, DEFAULT_MAX_RETRIES
+from .utils_http import get_session, add_transferred_bytes, add_received_elements
+from .utils_cache import get_cache
+from .utils_filter import split_response
+from .utils_polygon import is_area, is_area_relation, assemble_multipolygon
+from .utils_metrics import get_metrics
+
+try:
+    import ijson
+except ImportError:
+    ijson = None
+
+logger = logging.getLogger(__name__)
+# end of the elements array followed by the remark of a failed query
+_REMARK_RE = re.compile(rb'\]\s*,\s*"remark"\s*:')
 #from shapely.geometry import mapping, shape, box,
 
 def generate_filter(osm_type):
@@ -43,50 +63,147 @@ def generate_filter(osm_type):
         raise ValueError(f'Unrecognised filter type: {osm_type}')
     return osm_filter
 
+def parse_status(status_text):
+    """
+    Parse the text returned by the Overpass API status endpoint.
+
+    Parameters
+    ----------
+    status_text: string
+        body of the response from the /status endpoint
+    Returns
+    -------
+    status: dict
+        rate_limit (int, 0 means no limit, None if not announced), available_slots (int),
+        slot_times (list of datetime.datetime in UTC when the busy slots are released)
+        and running (bool, True if the server reports running queries)
+    """
+    status = {'rate_limit': None, 'available_slots': 0, 'slot_times': [], 'running': False}
+    recognized = False
+    for line in status_text.split('\n'):
+        tokens = line.strip().split(' ')
+        if line.startswith('Rate limit:'):
+            status['rate_limit'] = int(tokens[2])
+        # e.g. "2 slots available now."
+        elif 'available now' in line:
+            status['available_slots'] = int(tokens[0])
+            recognized = True
+        # e.g. "Slot available after: 2021-01-19T10:00:00Z, in 23 seconds."
+        elif line.startswith('Slot available after:'):
+            utc_time = dt.datetime.strptime(tokens[3], '%Y-%m-%dT%H:%M:%SZ,')
+            status['slot_times'].append(utc_time)
+            recognized = True
+        elif line.startswith('Currently running queries'):
+            status['running'] = True
+            recognized = True
+    if not recognized:
+        raise ValueError(f'Unrecognized server status: "{status_text}"')
+    return status
+
+def get_status(overpass_endpoint='http://overpass-api.de/api', session=None):
+    """
+    Query and parse the Overpass API status endpoint.
+
+    Parameters
+    ----------
+    overpass_endpoint: string
+        API endpoint to use for the overpass queries
+    session: requests.Session
+        pooled session used for the request. If None, the default session is used.
+    Returns
+    -------
+    status: dict
+        parsed status, see parse_status
+    """
+    session = get_session(session)
+    url = overpass_endpoint.rstrip('/') + '/status'
+    response = session.get(url, timeout=DEFAULT_STATUS_TIMEOUT)
+    return parse_status(response.text)
+
+def get_slot_limit(overpass_endpoint='http://overpass-api.de/api', session=None, default_slots=DEFAULT_SLOTS):
+    """
+    Check the Overpass API status endpoint to determine how many queries can run at the same time.
+
+    Parameters
+    ----------
+    overpass_endpoint: string
+        API endpoint to use for the overpass queries
+    session: requests.Session
+        pooled session used for the request. If None, the default session is used.
+    default_slots: int
+        number of slots to return if the status endpoint cannot be queried or parsed
+    Returns
+    -------
+    slots: int
+        number of slots of the endpoint, 0 if the endpoint has no rate limit
+    """
+    try:
+        status = get_status(overpass_endpoint, session)
+    except:
+        logger.warning('Unable to query the status of %s', overpass_endpoint)
+        return default_slots
+    if status['rate_limit'] is None:
+        return default_slots
+    return status['rate_limit']
+
 def get_pause_duration(
     default_duration=5, 
-    overpass_endpoint='http://overpass-api.de/api'
+    overpass_endpoint='http://overpass-api.de/api',
+    session=None,
+    max_checks=DEFAULT_MAX_RETRIES
 ):
     """
     Check the Overpass API status endpoint to determine how long to wait until
     next slot is available.
+
+    Parameters
+    ----------
+    default_duration: int
+        pause in seconds to return if the status endpoint cannot be parsed
+    overpass_endpoint: string
+        API endpoint to use for the overpass queries
+    session: requests.Session
+        pooled session used for the request. If None, the default session is used.
+    max_checks: int
+        number of times the status is checked while the server is only running queries,
+        waiting default_duration seconds between checks
+    Returns
+    -------
+    pause_duration: int
+        how long to pause in seconds before the next request
     """
-    try:
-        url = overpass_endpoint.rstrip('/') + '/status'
-        response = requests.get(url)#, headers=_get_http_headers())
-        status = response.text.split('\n')[3]
-        status_first_token = status.split(' ')[0]
-    # if we cannot reach the status endpoint or parse its output, log an
-    # error and return default duration
-    except:
-        print(f'Unable to query {url}')
-        return default_duration
-    try:
-        # if first token is numeric, it's how many slots you have available - no
-        # wait required
-        available_slots = int(status_first_token)
-        pause_duration = 0
-    except:
-        # if first token is 'Slot', it tells you when your slot will be free
-        if status_first_token == 'Slot':
-            utc_time_str = status.split(' ')[3]
-            utc_time = dt.datetime.strptime(utc_time_str,'%Y-%m-%dT%H:%M:%SZ,')
-            pause_duration = int((utc_time - dt.datetime.utcnow()).total_seconds() + 1)
-            pause_duration = max(pause_duration, 1)
+    for check in range(max_checks):
+        # if we cannot reach the status endpoint or parse its output, log an
+        # error and return default duration
+        try:
+            status = get_status(overpass_endpoint, session)
+        except:
+            logger.warning('Unable to query the status of %s', overpass_endpoint)
+            return default_duration
 
-        # if first token is 'Currently', it is currently running a query
-        elif status_first_token == 'Currently':
+        # if there are slots available - no wait required
+        if status['available_slots'] > 0:
+            return 0
+        # if all the slots are taken, wait until the first one is free
+        if status['slot_times']:
+            utc_time = min(status['slot_times'])
+            pause_duration = int((utc_time - dt.datetime.utcnow()).total_seconds() + 1)
+            return max(pause_duration, 1)
+        # if it is only running queries, wait and check again
+        if check < max_checks - 1:
             time.sleep(default_duration)
-            pause_duration = get_pause_duration()
-        else:
-            print(f'Unrecognized server status: "{status}"')
-            return default_duration
+    return default_duration
 
 def overpass_request(
     query_string, 
     pause_duration=1, 
     timeout=180,
-    overpass_endpoint='http://overpass-api.de/api'
+    overpass_endpoint='http://overpass-api.de/api',
+    session=None,
+    cache=None,
+    stream=False,
+    max_retries=DEFAULT_MAX_RETRIES,
+    raw=False
 ):
     """
     Send a request to the Overpass API via HTTP POST and return the JSON
@@ -100,43 +217,255 @@ def overpass_request(
         status endpoint to find when next slot is available
     timeout : int
         the timeout interval for the requests library
+    overpass_endpoint: string
+        API endpoint to use for the overpass queries
+    session: requests.Session
+        pooled session used for the request. If None, the default session is used.
+    cache: utils_cache.ResponseCache or bool
+        on-disk cache of responses. If None, the default cache is used. False skips
+        the cache for this request.
+    stream: bool
+        if True the elements are parsed incrementally from the socket (requires ijson):
+        'elements' is an iterator that must be consumed before the next request. If the
+        server reports a remark, it is set in 'remark' and the iterator raises
+        IncompleteResponseError (see iter_response_elements). Streamed responses are not
+        cached. CSV queries are never streamed.
+    max_retries: int
+        number of times the query is sent again when the server is busy (429 or 504),
+        waiting longer every time
+    raw: bool
+        if True the JSON body is not parsed: 'content' holds its bytes and 'remark' is read
+        from its tail, so it can be parsed in another process (see utils_parse). CSV
+        queries are always parsed.
     Returns
     -------
     response_json: dict
-
+        JSON response, None if the request failed. The rows of a CSV query are parsed into
+        elements too (see parse_csv_response).
     """
+    is_csv = is_csv_query(query_string)
+    stream = stream and not is_csv
+    raw = raw and not stream and not is_csv
+    if stream and ijson is None:
+        raise ImportError('Streaming responses requires ijson. Install it with `pip install ijson`.')
+    session = get_session(session)
+    cache = get_cache(cache)
+    metrics = get_metrics()
     url = overpass_endpoint.rstrip('/') + '/interpreter'
 
+    if cache is not None:
+        response_json = cache.get(query_string, overpass_endpoint, raw=raw)
+        if response_json is not None:
+            logger.debug('Using cached response for %s', url)
+            metrics.increment('cache_hits')
+            return response_json
+
     # Check server status first and wait if overloaded
-    if pause_duration is None:
-        pause_duration = get_pause_duration()
-    print(f'Pausing {pause_duration} seconds before making API POST request')
-    time.sleep(pause_duration)
+    with metrics.timer('request_pause_seconds'):
+        if pause_duration is None:
+            pause_duration = get_pause_duration(overpass_endpoint=overpass_endpoint, session=session)
+        logger.debug('Pausing %s seconds before making API POST request', pause_duration)
+        time.sleep(pause_duration)
 
-    # Post request
+    # Post request, the query is only logged in full at debug level (polygons can take megabytes)
     data = {'data': query_string}
-    print(f'Posting to {url} with timeout={timeout}, "{data}"')
-    response = requests.post(url, data={'data': query_string}, timeout=timeout)
+    logger.debug('Query: %s', query_string)
+    for attempt in range(max_retries + 1):
+        logger.info('Posting a query of %d bytes to %s with timeout=%s', len(query_string), url, timeout)
+        start = time.perf_counter()
+        response = session.post(url, data=data, timeout=timeout, stream=stream)
+        # the elapsed time of a response is the time until its headers are parsed
+        metrics.increment('requests', status=response.status_code)
+        metrics.observe('request_server_seconds', response.elapsed.total_seconds())
+        if stream and response.status_code == 200:
+            response_json = {}
+            response_json['elements'] = iter_response_elements(response, response_json)
+            return response_json
+        add_transferred_bytes(len(response.content))
+        metrics.observe('request_transfer_seconds',
+                        max(time.perf_counter() - start - response.elapsed.total_seconds(), 0))
 
-    try:
-        response_json = response.json()
-        if 'remark' in response_json:
-            print(f'Server remark: "{response_json["remark"]}"')
+        try:
+            if is_csv:
+                if response.status_code != 200:
+                    raise ValueError(f'status code {response.status_code}')
+                response_json = parse_csv_response(response.text)
+            elif raw:
+                if response.status_code != 200:
+                    raise ValueError(f'status code {response.status_code}')
+                response_json = {'content': response.content}
+                remark = find_remark(response.content[-DEFAULT_TAIL_SIZE:])
+                if remark is not None:
+                    response_json['remark'] = remark
+            else:
+                response_json = response.json()
+            if 'elements' in response_json:
+                add_received_elements(len(response_json['elements']))
+                metrics.observe('request_elements', len(response_json['elements']))
+            if 'remark' in response_json:
+                logger.warning('Server remark: "%s"', response_json['remark'])
+                metrics.increment('request_remarks')
+            break
 
-    except:
-        if response.status_code in [429, 504]:
-            error_pause_duration = get_pause_duration()
-            print(f'Server returned status {response.status_code} and no JSON data: retrying in {error_pause_duration} seconds.')
-            time.sleep(error_pause_duration)
-            response_json = overpass_request(query_string, pause_duration=pause_duration, timeout=timeout)
-        # else, this was an unhandled status_code, throw an exception
-        else:
-            print(f'Server returned status code {response.status_code} and no JSON data.')
-            print(f'Server returned no JSON data\n{response} {response.reason}\n{response.text}')
-            
+        except Exception:
+            response_json = None
+            # this was an unhandled status_code, do not retry
+            if response.status_code not in [429, 504]:
+                logger.error('Server returned status code %s %s and no JSON data:\n%.1000s',
+                             response.status_code, response.reason, response.text)
+                break
+            if attempt == max_retries:
+                logger.error('Server returned status %s and no JSON data: query failed after %d attempts',
+                             response.status_code, max_retries + 1)
+                break
+            # wait for a free slot, and longer on every attempt
+            error_pause_duration = max(
+                get_pause_duration(overpass_endpoint=overpass_endpoint, session=session), 2 ** attempt
+            )
+            logger.warning('Server returned status %s and no JSON data: retrying in %s seconds.',
+                           response.status_code, error_pause_duration)
+            metrics.increment('request_retries', status=response.status_code)
+            with metrics.timer('request_pause_seconds'):
+                time.sleep(error_pause_duration)
+
+    # only store complete responses, timeouts and errors come back with a remark
+    if cache is not None and not stream and isinstance(response_json, dict) and 'remark' not in response_json:
+        cache.put(query_string, overpass_endpoint, response_json.get('content', response_json))
 
     return response_json
 
+def is_csv_query(query_string):
+    """
+    Check whether an Overpass API query asks for CSV output.
+    """
+    return query_string.lstrip().startswith('[out:csv')
+
+def parse_csv_response(text):
+    """
+    Parse the CSV output of an Overpass API query into the elements of a JSON response.
+
+    The query must request the ::type, ::id, ::lat and ::lon columns with a header line
+    (see get_query_settings). Nodes get their coordinates as lat/lon and ways and relations
+    as a center, as in the JSON output of `out center;`. Empty tag columns are dropped.
+
+    Parameters
+    ----------
+    text: string
+        tab separated body of the response
+    Returns
+    -------
+    response_json: dict
+        dict with the parsed elements
+    """
+    elements = []
+    for row in csv.DictReader(io.StringIO(text), delimiter='\t'):
+        element = {'type': row.pop('@type'), 'id': int(row.pop('@id'))}
+        lat, lon = row.pop('@lat', ''), row.pop('@lon', '')
+        if lat and lon:
+            coords = {'lat': float(lat), 'lon': float(lon)}
+            if element['type'] == 'node':
+                element.update(coords)
+            else:
+                element['center'] = coords
+        element['tags'] = {key: value for key, value in row.items() if key is not None and value}
+        elements.append(element)
+    return {'elements': elements}
+
+class IncompleteResponseError(Exception):
+    """
+    Raised by the elements of a streamed response when the server reports a remark (e.g. a
+    timeout) instead of finishing them. The remark is the message of the exception.
+    """
+
+class _TailReader:
+    """
+    File-like wrapper of a response body that counts the bytes read and keeps the last ones,
+    where the Overpass API writes the remark of a failed query.
+
+    The remark follows the elements array, so the bytes are scanned for it as they are read
+    and has_remark is set as soon as the end of the elements is followed by a remark.
+    """
+    def __init__(self, fileobj, tail_size=DEFAULT_TAIL_SIZE):
+        self.fileobj = fileobj
+        self.tail_size = tail_size
+        self.tail = b''
+        self.size = 0
+        self.has_remark = False
+
+    def read(self, size=-1):
+        data = self.fileobj.read(size)
+        if not self.has_remark:
+            # keep a few bytes of the previous read, the remark can start in one and end in the next
+            self.has_remark = _REMARK_RE.search(self.tail[-64:] + data) is not None
+        self.size += len(data)
+        self.tail = (self.tail + data)[-self.tail_size:]
+        return data
+
+def iter_response_elements(response, response_json):
+    """
+    Parse the elements of a streamed Overpass API response one at a time.
+
+    A response with a remark is incomplete and dropped by the callers, so the elements stop
+    as soon as the remark is read (see _TailReader), without parsing the rest of the elements
+    already downloaded, and IncompleteResponseError is raised instead of building the
+    geometries of the elements consumed so far.
+
+    Parameters
+    ----------
+    response: requests.Response
+        response requested with stream=True
+    response_json: dict
+        dict where the remark of the response is set once it is read
+    Yields
+    ------
+    element: dict
+        node, way or relation of the response
+    """
+    response.raw.decode_content = True
+    reader = _TailReader(response.raw)
+    metrics = get_metrics()
+    count = 0
+    try:
+        for element in ijson.items(reader, 'elements.item', use_float=True):
+            if reader.has_remark:
+                # only the remark and the end of the object are left
+                reader.read()
+                break
+            count += 1
+            yield element
+    except ijson.JSONError as e:
+        response_json['remark'] = f'invalid JSON response: {e}'
+    except Exception as e:
+        response_json['remark'] = f'failed reading the response: {e!r}'
+        raise
+    finally:
+        add_transferred_bytes(reader.size)
+        add_received_elements(count)
+        metrics.observe('request_elements', count)
+        response.close()
+
+    remark = find_remark(reader.tail)
+    if remark is not None:
+        response_json['remark'] = remark
+        logger.warning('Server remark: "%s"', response_json['remark'])
+        metrics.increment('request_remarks')
+    if 'remark' in response_json:
+        raise IncompleteResponseError(response_json['remark'])
+
+def find_remark(tail):
+    """
+    Find the remark of an Overpass API JSON response in the last bytes of its body, where the
+    server writes it after the elements when a query fails.
+
+    Returns
+    -------
+    remark: string or None
+    """
+    match = re.search(rb'"remark"\s*:\s*("(?:[^"\\]|\\.)*")', tail)
+    if match:
+        return json.loads(match.group(1))
+    return None
+
 def get_coordinate_string(geometry):
     """
     Extract exterior coordinates from polygon(s) to pass to OSM in a query by
@@ -153,78 +482,709 @@ def get_coordinate_string(geometry):
 
     """
 
-    # extract the exterior coordinates of the geometry to pass to the API later
-    polygons_coords = []
+    # extract the exterior of the geometry to pass to the API later
     if isinstance(geometry, Polygon):
-        x, y = geometry.exterior.xy
-        polygons_coords.append(list(zip(x, y)))
+        polygons = [geometry]
     elif isinstance(geometry, MultiPolygon):
-        for polygon in geometry:
-            x, y = polygon.exterior.xy
-            polygons_coords.append(list(zip(x, y)))
+        polygons = list(geometry.geoms)
     else:
-        print('Geometry must be a shapely Polygon or MultiPolygon')
+        logger.warning('Geometry must be a shapely Polygon or MultiPolygon')
+        polygons = []
 
-    # convert the exterior coordinates of the polygon(s) to the string format
-    # the API expects
+    # convert the exterior coordinates of the polygon(s) to the "lat lon lat lon ..."
+    # string format the API expects, formatting all the values in a single pass
     polygon_coord_strs = []
-    for coords in polygons_coords:
-        s = ''
-        separator = ' '
-        for coord in list(coords):
-            # round floating point lats and longs to 6 decimal places (ie, ~100 mm),
-            # so we can hash and cache strings consistently
-            s = f'{s}{separator}{coord[1]:.6f}{separator}{coord[0]:.6f}'
-        polygon_coord_strs.append(s.strip(separator))
+    for polygon in polygons:
+        values = shapely.get_coordinates(polygon.exterior)[:, ::-1].ravel().tolist()
+        # round floating point lats and longs to 6 decimal places (ie, ~100 mm),
+        # so we can hash and cache strings consistently
+        polygon_coord_strs.append(' '.join(['%.6f'] * len(values)) % tuple(values))
 
     return polygon_coord_strs
 
+def simplify_to_budget(polygon, max_vertices):
+    """
+    Simplify the exterior of a polygon to a vertex budget without losing coverage.
+
+    The exterior is buffered by the simplification tolerance before it is simplified, so the
+    simplified polygon always covers the original one. The smallest tolerance within the
+    budget is found by bisection. If there is none, the bounding box of the polygon is used.
+
+    Parameters
+    ----------
+    polygon: shapely.geometry.Polygon
+        polygon to simplify
+    max_vertices: int
+        maximum number of vertices of the exterior, including the closing one
+    Returns
+    -------
+    simplified: shapely.geometry.Polygon
+        polygon without holes covering the original one
+    """
+    exterior = Polygon(polygon.exterior)
+    if len(polygon.exterior.coords) <= max_vertices:
+        return exterior
+    envelope = exterior.envelope
+    if max_vertices < 5:
+        return envelope
+
+    def simplify(tolerance):
+        simplified = exterior.buffer(tolerance, join_style='mitre').simplify(tolerance, preserve_topology=True)
+        if not isinstance(simplified, Polygon) or len(simplified.exterior.coords) > max_vertices:
+            return None
+        return simplified if simplified.covers(exterior) else None
+
+    west, south, east, north = exterior.bounds
+    low, high = 0.0, max(east - west, north - south)
+    best = None
+    for _ in range(16):
+        tolerance = (low + high) / 2
+        simplified = simplify(tolerance)
+        if simplified is None:
+            low = tolerance
+        else:
+            best, high = simplified, tolerance
+    if best is None or best.area >= envelope.area:
+        return envelope
+    return Polygon(best.exterior)
+
+def simplify_geometry(geometry, max_vertices):
+    """
+    Simplify the geometry of a query to a vertex budget without losing coverage.
+
+    The budget is shared by the polygons of the geometry in proportion to their number of
+    vertices and every exterior is simplified with simplify_to_budget, so the simplified
+    geometry covers the original one. The features retrieved with it have to be filtered
+    with the original geometry (see filter_features).
+
+    Parameters
+    ----------
+    geometry: shapely.geometry.Polygon or shapely.geometry.MultiPolygon
+        geographic boundaries to fetch geometries within
+    max_vertices: int
+        maximum number of vertices of the query geometry
+    Returns
+    -------
+    simplified: shapely.geometry.Polygon or shapely.geometry.MultiPolygon
+    """
+    polygons = list(geometry.geoms) if isinstance(geometry, MultiPolygon) else [geometry]
+    vertices = [len(polygon.exterior.coords) for polygon in polygons]
+    if sum(vertices) <= max_vertices:
+        return geometry
+    simplified = [
+        simplify_to_budget(polygon, max(5, max_vertices * count // sum(vertices)))
+        for polygon, count in zip(polygons, vertices)
+    ]
+    return simplified[0] if isinstance(geometry, Polygon) else MultiPolygon(simplified)
+
+def filter_features(gdf, geometry):
+    """
+    Keep the features that intersect a geometry, e.g. the original geometry of a query
+    made with a simplified one (see simplify_geometry).
+
+    Parameters
+    ----------
+    gdf: geopandas.GeoDataFrame
+        features retrieved from the overpass API
+    geometry: shapely.geometry.Polygon or shapely.geometry.MultiPolygon
+        geometry the features have to intersect
+    Returns
+    -------
+    gdf: geopandas.GeoDataFrame
+    """
+    if gdf is None or gdf.empty:
+        return gdf
+    shapely.prepare(geometry)
+    return gdf[shapely.intersects(geometry, gdf.geometry.values)]
+
+def is_rectangle(polygon):
+    """
+    Check whether a polygon is an axis-aligned rectangle, e.g. a tile fully inside the
+    geometry of a collection (see utils_geo.generate_tile_cover).
+    """
+    if not isinstance(polygon, Polygon) or polygon.is_empty or polygon.interiors:
+        return False
+    envelope_area = polygon.envelope.area
+    return envelope_area > 0 and abs(envelope_area - polygon.area) <= 1e-9 * envelope_area
+
+def get_area_filters(geometry):
+    """
+    Build the area filters of the overpass query for every polygon of a geometry.
+
+    Rectangles are queried with a (south,west,north,east) bbox filter, which the overpass
+    API evaluates much faster than a (poly:"...") filter.
+
+    Parameters
+    -----------
+    geometry: shapely.geometry.Polygon or shapely.geometry.MultiPolygon
+        geographic boundaries to fetch geometries within
+    Return
+    ------
+    area_filters: list of strings
+        bbox or poly filter of every polygon
+    """
+    polygons = list(geometry.geoms) if isinstance(geometry, MultiPolygon) else [geometry]
+    area_filters = []
+    for polygon in polygons:
+        if is_rectangle(polygon):
+            west, south, east, north = polygon.bounds
+            area_filters.append(f'({south:.6f},{west:.6f},{north:.6f},{east:.6f})')
+        else:
+            area_filters.extend(f'(poly:"{coord_str}")' for coord_str in get_coordinate_string(polygon))
+    return area_filters
+
+def OSM_response_to_features(response_json, output=DEFAULT_OUTPUT):
+    """
+    Parse Overpass API json response into a feature table with the parser of its output
+    profile: lines and areas for the body, skel and geom profiles and points for the center
+    and csv profiles.
+
+    Parameters
+    ----------
+    response_json: dict
+        response retrieved from the overpass API. Its elements can be a list or an
+        iterator (e.g. a streamed response, see overpass_request).
+    output: string or dict
+        output profile the response was requested with (see get_output_profile). Its tags
+        whitelist selects the tag columns, all the tags are kept if it is None.
+    Returns
+    -------
+    features: geopandas.GeoDataFrame or None
+        osm_id, osm_type code (see settings.ELEMENT_TYPE_CODES), tag columns and geometry
+        of every feature, None if the response could not be parsed (i.e. an element
+        without a required field or an invalid geometry). Any other error is raised.
+    """
+    if not 'elements' in response_json:
+        logger.warning('No elements in response!')
+        return elements_to_features([])
+    profile = get_output_profile(output)
+    try:
+        if profile['geometry'] == 'points':
+            return elements_to_point_features(response_json['elements'], profile['tags'])
+        return elements_to_features(response_json['elements'], profile['tags'])
+    except (KeyError, ValueError, shapely.errors.GEOSException):
+        logger.exception('Unable to parse the response')
+        return None
+
 def OSM_response_to_lines(response_json):
     """
-    Parse Overpass API json response to extract ways as linestrings
+    Parse Overpass API json response to extract ways as linestrings, closed ways tagged as
+    areas as polygons and multipolygon relations as multipolygons
+    Parameters
+    ----------
+    response_json: dict
+        response retrieved from the overpass API. Its elements can be a list or an
+        iterator (e.g. a streamed response, see overpass_request).
+    Returns
+    -------
+    geoms: list of shapely geometries
+        line strings, polygons and multipolygons from retrieved ways and relations
+
+    """
+    features = OSM_response_to_features(response_json, {'profile': 'body', 'tags': []})
+    if features is None:
+        return None
+    return list(features.geometry)
+
+def OSM_response_to_points(response_json):
+    """
+    Parse Overpass API json response to extract every element as a point: nodes by their
+    coordinates, ways and relations by their center (`out center;` and csv output profiles).
+
     Parameters
     ----------
     response_json: dict
         response retrieved from the overpass API
     Returns
     -------
-    geoms: shapely.geometry.LineString
-        line strings from retrieved nodes
+    geoms: list of shapely.geometry.Point
+    """
+    features = OSM_response_to_features(response_json, {'profile': 'center', 'tags': []})
+    if features is None:
+        return None
+    return list(features.geometry)
 
+class _TagTable:
     """
-    if not 'elements' in response_json:
-        print("No elements in response!")
-        return []
-    
-    # Iterate through elements in Overpass API response
-    nodes_xy = {}
-    ways = {}
-    for el in response_json['elements']:
+    Columnar store of the tags of the elements, filled while the elements are parsed.
+
+    Every column keeps the row numbers and values of the elements with that tag only, so
+    sparse tags take no memory for the elements without them.
+
+    Parameters
+    ----------
+    tags: list of strings
+        tags to keep. If None, all the tags are kept.
+    """
+    def __init__(self, tags=None):
+        self.tags = None if tags is None else list(tags)
+        self._selected = None if tags is None else set(tags)
+        self.columns = {}
+        self.size = 0
+
+    def append(self, tags):
+        """
+        Add the tags of an element and return its row number.
+        """
+        row = self.size
+        self.size += 1
+        for key, value in (tags or {}).items():
+            if key in FEATURE_COLUMNS or (self._selected is not None and key not in self._selected):
+                continue
+            column = self.columns.get(key)
+            if column is None:
+                column = self.columns[key] = (array('q'), [])
+            column[0].append(row)
+            column[1].append(value)
+        return row
+
+    def to_dict(self, rows):
+        """
+        Build a categorical column for every tag with the selected rows, in their order.
+        """
+        import pandas as pd
+        position = np.full(self.size, -1, dtype=np.int64)
+        position[np.asarray(rows, dtype=np.int64)] = np.arange(len(rows))
+        keys = sorted(self.columns) if self.tags is None else [key for key in self.tags if key in self.columns]
+        columns = {}
+        for key in keys:
+            column_rows, values = self.columns[key]
+            positions = position[np.asarray(column_rows, dtype=np.int64)]
+            selected = positions >= 0
+            if not selected.any():
+                continue
+            column = np.full(len(rows), None, dtype=object)
+            column[positions[selected]] = np.asarray(values, dtype=object)[selected]
+            columns[key] = pd.Categorical(column)
+        return columns
+
+def build_features(ids, types, geoms, tag_table, rows):
+    """
+    Build the feature table from the columns of the parsed elements.
+
+    Parameters
+    ----------
+    ids: array_like of int
+        osm id of every feature
+    types: array_like of int
+        element type code of every feature (see settings.ELEMENT_TYPE_CODES)
+    geoms: array_like of shapely geometries
+        geometry of every feature
+    tag_table: _TagTable
+        tags of the parsed elements
+    rows: array_like of int
+        row of every feature in the tag table
+    Returns
+    -------
+    features: geopandas.GeoDataFrame
+    """
+    import geopandas as gpd
+    columns = {
+        'osm_id': np.asarray(ids, dtype=np.int64),
+        'osm_type': np.asarray(types, dtype=np.int8),
+        **tag_table.to_dict(rows)
+    }
+    return gpd.GeoDataFrame(columns, geometry=np.asarray(geoms, dtype=object), crs=DEFAULT_CRS)
+
+def elements_to_geometries(elements):
+    """
+    Build the geometries of the ways and multipolygon relations from Overpass API elements
+    (see elements_to_features).
+
+    Returns
+    -------
+    geoms: list of shapely geometries
+    """
+    return list(elements_to_features(elements, tags=[]).geometry)
+
+def elements_to_features(elements, tags=None):
+    """
+    Build the feature table of the ways and multipolygon relations from Overpass API elements.
+
+    Elements are consumed one at a time and only the node table (ids and coordinates), the
+    flattened node ids of the ways, the members of the multipolygon relations and the
+    selected tags are kept, in compact arrays, so a streamed response never needs to be held
+    in memory. Ways with an inline geometry (`out geom;`) keep their coordinates instead and
+    do not need the node table.
+
+    Closed ways tagged as areas (see utils_polygon.is_area) become polygons and the rest of
+    the ways line strings. Multipolygon relations are assembled into multipolygons with holes
+    and their untagged member ways, which only carry the geometry of the relation, are dropped.
+
+    Parameters
+    ----------
+    elements: iterable of dict
+        nodes, ways and relations retrieved from the overpass API
+    tags: list of strings
+        tags to keep as columns. If None, all the tags are kept.
+    Returns
+    -------
+    features: geopandas.GeoDataFrame
+        osm_id, osm_type code, tag columns (pandas categoricals) and geometry of every feature
+    """
+    tag_table = _TagTable(tags)
+    node_ids = array('q')
+    node_lons = array('d')
+    node_lats = array('d')
+    way_ids = array('q')
+    way_lengths = array('q')
+    way_node_ids = array('q')
+    way_areas = array('b')
+    way_tagged = array('b')
+    way_rows = array('q')
+    geom_ids = array('q')
+    geom_lengths = array('q')
+    geom_lons = array('d')
+    geom_lats = array('d')
+    geom_areas = array('b')
+    geom_tagged = array('b')
+    geom_rows = array('q')
+    relation_ids = array('q')
+    relation_rows = array('q')
+    relations = []
+    seen = set()
+    for el in elements:
         if el['type'] == 'node':
             # Save nodes as points
-            nodes_xy[el['id']] = (el['lon'], el['lat'])
-        if el['type'] == 'way':
-            # Save ways as lists of their node IDs
-            ways[el['id']] = el['nodes']
+            node_ids.append(el['id'])
+            node_lons.append(el['lon'])
+            node_lats.append(el['lat'])
+        elif el['type'] == 'way' and el['id'] not in seen:
+            seen.add(el['id'])
+            el_tags = el.get('tags')
+            if 'geometry' in el:
+                # Save ways with inline geometry as their coordinates, skipping missing nodes
+                coords = [point for point in el['geometry'] if point]
+                geom_ids.append(el['id'])
+                geom_lengths.append(len(coords))
+                geom_lons.extend(point['lon'] for point in coords)
+                geom_lats.extend(point['lat'] for point in coords)
+                geom_areas.append(is_area(el_tags))
+                geom_tagged.append(bool(el_tags))
+                geom_rows.append(tag_table.append(el_tags))
+            else:
+                # Save ways as their number of nodes and node IDs
+                way_ids.append(el['id'])
+                way_lengths.append(len(el['nodes']))
+                way_node_ids.extend(el['nodes'])
+                way_areas.append(is_area(el_tags))
+                way_tagged.append(bool(el_tags))
+                way_rows.append(tag_table.append(el_tags))
+        elif el['type'] == 'relation' and is_area_relation(el.get('tags')) and ('relation', el['id']) not in seen:
+            # Save multipolygons as the role and way id (or inline coordinates) of their members
+            seen.add(('relation', el['id']))
+            relation_ids.append(el['id'])
+            relation_rows.append(tag_table.append(el['tags']))
+            relations.append([
+                (member.get('role', ''), member['ref'], _get_member_coords(member))
+                for member in el.get('members', []) if member['type'] == 'way'
+            ])
 
-    # Create line strings from lists of nodes
-    
-    ########
-    # TODO: Add simplification logic here
-    #  e.g. remove duplicate points, etc.
-    # TODO: Add cleaning for polygons
-    try:
-        geoms = []
-        for way_nodes in ways.values():
-            try:
-                line_ = LineString([nodes_xy[n] for n in way_nodes])
-                geoms.append(line_)
-            except:
-                print(f'{way_nodes} failed!')
-    except:
-        geoms = None
+    coords, lengths = ways_to_coords(node_ids, node_lons, node_lats, way_lengths, way_node_ids)
+    ids = np.concatenate([np.asarray(way_ids, dtype=np.int64), np.asarray(geom_ids, dtype=np.int64)])
+    coords = np.concatenate([coords, np.column_stack([
+        np.asarray(geom_lons, dtype=np.float64), np.asarray(geom_lats, dtype=np.float64)
+    ])])
+    lengths = np.concatenate([lengths, np.asarray(geom_lengths, dtype=np.int64)])
+    areas = np.concatenate([np.asarray(way_areas, dtype=bool), np.asarray(geom_areas, dtype=bool)])
+    tagged = np.concatenate([np.asarray(way_tagged, dtype=bool), np.asarray(geom_tagged, dtype=bool)])
+    rows = np.concatenate([np.asarray(way_rows, dtype=np.int64), np.asarray(geom_rows, dtype=np.int64)])
+
+    geoms = coords_to_geometries(coords, lengths, areas)
+    multipolygons, member_ids = relations_to_multipolygons(relations, ids, coords, lengths)
+
+    # drop the untagged ways that are only the outline of a multipolygon
+    keep = np.array([geom is not None for geom in geoms], dtype=bool)
+    if member_ids:
+        keep &= tagged | ~np.isin(ids, np.fromiter(member_ids, dtype=np.int64))
+    assembled = np.array([geom is not None for geom in multipolygons], dtype=bool)
+
+    return build_features(
+        np.concatenate([ids[keep], np.asarray(relation_ids, dtype=np.int64)[assembled]]),
+        np.concatenate([
+            np.full(keep.sum(), ELEMENT_TYPE_CODES['way']),
+            np.full(assembled.sum(), ELEMENT_TYPE_CODES['relation'])
+        ]),
+        np.concatenate([geoms[keep], np.asarray(multipolygons, dtype=object)[assembled]]),
+        tag_table,
+        np.concatenate([rows[keep], np.asarray(relation_rows, dtype=np.int64)[assembled]])
+    )
+
+def _get_member_coords(member):
+    """
+    Return the inline coordinates of a relation member (`out geom;`), None if it has none.
+    """
+    if 'geometry' not in member:
+        return None
+    return np.array([(point['lon'], point['lat']) for point in member['geometry'] if point], dtype=np.float64)
+
+def ways_to_coords(node_ids, node_lons, node_lats, way_lengths, way_node_ids):
+    """
+    Look up the coordinates of the nodes of the ways.
+
+    The node table is kept in sorted NumPy arrays and the node ids of all the ways are looked
+    up at once with searchsorted. Ways referencing missing nodes get no coordinates.
+
+    Parameters
+    ----------
+    node_ids: array_like of int
+        ids of the nodes
+    node_lons: array_like of float
+        longitude of the nodes
+    node_lats: array_like of float
+        latitude of the nodes
+    way_lengths: array_like of int
+        number of nodes of every way
+    way_node_ids: array_like of int
+        node ids of all the ways, one way after the other
+    Returns
+    -------
+    coords: numpy.ndarray
+        (n, 2) coordinates of all the ways, one way after the other
+    lengths: numpy.ndarray
+        number of coordinates of every way, 0 if any of its nodes is missing
+    """
+    lengths = np.asarray(way_lengths, dtype=np.int64)
+    flat_ids = np.asarray(way_node_ids, dtype=np.int64)
+    if not len(lengths) or not len(node_ids):
+        return np.empty((0, 2), dtype=np.float64), np.zeros(len(lengths), dtype=np.int64)
+
+    # node table sorted by id
+    ids = np.asarray(node_ids, dtype=np.int64)
+    coords = np.column_stack([np.asarray(node_lons, dtype=np.float64), np.asarray(node_lats, dtype=np.float64)])
+    order = np.argsort(ids, kind='stable')
+    ids = ids[order]
+    coords = coords[order]
+
+    # way index of every node of the flattened node ids
+    way_index = np.repeat(np.arange(len(lengths)), lengths)
+
+    # look up every node of every way in the node table
+    positions = np.searchsorted(ids, flat_ids)
+    positions[positions == len(ids)] = 0
+    found = ids[positions] == flat_ids
+
+    valid = np.ones(len(lengths), dtype=bool)
+    valid[way_index[~found]] = False
+    mask = valid[way_index]
+    return coords[positions[mask]], np.where(valid, lengths, 0)
+
+def coords_to_geometries(coords, lengths, areas):
+    """
+    Build the geometry of every way from its flattened coordinates: a polygon for the closed
+    ways that are areas and a line string for the rest, all of them in bulk with shapely 2.
+
+    Parameters
+    ----------
+    coords: numpy.ndarray
+        (n, 2) coordinates of all the ways, one way after the other
+    lengths: numpy.ndarray
+        number of coordinates of every way
+    areas: numpy.ndarray
+        whether every way is an area if it is closed
+    Returns
+    -------
+    geoms: numpy.ndarray
+        geometry of every way, None for the ways with less than two coordinates
+    """
+    geoms = np.full(len(lengths), None, dtype=object)
+    if not len(lengths):
+        return geoms
+    offsets = np.concatenate([[0], np.cumsum(lengths)])
+    way_index = np.repeat(np.arange(len(lengths)), lengths)
+
+    valid = lengths >= 2
+    closed = np.zeros(len(lengths), dtype=bool)
+    rings = lengths >= 4
+    closed[rings] = (coords[offsets[:-1][rings]] == coords[offsets[1:][rings] - 1]).all(axis=1)
+    polygons = valid & closed & areas
+    lines = valid & ~polygons
+
+    for selected, build in ((lines, shapely.linestrings), (polygons, shapely.linearrings)):
+        if not selected.any():
+            continue
+        mask = selected[way_index]
+        # consecutive indices for the selected ways, as required by the shapely constructors
+        new_index = np.cumsum(selected) - 1
+        built = build(coords[mask], indices=new_index[way_index[mask]])
+        geoms[selected] = shapely.polygons(built) if build is shapely.linearrings else built
     return geoms
 
+def relations_to_multipolygons(relations, way_ids, coords, lengths):
+    """
+    Assemble the multipolygons of the relations from the coordinates of their member ways.
+
+    Parameters
+    ----------
+    relations: list of lists
+        role, way id and inline coordinates (or None) of the members of every relation
+    way_ids: numpy.ndarray
+        ids of the ways
+    coords: numpy.ndarray
+        (n, 2) coordinates of all the ways, one way after the other
+    lengths: numpy.ndarray
+        number of coordinates of every way
+    Returns
+    -------
+    multipolygons: list of shapely.geometry.MultiPolygon
+        multipolygon of every relation, None if it could not be assembled
+    member_ids: set
+        ids of the member ways of the assembled multipolygons
+    """
+    multipolygons = []
+    member_ids = set()
+    if not relations:
+        return multipolygons, member_ids
+    offsets = np.concatenate([[0], np.cumsum(lengths)])
+    way_index = {way_id: i for i, way_id in enumerate(way_ids.tolist())}
+    for members in relations:
+        member_coords = []
+        for role, ref, inline in members:
+            if inline is not None:
+                member_coords.append((role, inline))
+            elif ref in way_index:
+                i = way_index[ref]
+                member_coords.append((role, coords[offsets[i]:offsets[i + 1]]))
+        multipolygon = assemble_multipolygon(member_coords)
+        multipolygons.append(multipolygon)
+        if multipolygon is not None:
+            member_ids.update(ref for _, ref, _ in members)
+    return multipolygons, member_ids
+
+def elements_to_point_features(elements, tags=None):
+    """
+    Build the feature table of the elements as points: nodes by their coordinates and ways
+    and relations by their center.
+
+    Parameters
+    ----------
+    elements: iterable of dict
+        elements retrieved from the overpass API
+    tags: list of strings
+        tags to keep as columns. If None, all the tags are kept.
+    Returns
+    -------
+    features: geopandas.GeoDataFrame
+        osm_id, osm_type code, tag columns (pandas categoricals) and geometry of every feature
+    """
+    tag_table = _TagTable(tags)
+    ids = array('q')
+    types = array('b')
+    lons = array('d')
+    lats = array('d')
+    rows = array('q')
+    seen = set()
+    for el in elements:
+        coords = el if el['type'] == 'node' else el.get('center')
+        if not coords or (el['type'], el['id']) in seen:
+            continue
+        seen.add((el['type'], el['id']))
+        ids.append(el['id'])
+        types.append(ELEMENT_TYPE_CODES[el['type']])
+        lons.append(coords['lon'])
+        lats.append(coords['lat'])
+        rows.append(tag_table.append(el.get('tags')))
+
+    geoms = shapely.points(np.asarray(lons, dtype=np.float64), np.asarray(lats, dtype=np.float64))
+    return build_features(ids, types, geoms, tag_table, rows)
+
+def concat_features(list_gdfs):
+    """
+    Concatenate feature tables keeping the tag columns as categoricals.
+
+    Returns
+    -------
+    features: geopandas.GeoDataFrame or None
+        None if there is no table to concatenate
+    """
+    import pandas as pd
+    if not list_gdfs:
+        return None
+    features = pd.concat(list_gdfs, ignore_index=True)
+    features = features[[column for column in features.columns if column != 'geometry'] + ['geometry']]
+    for column in features.columns:
+        # categoricals with different categories are concatenated as objects
+        if column not in FEATURE_COLUMNS and features[column].dtype == object:
+            features[column] = features[column].astype('category')
+    return features
+
+def drop_duplicate_features(gdf):
+    """
+    Drop the features retrieved more than once, e.g. a way crossing several parts of a
+    split geometry or matching several filters. Features are matched by their osm_type and
+    osm_id with a hash table and the first one is kept.
+
+    Parameters
+    ----------
+    gdf: geopandas.GeoDataFrame
+        feature table (see OSM_response_to_features)
+    Returns
+    -------
+    gdf: geopandas.GeoDataFrame
+    """
+    if gdf is None or gdf.empty or 'osm_id' not in gdf:
+        return gdf
+    duplicated = gdf.duplicated(subset=['osm_type', 'osm_id'])
+    if not duplicated.any():
+        return gdf
+    return gdf[~duplicated.to_numpy()].reset_index(drop=True)
+
+def clip_features(gdf, geometry):
+    """
+    Clip the features to a geometry, e.g. a tile or the original geometry of a query.
+
+    The features are indexed in an STRtree that is queried with the geometry, so only the
+    features that intersect it are tested. Features fully inside the geometry are kept as
+    they are, only the ones crossing its boundary are intersected with it. Features that only
+    touch the geometry (e.g. a line ending on the boundary of a tile) are dropped, points on
+    the boundary are kept.
+
+    Parameters
+    ----------
+    gdf: geopandas.GeoDataFrame
+        feature table (see OSM_response_to_features)
+    geometry: shapely.geometry.Polygon or shapely.geometry.MultiPolygon
+        geometry to clip the features to
+    Returns
+    -------
+    gdf: geopandas.GeoDataFrame
+        features intersecting the geometry, clipped to it
+    """
+    if gdf is None or gdf.empty:
+        return gdf
+    geoms = np.asarray(gdf.geometry.values, dtype=object)
+    tree = shapely.STRtree(geoms)
+    index = np.sort(tree.query(geometry, predicate='intersects'))
+    clipped = geoms[index]
+    boundary = ~shapely.contains_properly(geometry, clipped)
+    clipped[boundary] = shapely.intersection(clipped[boundary], geometry)
+    keep = ~shapely.is_empty(clipped) & (shapely.get_dimensions(clipped) == shapely.get_dimensions(geoms[index]))
+
+    gdf = gdf.iloc[index[keep]].copy()
+    gdf['geometry'] = clipped[keep]
+    return gdf.reset_index(drop=True)
+
+def merge_features(list_gdfs, geometry=None):
+    """
+    Merge the feature tables of several queries: concatenate them, drop the duplicated
+    features and, if a geometry is given, clip them to it.
+
+    Parameters
+    ----------
+    list_gdfs: list of geopandas.GeoDataFrame
+        feature tables (see OSM_response_to_features)
+    geometry: shapely.geometry.Polygon or shapely.geometry.MultiPolygon
+        if not None, geometry to clip the features to (see clip_features)
+    Returns
+    -------
+    features: geopandas.GeoDataFrame or None
+        None if there is no table to merge
+    """
+    features = drop_duplicate_features(concat_features(list_gdfs))
+    if geometry is not None:
+        features = clip_features(features, geometry)
+    return features
+
 def cut_geom(polygon, N):
     """
     Cut geometry in n*2n parts
@@ -239,8 +1199,7 @@ def cut_geom(polygon, N):
     intersected_feats: shapely.geometry.MultiPolygon
         """
     # Get bounds of grid
-    lon_end,lat_start,lon_start,lat_end = polygon.bounds
-    print(lon_end,lat_start,lon_start,lat_end)
+    lon_start,lat_start,lon_end,lat_end = polygon.bounds
 
     num_cells = N * N
     lon_edge = (lon_end - lon_start) / (num_cells ** 0.5)
@@ -261,17 +1220,35 @@ def cut_geom(polygon, N):
             polygon_temp = box(x1, y1, x2, y2)
             polys.append(polygon_temp)
 
-    # Intersects grid against feature
+    # Intersects grid against feature, keeping only the polygonal parts (not touching edges)
     intersected_feats = []
     for p in polys:
         is_intersect = p.intersects(polygon)
         if is_intersect:
             intersection = p.intersection(polygon)
-            intersected_feats.append(intersection)
+            if isinstance(intersection, GeometryCollection):
+                intersection = MultiPolygon([
+                    geom for part in intersection.geoms
+                    for geom in getattr(part, 'geoms', [part]) if isinstance(geom, Polygon)
+                ])
+            if isinstance(intersection, (Polygon, MultiPolygon)) and not intersection.is_empty:
+                intersected_feats.append(intersection)
         
     return intersected_feats
 
-def get_cut_dfs(polygon_list, filters):
+def get_cut_dfs(
+    polygon_list,
+    filters,
+    timeout=180,
+    overpass_endpoint='http://overpass-api.de/api',
+    session=None,
+    cache=None,
+    pause_duration=1,
+    depth=0,
+    max_depth=DEFAULT_MAX_DEPTH,
+    parts=None,
+    output=DEFAULT_OUTPUT
+):
     """
     Iterates over a list of polygons and retrieves the OSM geometries that intersect with them.
     Combines into a single GeoDataFrame.
@@ -279,47 +1256,211 @@ def get_cut_dfs(polygon_list, filters):
     Parameters
     ----------
     polygon_list: List of Shapely Polygons
+    filters: list of strings
+        filters to be used in the query for retrieving osm data from the overpass API
+    session: requests.Session
+        pooled session used for the requests. If None, the default session is used.
+    cache: utils_cache.ResponseCache or bool
+        on-disk cache of responses. If None, the default cache is used. False disables it.
+    pause_duration: int
+        how long to pause in seconds before each request, if None, will query API
+        status endpoint to find when next slot is available
+    depth: int
+        number of times the polygons have already been split
+    max_depth: int
+        maximum number of times a polygon is split in 2x2 parts when its query times out
+    parts: list
+        if a list is given, the final parts queried are appended to it as dicts with their
+        geometry, number of elements retrieved (None if the query failed) and split depth
+    output: string or dict
+        output profile of the queries (see get_output_profile)
     Returns GeoDataFrame
     --------
 
     """
     list_dfs = []
     for geom in polygon_list:
-        response_json = download_OSM(geom,filters)
-        try:
-            if len(response_json) and response_json['elements']:
-                print('Respose_recieved...')
-                    ## Create graph and convert of GeoDataFrame
-                try:
-                    geoms = OSM_response_to_lines(response_json)
-                    #df = get_Lines_gdf(G)
-                    if geoms:
-                        df = gpd.GeoDataFrame(geometry=geoms)
-                        list_dfs.append(df)
-                except:
-                    print('Fail generation of graph... No response')
-        except:
-            if (response_json==None) or ('remark' in response_json):
-                print('response retrieved...')
-                polygon_list = cut_geom(geom, 2)
-                sublist_dfs = get_cut_dfs(polygon_list, filters)
-                list_dfs.append(sublist_dfs)
+        response_json = download_OSM(
+            geom,
+            filters,
+            timeout=timeout,
+            overpass_endpoint=overpass_endpoint,
+            session=session,
+            cache=cache,
+            pause_duration=pause_duration,
+            output=output
+        )
+        if is_complete_response(response_json):
+            if parts is not None:
+                count = sum(len(el['elements']) for el in response_json)
+                parts.append({'geometry': geom, 'count': count, 'depth': depth})
+            df = generate_osm_gdf(response_json, output)
+            if df is not None:
+                list_dfs.append(df)
             else:
-                print('There is no data for this tile')
-    try:         
-       gdf = pd.concat(list_dfs)
-    except:
-       print('no objects to concatenate')
-       gdf = None
+                logger.info('There is no data for this tile')
+        elif depth < max_depth:
+            logger.info('Query failed, cutting the geometry (depth %d)...', depth + 1)
+            get_metrics().observe('split_depth', depth + 1)
+            sublist_dfs = get_cut_dfs(
+                cut_geom(geom, 2),
+                filters,
+                timeout,
+                overpass_endpoint,
+                session,
+                cache,
+                pause_duration,
+                depth=depth + 1,
+                max_depth=max_depth,
+                parts=parts,
+                output=output
+            )
+            if sublist_dfs is not None:
+                list_dfs.append(sublist_dfs)
+        else:
+            logger.warning('Query failed at the maximum split depth %d, skipping the polygon', max_depth)
+            if parts is not None:
+                parts.append({'geometry': geom, 'count': None, 'depth': depth})
+    # a way crossing several parts is retrieved by all of them
+    gdf = merge_features(list_dfs)
+    if gdf is None:
+        logger.info('no objects to concatenate')
     
     return gdf
 
 
+def is_complete_response(response_json):
+    """
+    Check that every response retrieved by download_OSM finished without errors.
+
+    Parameters
+    ----------
+    response_json: list
+        list with the responses retrieved from the overpass API
+    Returns
+    -------
+    complete: bool
+        False if the request failed or any query timed out (came back with a remark)
+    """
+    if response_json is None:
+        return False
+    return all(el is not None and ('elements' in el or 'content' in el) and 'remark' not in el for el in response_json)
+
+def get_output_profile(output=DEFAULT_OUTPUT):
+    """
+    Resolve the output profile of the overpass queries.
+
+    Parameters
+    ----------
+    output: string or dict
+        name of a profile of settings.OUTPUT_PROFILES ('body', 'skel', 'geom', 'geom_skel',
+        'center' or 'csv') or a dict with the name in its 'profile' key and the keys of the
+        profile to override, e.g. {'profile': 'csv', 'tags': ['highway', 'name']} or
+        {'profile': 'body', 'batch': False}
+    Returns
+    -------
+    profile: dict
+        format, recurse, out statement, geometry kind, batch and tags of the profile
+    """
+    if isinstance(output, dict):
+        name = output.get('profile', DEFAULT_OUTPUT)
+        overrides = {key: value for key, value in output.items() if key != 'profile'}
+    else:
+        name, overrides = output, {}
+    if name not in OUTPUT_PROFILES:
+        raise ValueError(f'output profile {name} is not supported. Try with {list(OUTPUT_PROFILES)}')
+    return {'tags': None, **OUTPUT_PROFILES[name], **overrides}
+
+def get_query_settings(timeout=180, output=DEFAULT_OUTPUT):
+    """
+    Build the settings statement of the overpass queries of an output profile.
+
+    The csv format always returns the type, id and coordinates of the elements (the center
+    of ways and relations) and a column for every tag of the profile whitelist.
+    """
+    profile = get_output_profile(output)
+    if profile['format'] == 'csv':
+        columns = ['::type', '::id', '::lat', '::lon'] + [f'"{tag}"' for tag in profile['tags'] or []]
+        return f'[out:csv({",".join(columns)};true)][timeout:{timeout}]'
+    return f'[out:json][timeout:{timeout}]'
+
+def get_query_strings(geometry, filters='', timeout=180, output=DEFAULT_OUTPUT):
+    """
+    Build the Overpass API queries for every filter and every polygon of a geometry. The
+    rectangles are queried by bbox (see get_area_filters).
+
+    Parameters
+    ----------
+    geometry: shapely.geometry.Polygon or shapely.geometry.MultiPolygon
+        geographic boundaries to fetch geometries within
+    filters: list of strings
+        filters to be used in the query for retrieving osm data from the overpass API
+    timeout: int
+        the timeout interval for the overpass query
+    output: string or dict
+        output profile of the queries (see get_output_profile)
+    Returns
+    -------
+    query_strings: list of strings
+        a single union query of every filter and polygon if the profile is batched (see
+        split_batch_response), otherwise one query per filter and polygon
+    """
+    if not geometry.is_valid:
+        logger.warning('Shape does not have a valid geometry')
+    if not isinstance(geometry, (Polygon, MultiPolygon)):
+        logger.warning('Geometry must be a shapely Polygon or MultiPolygon.')
+        
+    area_filters = get_area_filters(geometry)
+    logger.debug('Geometry coordinates converted into string')
+    profile = get_output_profile(output)
+    overpass_settings = get_query_settings(timeout, profile)
+    recurse = '>;' if profile['recurse'] else ''
+
+    clauses = [
+        f'{_filter}{area_filter};'
+        for _filter in filters
+        for area_filter in area_filters
+    ]
+    if profile['batch']:
+        clauses = [''.join(clauses)]
+    return [f'{overpass_settings};({clause}{recurse});{profile["out"]}' for clause in clauses]
+
+def split_batch_response(response_json, filters, output=DEFAULT_OUTPUT):
+    """
+    Split the response of a batched query back into one response per filter (see
+    utils_filter.split_response), as download_OSM returns them without batching.
+
+    Parameters
+    ----------
+    response_json: dict
+        response of the union query of all the filters
+    filters: list of strings
+        filters of the query
+    output: string or dict
+        output profile of the query (see get_output_profile)
+    Returns
+    -------
+    responses: list of dict
+        one response per filter or, if the response has no tags to match the filters (skel
+        and csv profiles), failed, or the filters cannot be matched, the response as is
+    """
+    profile = get_output_profile(output)
+    has_tags = profile['format'] == 'json' and 'skel' not in profile['out']
+    if len(filters) < 2 or not has_tags or not isinstance(response_json, dict) or \
+            'elements' not in response_json or 'remark' in response_json:
+        return [response_json]
+    return split_response(response_json, filters) or [response_json]
+
 def download_OSM(
     geometry,
     filters='',
     timeout=180,
-    overpass_endpoint='http://overpass-api.de/api'
+    overpass_endpoint='http://overpass-api.de/api',
+    session=None,
+    cache=None,
+    pause_duration=1,
+    output=DEFAULT_OUTPUT,
+    raw=False
 ):
     """
     Request to Overpass API
@@ -334,39 +1475,124 @@ def download_OSM(
     timeout: int
         the timeout interval for the requests library
     overpass_enpoint: string
+    session: requests.Session
+        pooled session used for the requests. If None, the default session is used.
+    cache: utils_cache.ResponseCache or bool
+        on-disk cache of responses. If None, the default cache is used. False disables it.
+    pause_duration: int
+        how long to pause in seconds before each request, if None, will query API
+        status endpoint to find when next slot is available
+    output: string or dict
+        output profile of the queries (see get_output_profile)
+    raw: bool
+        if True the JSON responses are not parsed (see overpass_request) and the responses of
+        batched queries are not split by filter
     Retunrs
     -------
     response_json: dict
         response retrived from the overpass API
     """
-    if not geometry.is_valid:
-        print('Shape does not have a valid geometry')
-    if not isinstance(geometry, (Polygon, MultiPolygon)):
-        print('Geometry must be a shapely Polygon or MultiPolygon.')
-        
-    geometry_coord_str = get_coordinate_string(geometry)
-    print('Geometry coordines converted into string')
-    overpass_settings = f'[out:json][timeout:{timeout}]'
+    query_strings = get_query_strings(geometry, filters, timeout, output)
     
     try:
         response_json = []
-        for _filter in filters:
-            for polygon_coord_str in geometry_coord_str:
-                print(polygon_coord_str)
-                query_str = f'{overpass_settings};({_filter}(poly:"{polygon_coord_str}");>;);out;'
-                print(query_str)
-                print(f'Requesting data within polygon from API in {len(polygon_coord_str)} request(s)')
-                response_j = overpass_request(
-                            query_str, 
-                            timeout=timeout, 
-                            overpass_endpoint=overpass_endpoint
-                        )
+        logger.info('Requesting data within polygon from API in %d request(s)', len(query_strings))
+        for query_str in query_strings:
+            response_j = overpass_request(
+                        query_str, 
+                        pause_duration=pause_duration,
+                        timeout=timeout, 
+                        overpass_endpoint=overpass_endpoint,
+                        session=session,
+                        cache=cache,
+                        raw=raw
+                    )
+            if get_output_profile(output)['batch'] and 'content' not in (response_j or {}):
+                response_json.extend(split_batch_response(response_j, filters, output))
+            else:
                 response_json.append(response_j)
     except:
         response_json = None
     return response_json
 
-def retrieve_osm(geometry, osm_filter, timeout=180, overpass_endpoint='http://overpass-api.de/api'):
+def stream_OSM(
+    geometry,
+    filters='',
+    timeout=180,
+    overpass_endpoint='http://overpass-api.de/api',
+    session=None,
+    cache=None,
+    pause_duration=1,
+    output=DEFAULT_OUTPUT
+):
+    """
+    Request to Overpass API parsing every response into geometries while it is downloaded,
+    so the peak memory is bounded by the node table and not by the whole response.
+
+    Parameters
+    ----------
+    geometry: shapely.geometry.Polygon or shapely.geometry.MultiPolygon
+        geographic boundaries to fetch geometries within
+    filters: list of strings
+        filters to be used in the query for retrieving osm data from the overpass API
+    timeout: int
+        the timeout interval for the requests library
+    overpass_endpoint: string
+        API endpoint to use for the overpass queries
+    session: requests.Session
+        pooled session used for the requests. If None, the default session is used.
+    cache: utils_cache.ResponseCache or bool
+        on-disk cache of responses, only read since streamed responses are not stored.
+    pause_duration: int
+        how long to pause in seconds before each request, if None, will query API
+        status endpoint to find when next slot is available
+    output: string or dict
+        output profile of the queries (see get_output_profile). CSV responses are not streamed.
+    Returns
+    -------
+    osm_gdf: geopandas.GeoDataFrame or None
+        geometries retrieved, None if any of the queries failed or timed out
+    """
+    list_gdfs = []
+    for query_str in get_query_strings(geometry, filters, timeout, output):
+        response_json = overpass_request(
+            query_str,
+            pause_duration=pause_duration,
+            timeout=timeout,
+            overpass_endpoint=overpass_endpoint,
+            session=session,
+            cache=cache,
+            stream=True
+        )
+        if response_json is None:
+            return None
+        try:
+            features = OSM_response_to_features(response_json, output)
+        except IncompleteResponseError:
+            # the remark was read before the geometries of the response were built
+            return None
+        if features is None or not is_complete_response([response_json]):
+            return None
+        if not features.empty:
+            list_gdfs.append(features)
+    if not list_gdfs:
+        return elements_to_features([])
+    return merge_features(list_gdfs)
+
+def retrieve_osm(
+    geometry,
+    osm_filter,
+    timeout=180,
+    overpass_endpoint='http://overpass-api.de/api',
+    session=None,
+    cache=None,
+    pause_duration=1,
+    stream=False,
+    output=DEFAULT_OUTPUT,
+    max_vertices=None,
+    partition_path=None,
+    raw=False
+):
     """
     Retrieves OSM data within a given geometry from the Overpass API.
     
@@ -382,6 +1608,33 @@ def retrieve_osm(geometry, osm_filter, timeout=180, overpass_endpoint='http://ov
         the timeout interval for the HTTP request. Set to 180 by default.
     overpass_endpoint: string
         API endpoint to use for the overpass queries
+    session: requests.Session
+        pooled session used for the requests. If None, the default session is used.
+    cache: utils_cache.ResponseCache or bool
+        on-disk cache of responses. If None, the default cache is used. False disables it.
+    pause_duration: int
+        how long to pause in seconds before each request, if None, will query API
+        status endpoint to find when next slot is available
+    stream: bool
+        if True each response is parsed into geometries while it is downloaded (see
+        stream_OSM) and a geopandas.GeoDataFrame is returned. Requires ijson.
+    output: string or dict
+        output profile of the queries (see get_output_profile), e.g. 'geom' to get the
+        geometry of the ways inline or 'csv' to get only the center and some tags of
+        every element.
+    max_vertices: int
+        if not None, the geometry is simplified to this number of vertices before it is
+        queried (see simplify_geometry). The simplified geometry covers the original one,
+        so the features are filtered with the original geometry (see filter_features) and
+        returned as a geopandas.GeoDataFrame.
+    partition_path: string
+        directory to record the partition of the geometries that time out, so the next run
+        goes straight to its parts (see utils_partition.load_partition), e.g. a directory of
+        the collection. If None, the partitions are not recorded.
+    raw: bool
+        if True the JSON responses are returned unparsed, with their bytes in 'content', to
+        be parsed in a process pool (see utils_parse.ParserPool). Split geometries are still
+        returned as a geopandas.GeoDataFrame. Ignored with max_vertices.
         
     Returns
     -------
@@ -389,24 +1642,69 @@ def retrieve_osm(geometry, osm_filter, timeout=180, overpass_endpoint='http://ov
             response retrieved from overpass API
 
     """
-    print(f"\nFetching OSM")
-    response_json = download_OSM(geometry, filters=osm_filter)
-    try:
-        if ('remark' not in response_json) and (len(response_json[0]['elements']) == 0):
-            print(f'No actual data retrieved')
-        elif len(response_json) and (len(response_json[0]['elements'])>0):
-            print(f'Data retrieve succesfully!')
-    except:
-        if (response_json == None) or ('remark' in response_json):
-            print(f'Cutting the geometry ...')
-            multi_pol = cut_geom(geometry, 2)
-            #response_json = download_OSM(multi_pol, filters=osm_filter)
-            response_json = get_cut_dfs(multi_pol, filters=osm_filter)
-        else:
-            print(f'No data retrieved!')
+    # avoid the partition module import at load time, it depends on this module
+    from .utils_partition import load_partition, save_partition, adaptive_partition
+
+    if max_vertices is not None:
+        response_json = retrieve_osm(
+            simplify_geometry(geometry, max_vertices),
+            osm_filter,
+            timeout=timeout,
+            overpass_endpoint=overpass_endpoint,
+            session=session,
+            cache=cache,
+            pause_duration=pause_duration,
+            stream=stream,
+            output=output,
+            partition_path=partition_path
+        )
+        if response_json is None:
+            return None
+        gdf = generate_osm_gdf(response_json, output)
+        # the simplified geometry covers more than the original one
+        return filter_features(elements_to_features([]) if gdf is None else gdf, geometry)
+
+    logger.info('Fetching OSM')
+    kwargs = dict(
+        timeout=timeout,
+        overpass_endpoint=overpass_endpoint,
+        session=session,
+        cache=cache,
+        pause_duration=pause_duration
+    )
+    # an area that already timed out in a previous run goes straight to its recorded partition
+    partition = load_partition(geometry, osm_filter, partition_path, output, overpass_endpoint)
+    if partition is None and stream:
+        gdf = stream_OSM(geometry, filters=osm_filter, output=output, **kwargs)
+        if gdf is not None:
+            logger.info('Data retrieved successfully!')
+            return gdf
+        logger.info('Cutting the geometry ...')
+        partition = adaptive_partition(geometry, osm_filter, timed_out=True, **kwargs)
+    elif partition is None:
+        response_json = download_OSM(geometry, filters=osm_filter, output=output, raw=raw, **kwargs)
+        if is_complete_response(response_json):
+            if raw or any(len(el['elements']) for el in response_json):
+                logger.info('Data retrieved successfully!')
+            else:
+                logger.info('No actual data retrieved')
+            return response_json
+        logger.info('Cutting the geometry ...')
+        partition = adaptive_partition(geometry, osm_filter, timed_out=True, **kwargs)
+
+    polygon_list = [part['geometry'] for part in partition if part['count'] != 0]
+    logger.info('Retrieving %d parts of the geometry (%d empty)', len(polygon_list), len(partition) - len(polygon_list))
+    if not polygon_list:
+        return elements_to_features([])
+
+    # record the parts that finally worked, including the ones split again after a timeout
+    parts = [part for part in partition if part['count'] == 0]
+    response_json = get_cut_dfs(polygon_list, filters=osm_filter, parts=parts, output=output, **kwargs)
+    if partition_path is not None:
+        save_partition(geometry, osm_filter, parts, partition_path, output, overpass_endpoint)
     return response_json
 
-def generate_osm_gdf(response_json):
+def generate_osm_gdf(response_json, output=DEFAULT_OUTPUT, geometry=None):
     """
     Generate GeoDataFrame from a response retrieved from the overpass API
     
@@ -414,27 +1712,39 @@ def generate_osm_gdf(response_json):
     ----------
     response_json: list
         list with the response retrieved from the overpass API
+    output: string or dict
+        output profile the response was requested with (see get_output_profile)
+    geometry: shapely.geometry.Polygon or shapely.geometry.MultiPolygon
+        if not None, the features are clipped to the geometry (see clip_features)
     
     Return
     ------
     osm_gdf: geopandas.GeoDataFrame
-        response from overpass API in geopandas.GeoDataFrame format
+        response from overpass API in geopandas.GeoDataFrame format, with the osm_id,
+        osm_type code and tag columns of every feature (see OSM_response_to_features).
+        Features in more than one response are kept once.
     
     """
+    import geopandas as gpd
     list_gdfs = []
-    for el in response_json:
-        geoms = OSM_response_to_lines(el)
-        if geoms:
-            gdf = gpd.GeoDataFrame(geometry=geoms)
-            list_gdfs.append(gdf)
-    try:
-        osm_gdf = pd.concat(list_gdfs)
-    except:
-        osm_gdf = None
-        print('Dataframe concatenation failed!')
+    if isinstance(response_json, gpd.GeoDataFrame):
+        # split geometries and streamed responses are already parsed (see retrieve_osm)
+        list_gdfs.append(response_json)
+    else:
+        metrics = get_metrics()
+        for el in response_json:
+            with metrics.timer('parse_seconds'):
+                features = OSM_response_to_features(el, output)
+            if features is not None:
+                metrics.observe('parse_features', len(features))
+            if features is not None and not features.empty:
+                list_gdfs.append(features)
+    osm_gdf = merge_features(list_gdfs, geometry)
+    if osm_gdf is None:
+        logger.info('Dataframe concatenation failed!')
     return osm_gdf
 
-def _to_file(gdf, filename, driver):
+def _to_file(gdf, filename, driver, path=DEFAULT_OUTPUT_DIR):
     """
     Save response geogapdas.GeoDataFrame to local file
     
@@ -442,143 +1752,22 @@ def _to_file(gdf, filename, driver):
     ----------
     gdf: geopandas.GeoDataFrame
         response from overpass API in geopandas.GeoDataFrame format
-    output_path: string
-        File path or file handle to write to.
+    filename: string
+        name of the file to write to.
     driver : string, default: 'ESRI Shapefile'
-        The OGR format driver used to write the vector file.
+        The OGR format driver used to write the vector file, or 'GeoParquet'.
+    path: string
+        output directory. Default: ./data
     """
-    # output_path = kwargs.get('output_path', DEFAULT_PATH)
-    # driver = kwargs.get('driver', DEFAULT_DRIVER)
-    if not os.path.exists('./data'):
-        os.makedirs('./data')
+    # avoid the writer module import at load time, pyarrow is only needed for GeoParquet
+    from .utils_writer import get_writer
+
+    if not os.path.exists(path):
+        os.makedirs(path)
     try:
-        gdf.to_file(f'./data/{filename}', driver=driver)
+        if driver == 'GeoParquet':
+            with get_writer(driver, os.path.join(path, filename)) as writer:
+                writer.write(gdf)
+        else:
+            gdf.to_file(os.path.join(path, filename), driver=driver)
     except: raise ValueError('Local export failed!')
-
-
-    ## TODO - Add in CollectionOsm
-
-    # def retrieve_osmData(manifest, osm_filter, infrastructure,  path):
-    # """
-    # Download OSM ways and nodes within a given geometry from the Overpass API.
-    
-    # Parameters
-    # ----------
-    # manifest: geopandas.GeoDataFrame
-    #         manifest geodataframe.
-    # osm_type: string
-    #     type of filter to retieve if custom_filter is None
-    # infrastructure: string
-    #     infrastructure type that will be use to build the overpas api query (e.g. 'way["highway"]')
-    # custom_filter: string
-    #     a custom filter to be used instead of the already defined in the osm_type
-        
-    # Returns
-    # -------
-    
-    # """
-    # if not os.path.exists(path):
-    #     os.makedirs(path)
-    #     print(f'new directory successfully created it {path}')
-    
-    # tiles_to_process = manifest[manifest.exclude == 0]
-
-    # #once all the tiles have been processed the tiles_to_process will be 0
-    # print(f'Tiles to process: {len(tiles_to_process), len(manifest)}')
-    
-    # for i in range(0, len(tiles_to_process)):
-    #     print(f"{round(100*i/len(tiles_to_process),2)}%")
-    #     entry = tiles_to_process.iloc[i]
-
-    #     tile_id = entry['id']
-    #     polygon = entry['geometry']
-
-    #     # need to define the storage of the retrieved tiles
-    #     export = True
-    #     #upload = True
-    #     successful_export = True if entry['exported'] == 1 else False
-    #     #successful_upload = True if entry['uploaded'] == 1 else False
-    #     exclude = True if entry['exclude'] == 1 else False
-
-    #     # If exclude (i.e. no roads), dont export or upload
-    #     #if exclude or all([successful_export, successful_upload]):
-    #     if exclude or successful_export: 
-    #         export = False
-    #         #upload = False
-
-    #      # If already exported, dont export again
-    #     #elif successful_export and not successful_upload:
-    #     #    export = False
-    #     #    upload = True
-
-    #     if export:
-    #         print(f"\nFetching OSM for {tile_id.replace('_', '/')}\n")
-    #         response_json = download_OSM(polygon,infrastructure=infrastructure,filters=osm_filter)
-
-    #         #print(f'response status: {response_json.status_code}, lenght of response: {len(response_json)}')
-            
-    #         try:
-    #             if ('remark' not in response_json) and (len(response_json['elements']) == 0):
-    #                 print(f'No actual data in {tile_id}')
-
-    #             elif len(response_json) and response_json['elements']>0:
-    #                 print(f'Data retrieve for {tile_id}')
-    #                 ## Create graph and convert of GeoDataFrame
-    #                 geoms = OSM_response_to_lines(response_json)
-    #                 #df = get_Lines_gdf(G)
-    #                 if geoms:
-    #                     df = gpd.GeoDataFrame(geometry=geoms)
-    #                     #df.to_file(f'out.shp')
-
-    #                 ## Attempt temporary LOCAL export
-    #                 try:
-    #                     df.to_csv(f'{path}/{tile_id}.csv', index=False)
-    #                     successful_export = True
-    #                     print('successful exported!')
-
-    #                 except:
-    #                     print('Local export failed')
-    #                     print(f"\nExcluding {tile_id.replace('_', '/')}, no graph produced\n")
-    #                     exclude = False
-    #             # else:
-    #             #     print(f"\nGeneration of graph failed! Excluding {tile_id.replace('_', '/')}, no graph produced\n")
-    #             #     exclude = True
-    #         except:
-    #             # print(f"\nExcluding {tile_id.replace('_', '/')}, no graph produced\n")
-    #             # exclude = True
-    #             if (response_json == None) or ('remark' in response_json):
-    #                 print(f'Cutting the geometry of {tile_id}...')
-    #                 multi_pol = cut_geom(polygon, 2)
-    #                 list_dfs = get_cut_dfs(multi_pol, infrastructure=infrastructure,filters=osm_filter)
-    #                 try:
-    #                     df = pd.concat(list_dfs)
-    #                 except:
-    #                     df = None
-    #                     print('Dataframe concatenation failed!')
-    #                 if df is not None:
-    #                     print('Exporting df...')
-    #                     df.to_csv(f'{path}/{tile_id}.csv', index=False)
-    #                     successful_export = True
-    #                     print('successful exported!')
-    #                 else:
-    #                     print('No data retrieved')
-    #                     successful_export = False
-    #                     print('Tile excluded!')
-    #                     exclude =True
-    #             else:
-    #                 print(f'No data for {tile_id}')
-    #                 print(f"\nExcluding {tile_id.replace('_', '/')}, no graph produced\n")
-    #                 print('Tile excluded!')
-    #                 exclude = True
-
-
-
-                
-    #     ## Update manifest
-    #     index = manifest.index[manifest.id == tile_id].tolist()[0]
-    #     manifest.at[index, 'exclude'] = 1 if exclude else 0
-    #     manifest.at[index, 'exported'] = 1 if successful_export else 0  
-    #     #manifest.at[index, 'uploaded'] = 1 if successful_upload else 0
-        
-    #     return manifest
-
@@ -0,0 +1,181 @@
+"""General util functions to parse Overpass API responses into features in a process pool"""
+import json
+import time
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import shapely
+from .utils_osm import OSM_response_to_features, merge_features
+from .utils_http import add_received_elements
+from .utils_metrics import get_metrics
+from .settings import DEFAULT_CRS, DEFAULT_OUTPUT, DEFAULT_PARSE_WORKERS
+
+
+def features_to_buffers(features):
+    """
+    Pack a feature table into flat buffers that are cheap to send between processes: the
+    osm_id and osm_type arrays, the codes and categories of every tag column and the WKB of
+    all the geometries concatenated with their offsets.
+
+    Parameters
+    ----------
+    features: geopandas.GeoDataFrame
+        feature table (see utils_osm.OSM_response_to_features)
+    Returns
+    -------
+    buffers: dict or None
+        None if features is None
+    """
+    if features is None:
+        return None
+    wkb = shapely.to_wkb(np.asarray(features.geometry.values, dtype=object))
+    offsets = np.zeros(len(wkb) + 1, dtype=np.int64)
+    # missing geometries take no bytes
+    wkb = [b'' if geom is None else geom for geom in wkb]
+    np.cumsum([len(geom) for geom in wkb], out=offsets[1:])
+    tags = {}
+    for column in features.columns:
+        if column in ('osm_id', 'osm_type', 'geometry'):
+            continue
+        values = features[column].astype('category')
+        tags[column] = (values.cat.codes.to_numpy(), values.cat.categories.tolist())
+    return {
+        'osm_id': features['osm_id'].to_numpy(dtype=np.int64),
+        'osm_type': features['osm_type'].to_numpy(dtype=np.int8),
+        'tags': tags,
+        'wkb': b''.join(wkb),
+        'offsets': offsets,
+    }
+
+def buffers_to_features(buffers):
+    """
+    Unpack the buffers of features_to_buffers into a feature table.
+
+    Returns
+    -------
+    features: geopandas.GeoDataFrame or None
+        None if buffers is None
+    """
+    import geopandas as gpd
+    import pandas as pd
+    if buffers is None:
+        return None
+    wkb, offsets = memoryview(buffers['wkb']), buffers['offsets']
+    geoms = np.empty(len(offsets) - 1, dtype=object)
+    geoms[:] = [
+        wkb[start:stop].tobytes() if stop > start else None
+        for start, stop in zip(offsets[:-1].tolist(), offsets[1:].tolist())
+    ]
+    columns = {'osm_id': buffers['osm_id'], 'osm_type': buffers['osm_type']}
+    for column, (codes, categories) in buffers['tags'].items():
+        columns[column] = pd.Categorical.from_codes(codes, categories=categories)
+    return gpd.GeoDataFrame(columns, geometry=shapely.from_wkb(geoms), crs=DEFAULT_CRS)
+
+def parse_content(content, output=DEFAULT_OUTPUT):
+    """
+    Parse the bytes of an Overpass API JSON response into the buffers of its feature table
+    (see features_to_buffers). This is the task run by the workers of ParserPool.
+
+    Parameters
+    ----------
+    content: bytes
+        body of the response (see utils_osm.overpass_request with raw=True)
+    output: string or dict
+        output profile the response was requested with (see utils_osm.get_output_profile)
+    Returns
+    -------
+    buffers: dict or None
+        None if the response could not be parsed. The number of elements of the response
+        and the seconds spent parsing it are returned in 'elements' and 'elapsed', as the
+        counters and metrics of the worker process are not shared.
+    """
+    start = time.perf_counter()
+    try:
+        response_json = json.loads(content)
+    except ValueError:
+        return None
+    buffers = features_to_buffers(OSM_response_to_features(response_json, output))
+    if buffers is not None:
+        buffers['elements'] = len(response_json.get('elements', []))
+        buffers['elapsed'] = time.perf_counter() - start
+    return buffers
+
+class ParserPool:
+    """
+    Pool of processes that parse the raw responses of the Overpass API and build their
+    geometries, so the parsing is not bound to a single core by the GIL while the download
+    threads wait for the network.
+
+    The responses are sent to the workers as bytes and the features come back as WKB and
+    numpy buffers (see features_to_buffers), never as pickled shapely objects. The pool can
+    be shared by the download threads.
+
+    Parameters
+    ----------
+    workers: int
+        number of processes. If None, the number of CPUs.
+    output: string or dict
+        output profile the responses are requested with (see utils_osm.get_output_profile)
+
+    Usage
+    -----
+    with ParserPool(workers=8) as parser:
+        gdf = parser.parse(retrieve_osm(geometry, osm_filter, raw=True))
+    """
+    def __init__(self, workers=DEFAULT_PARSE_WORKERS, output=DEFAULT_OUTPUT):
+
+        self.output = output
+        # the workers are spawned, forking the download threads and their sockets is unsafe
+        self.executor = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        self.executor.shutdown()
+
+    def submit(self, content):
+        """
+        Parse the bytes of a response in the pool.
+
+        Returns
+        -------
+        future: concurrent.futures.Future
+            future of the buffers of the feature table (see parse_content)
+        """
+        return self.executor.submit(parse_content, content, self.output)
+
+    def parse(self, response_json, geometry=None):
+        """
+        Parse the responses of utils_osm.retrieve_osm into a feature table, as
+        utils_osm.generate_osm_gdf does. Raw responses are parsed in the pool and the ones
+        already parsed (e.g. CSV responses) in the calling thread.
+
+        Parameters
+        ----------
+        response_json: list or geopandas.GeoDataFrame
+            responses retrieved from the overpass API, a GeoDataFrame is returned as is
+        geometry: shapely.geometry.Polygon or shapely.geometry.MultiPolygon
+            if not None, the features are clipped to the geometry (see utils_osm.clip_features)
+        Returns
+        -------
+        osm_gdf: geopandas.GeoDataFrame or None
+            None if no response could be parsed or they have no features
+        """
+        if not isinstance(response_json, list):
+            return merge_features([response_json], geometry)
+        metrics = get_metrics()
+        futures = [self.submit(el['content']) for el in response_json if 'content' in el]
+        list_gdfs = [OSM_response_to_features(el, self.output) for el in response_json if 'content' not in el]
+        for future in futures:
+            buffers = future.result()
+            if buffers is not None:
+                add_received_elements(buffers['elements'])
+                metrics.observe('request_elements', buffers['elements'])
+                metrics.observe('parse_seconds', buffers['elapsed'])
+                metrics.observe('parse_features', len(buffers['osm_id']))
+            list_gdfs.append(buffers_to_features(buffers))
+        return merge_features([gdf for gdf in list_gdfs if gdf is not None and not gdf.empty], geometry)
@@ -0,0 +1,213 @@
+"""General util functions to split a geometry in parts that the Overpass API can answer"""
+import os
+import re
+import json
+import math
+import hashlib
+import logging
+import requests
+from shapely import wkt
+from .utils_osm import overpass_request, get_area_filters, cut_geom, get_output_profile
+from .utils_metrics import get_metrics
+from .settings import DEFAULT_TIMEOUT, DEFAULT_OVERPASS_ENDPOINT, DEFAULT_MAX_ELEMENTS, DEFAULT_MAX_DEPTH, \
+    DEFAULT_MAX_SPLIT, DEFAULT_MAX_PARTS, DEFAULT_OUTPUT
+
+logger = logging.getLogger(__name__)
+# remarks of the queries that are too dense to be answered by the server
+_TIMEOUT_REMARK_RE = re.compile(r'timed out|out of memory', re.IGNORECASE)
+
+def count_elements(
+    geometry,
+    filters,
+    timeout=DEFAULT_TIMEOUT,
+    overpass_endpoint=DEFAULT_OVERPASS_ENDPOINT,
+    session=None,
+    cache=None,
+    pause_duration=1
+):
+    """
+    Count the elements matching the filters within a geometry with a single `out count;` query.
+
+    Parameters
+    ----------
+    geometry: shapely.geometry.Polygon or shapely.geometry.MultiPolygon
+        geographic boundaries to count the elements within
+    filters: list of strings
+        filters to be used in the query for retrieving osm data from the overpass API
+    Returns
+    -------
+    count: int or None
+        number of elements, None if the count query timed out (i.e. the area is too dense)
+    Raises
+    ------
+    ValueError
+        if the count query failed for any other reason or its response cannot be read
+    requests.RequestException
+        if the server cannot be reached
+    """
+    clauses = ''.join(
+        f'{_filter}{area_filter};'
+        for _filter in filters
+        for area_filter in get_area_filters(geometry)
+    )
+    query_str = f'[out:json][timeout:{timeout}];({clauses});out count;'
+    response_json = overpass_request(
+        query_str,
+        pause_duration=pause_duration,
+        timeout=timeout,
+        overpass_endpoint=overpass_endpoint,
+        session=session,
+        cache=cache
+    )
+    if response_json is None:
+        raise ValueError('the count query failed')
+    if 'remark' in response_json:
+        if _TIMEOUT_REMARK_RE.search(response_json['remark']):
+            return None
+        raise ValueError(f'the count query failed: {response_json["remark"]}')
+    try:
+        return int(response_json['elements'][0]['tags']['total'])
+    except (KeyError, IndexError, TypeError, ValueError) as e:
+        raise ValueError(f'invalid count response: {e!r}')
+
+def adaptive_partition(
+    geometry,
+    filters,
+    max_elements=DEFAULT_MAX_ELEMENTS,
+    max_depth=DEFAULT_MAX_DEPTH,
+    max_split=DEFAULT_MAX_SPLIT,
+    max_parts=DEFAULT_MAX_PARTS,
+    timed_out=False,
+    path=None,
+    output=DEFAULT_OUTPUT,
+    **kwargs
+):
+    """
+    Split a geometry in parts small enough to be retrieved from the Overpass API.
+
+    The number of elements of every part is estimated with a cheap `out count;` query and the
+    split factor is chosen from its density, so dense areas are cut deeper at once while empty
+    areas are not split at all. A part whose count times out is cut in 2x2. A part whose count
+    fails for any other reason (e.g. the server is down) is not split, so an unreachable
+    server does not cost a count query for every part down to max_depth.
+
+    Parameters
+    ----------
+    geometry: shapely.geometry.Polygon or shapely.geometry.MultiPolygon
+        geographic boundaries to split
+    filters: list of strings
+        filters to be used in the query for retrieving osm data from the overpass API
+    max_elements: int
+        maximum number of elements in a part
+    max_depth: int
+        maximum number of times a part is split
+    max_split: int
+        maximum number of cuts per side in a single split (i.e. max_split*max_split parts)
+    max_parts: int
+        maximum number of parts of the partition. Once reached, the parts are not split again.
+    timed_out: bool
+        if True the query of the whole geometry is known to time out, so the element count
+        of the geometry is taken as an upper bound for the parts.
+    path: string
+        directory to record the partition (see load_partition). If None, it is not recorded.
+    output: string or dict
+        output profile the parts are retrieved with, part of the key of the recorded partition
+    **kwargs
+        timeout, overpass_endpoint, session, cache and pause_duration of the count queries
+
+    Returns
+    -------
+    partition: list of dict
+        parts with their geometry, element count (None if unknown) and split depth
+    """
+    total = 1
+
+    def split(part, depth):
+        nonlocal max_elements, total
+        try:
+            count = count_elements(part, filters, **kwargs)
+        except (requests.RequestException, ValueError) as e:
+            logger.warning('Count query failed, the part is not split: %r', e)
+            return [{'geometry': part, 'count': None, 'depth': depth}]
+        if timed_out and depth == 0 and count:
+            max_elements = min(max_elements, max(count // 2, 1))
+        if depth >= max_depth or (count is not None and count <= max_elements):
+            return [{'geometry': part, 'count': count, 'depth': depth}]
+        # when the count itself times out the part is too dense to estimate, cut it in 2x2
+        n = 2 if count is None else min(max(math.ceil(math.sqrt(count / max_elements)), 2), max_split)
+        if total + n * n - 1 > max_parts:
+            logger.warning('The partition reached %d parts, the part is not split', total)
+            return [{'geometry': part, 'count': count, 'depth': depth}]
+        total += n * n - 1
+        logger.info('Splitting part with %s elements in %dx%d (depth %d)', count, n, n, depth + 1)
+        get_metrics().observe('split_depth', depth + 1)
+        parts = []
+        for subpart in cut_geom(part, n):
+            parts.extend(split(subpart, depth + 1))
+        return parts
+
+    partition = split(geometry, 0)
+    if path is not None:
+        overpass_endpoint = kwargs.get('overpass_endpoint', DEFAULT_OVERPASS_ENDPOINT)
+        save_partition(geometry, filters, partition, path, output, overpass_endpoint)
+    return partition
+
+def get_partition_filename(
+    geometry,
+    filters,
+    path,
+    output=DEFAULT_OUTPUT,
+    overpass_endpoint=DEFAULT_OVERPASS_ENDPOINT
+):
+    """
+    Build the filename of the partition recorded for a geometry, filters, output profile and
+    endpoint. The same area can be too dense for one profile (e.g. body) and not for another
+    (e.g. center), and the servers have different limits.
+    """
+    key = '\n'.join([
+        wkt.dumps(geometry, rounding_precision=6),
+        *filters,
+        json.dumps(get_output_profile(output), sort_keys=True),
+        overpass_endpoint.rstrip('/')
+    ])
+    return os.path.join(path, f'{hashlib.sha256(key.encode("utf-8")).hexdigest()}.json')
+
+def save_partition(
+    geometry,
+    filters,
+    partition,
+    path,
+    output=DEFAULT_OUTPUT,
+    overpass_endpoint=DEFAULT_OVERPASS_ENDPOINT
+):
+    """
+    Record the partition of a geometry and filters in a json file of the directory path.
+    """
+    os.makedirs(path, exist_ok=True)
+    parts = [{**part, 'geometry': part['geometry'].wkt} for part in partition]
+    with open(get_partition_filename(geometry, filters, path, output, overpass_endpoint), 'w') as f:
+        json.dump(parts, f)
+
+def load_partition(
+    geometry,
+    filters,
+    path,
+    output=DEFAULT_OUTPUT,
+    overpass_endpoint=DEFAULT_OVERPASS_ENDPOINT
+):
+    """
+    Load the partition recorded for a geometry and filters with an output profile and endpoint.
+
+    Returns
+    -------
+    partition: list of dict or None
+        None if the area has not been partitioned before or path is None
+    """
+    if path is None:
+        return None
+    filename = get_partition_filename(geometry, filters, path, output, overpass_endpoint)
+    if not os.path.exists(filename):
+        return None
+    with open(filename) as f:
+        parts = json.load(f)
+    return [{**part, 'geometry': wkt.loads(part['geometry'])} for part in parts]
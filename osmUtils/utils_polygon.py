@@ -0,0 +1,147 @@
+"""General util functions to assemble the areas of the OSM ways and relations"""
+from collections import defaultdict
+import numpy as np
+import shapely
+from shapely.geometry import Polygon, MultiPolygon
+from .settings import DEFAULT_AREA_TAGS, DEFAULT_AREA_RELATIONS
+
+
+def is_area(tags, area_tags=DEFAULT_AREA_TAGS):
+    """
+    Check whether the tags of a closed way describe an area instead of a line.
+
+    Parameters
+    ----------
+    tags: dict
+        tags of the way
+    area_tags: dict
+        tags that make a closed way an area (see settings.DEFAULT_AREA_TAGS)
+    Returns
+    -------
+    area: bool
+    """
+    if not tags or tags.get('area') == 'no':
+        return False
+    if tags.get('area') == 'yes':
+        return True
+    for key, value in tags.items():
+        if key not in area_tags:
+            continue
+        rule = area_tags[key]
+        if rule is None:
+            return True
+        if 'include' in rule and value in rule['include']:
+            return True
+        if 'exclude' in rule and value not in rule['exclude']:
+            return True
+    return False
+
+def is_area_relation(tags, area_relations=DEFAULT_AREA_RELATIONS):
+    """
+    Check whether a relation is a multipolygon to assemble from its member ways.
+    """
+    return bool(tags) and tags.get('type') in area_relations
+
+def assemble_rings(segments):
+    """
+    Join way segments into closed rings by matching their endpoints.
+
+    The endpoints of the open segments are indexed in a dict, so every segment is joined
+    to the next one in constant time instead of searching all the pairs. Segments that do
+    not close a ring are dropped.
+
+    Parameters
+    ----------
+    segments: list of numpy.ndarray
+        (n, 2) coordinates of every way
+    Returns
+    -------
+    rings: list of numpy.ndarray
+        (n, 2) coordinates of every closed ring
+    """
+    rings = []
+    open_segments = {}
+    endpoints = defaultdict(list)
+    for i, segment in enumerate(segments):
+        if len(segment) < 2:
+            continue
+        start, end = tuple(segment[0]), tuple(segment[-1])
+        if start == end:
+            if len(segment) >= 4:
+                rings.append(segment)
+            continue
+        open_segments[i] = segment
+        endpoints[start].append(i)
+        endpoints[end].append(i)
+
+    while open_segments:
+        i, segment = open_segments.popitem()
+        start, end = tuple(segment[0]), tuple(segment[-1])
+        endpoints[start].remove(i)
+        endpoints[end].remove(i)
+        parts = [segment]
+        while start != end and endpoints[end]:
+            j = endpoints[end].pop()
+            segment = open_segments.pop(j)
+            if tuple(segment[0]) != end:
+                segment = segment[::-1]
+            endpoints[tuple(segment[-1])].remove(j)
+            parts.append(segment[1:])
+            end = tuple(segment[-1])
+        if start == end:
+            ring = np.concatenate(parts)
+            if len(ring) >= 4:
+                rings.append(ring)
+    return rings
+
+def rings_to_multipolygon(outer_rings, inner_rings):
+    """
+    Build a multipolygon from its outer and inner rings, every inner ring being a hole of
+    the outer ring that contains it.
+
+    Parameters
+    ----------
+    outer_rings: list of numpy.ndarray
+        (n, 2) coordinates of the outer rings
+    inner_rings: list of numpy.ndarray
+        (n, 2) coordinates of the inner rings
+    Returns
+    -------
+    multipolygon: shapely.geometry.MultiPolygon or None
+        None if there is no outer ring
+    """
+    if not outer_rings:
+        return None
+    outers = [Polygon(ring) for ring in outer_rings]
+    holes = [[] for _ in outers]
+    if inner_rings:
+        points = [Polygon(ring).representative_point() for ring in inner_rings]
+        if len(outers) == 1:
+            pairs = [(k, 0) for k in range(len(points))]
+        else:
+            tree = shapely.STRtree(outers)
+            pairs = zip(*tree.query(points, predicate='within'))
+        assigned = set()
+        for k, i in pairs:
+            if k not in assigned:
+                assigned.add(k)
+                holes[i].append(inner_rings[k])
+    return MultiPolygon([Polygon(ring, holes[i]) for i, ring in enumerate(outer_rings)])
+
+def assemble_multipolygon(members):
+    """
+    Assemble the multipolygon of a relation from the coordinates of its member ways.
+
+    Parameters
+    ----------
+    members: list of tuples
+        role and (n, 2) coordinates of every member way. Members without role are taken
+        as outer.
+    Returns
+    -------
+    multipolygon: shapely.geometry.MultiPolygon or None
+        None if no outer ring can be closed
+    """
+    outer = [coords for role, coords in members if role in ('outer', '')]
+    inner = [coords for role, coords in members if role == 'inner']
+    return rings_to_multipolygon(assemble_rings(outer), assemble_rings(inner))
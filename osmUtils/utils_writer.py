@@ -0,0 +1,367 @@
+"""General util functions to write the features of the tiles to a single file as they are retrieved"""
+import os
+import glob
+import json
+import threading
+from abc import ABC, abstractmethod
+import numpy as np
+import shapely
+from .settings import DEFAULT_CRS, FEATURE_COLUMNS, DEFAULT_FILE_EXTENSIONS, STREAMING_DRIVERS
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+    pq = None
+
+OTHER_TAGS = 'other_tags'
+
+
+class TileWriter(ABC):
+    """
+    Writer that appends the feature table of every tile to a single file.
+
+    The columns of the file are fixed when it is created: osm_id, osm_type, the tag columns
+    and other_tags, where the tags of a tile without a column of their own are kept as a
+    JSON object. Writes are serialized, so the writer can be shared by the download workers.
+
+    A file is only readable once it is closed. With tiles_per_part the writer closes the
+    current file every so many tiles and goes on with a new part (see get_part_filename), so
+    an interrupted download only loses the tiles of the open part. The tiles of the closed
+    parts are returned by pop_committed. The features of the files of an interrupted download
+    are recorded with add_seen, so a resumed download does not write them again.
+
+    Parameters
+    ----------
+    path: string
+        path of the output file
+    columns: list of strings
+        tag columns of the file. If None, the tag columns of the first tile written are used.
+    unique: bool
+        if True, the features already written by a previous tile (e.g. a way crossing several
+        tiles) are skipped. Their osm_type and osm_id are kept in a set.
+    tiles_per_part: int
+        if not None, number of tiles written to every part of the file
+    """
+    def __init__(self, path, columns=None, unique=True, tiles_per_part=None):
+
+        self.path = path
+        self.paths = [path]
+        self.columns = None if columns is None else list(columns)
+        self.unique = unique
+        self.tiles_per_part = tiles_per_part
+        self.features = 0
+        self.tiles = 0
+        self._seen = set()
+        self._pending = []
+        self._committed = []
+        self._lock = threading.Lock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def write(self, gdf, tile_id=None):
+        """
+        Append the features of a tile to the file.
+
+        Parameters
+        ----------
+        gdf: geopandas.GeoDataFrame
+            feature table of the tile (see utils_osm.OSM_response_to_features)
+        tile_id: string
+            id of the tile, returned by pop_committed once its part is closed
+        """
+        with self._lock:
+            if self.unique and gdf is not None and 'osm_id' in gdf:
+                gdf = self.drop_seen(gdf)
+            if gdf is not None and not gdf.empty:
+                if self.columns is None:
+                    self.columns = [column for column in gdf.columns if column not in FEATURE_COLUMNS]
+                self._write(self.conform(gdf))
+                self.features += len(gdf)
+                self.tiles += 1
+            if tile_id is not None:
+                self._pending.append(tile_id)
+            if self.tiles_per_part and len(self._pending) >= self.tiles_per_part:
+                self._close()
+                self._commit()
+                self.path = get_part_filename(self.paths[0], self.paths)
+                self.paths.append(self.path)
+                self._open()
+
+    def pop_committed(self):
+        """
+        Return the ids of the tiles written to a closed (and readable) part since the last call.
+        """
+        with self._lock:
+            committed, self._committed = self._committed, []
+        return committed
+
+    def _commit(self):
+        self._committed.extend(self._pending)
+        self._pending = []
+
+    def add_seen(self, paths):
+        """
+        Record the features of finished files (e.g. the parts written before a download was
+        interrupted) as already written.
+        """
+        with self._lock:
+            for path in paths:
+                osm_ids, osm_types = self._read_keys(path)
+                self._seen.update(_get_keys(osm_ids, osm_types))
+
+    def drop_seen(self, gdf):
+        """
+        Drop the features already written and record the new ones.
+        """
+        keys = _get_keys(gdf['osm_id'].to_numpy(), gdf['osm_type'].to_numpy())
+        new = np.fromiter((key not in self._seen for key in keys), dtype=bool, count=len(keys))
+        self._seen.update(keys)
+        return gdf if new.all() else gdf[new]
+
+    def conform(self, gdf):
+        """
+        Convert a feature table to the columns of the file.
+
+        Returns
+        -------
+        table: dict
+            osm_id, osm_type, tag and other_tags columns as arrays and geometry as shapely array
+        """
+        if 'osm_id' in gdf:
+            osm_ids = gdf['osm_id'].to_numpy(dtype=np.int64)
+            osm_types = gdf['osm_type'].to_numpy(dtype=np.int8)
+        else:
+            osm_ids = np.zeros(len(gdf), dtype=np.int64)
+            osm_types = np.full(len(gdf), -1, dtype=np.int8)
+        table = {'osm_id': osm_ids, 'osm_type': osm_types}
+        for column in self.columns:
+            table[column] = _to_strings(gdf[column]) if column in gdf else np.full(len(gdf), None, dtype=object)
+
+        other_tags = np.full(len(gdf), None, dtype=object)
+        extra = [column for column in gdf.columns if column not in FEATURE_COLUMNS and column not in self.columns]
+        if extra:
+            values = gdf[extra].astype(object).where(gdf[extra].notna(), None).to_numpy()
+            for i in np.flatnonzero(gdf[extra].notna().any(axis=1).to_numpy()):
+                other_tags[i] = json.dumps({key: value for key, value in zip(extra, values[i]) if value is not None})
+        table[OTHER_TAGS] = other_tags
+        table['geometry'] = np.asarray(gdf.geometry.values, dtype=object)
+        return table
+
+    def _open(self):
+        pass
+
+    @abstractmethod
+    def _write(self, table):
+        """
+        Append the table of a tile (see conform) to the open file.
+        """
+
+    @abstractmethod
+    def _close(self):
+        """
+        Finish the open file.
+        """
+
+    @abstractmethod
+    def _read_keys(self, path):
+        """
+        Read the osm_id and osm_type columns of a finished file as arrays.
+        """
+
+    def close(self):
+        """
+        Finish the file. It is only readable once it is closed.
+        """
+        with self._lock:
+            self._close()
+            self._commit()
+
+class GeoParquetWriter(TileWriter):
+    """
+    GeoParquet writer with a row group per tile (requires pyarrow).
+
+    Geometries are stored as WKB with a bbox covering column, so readers can skip the row
+    groups (i.e. the tiles) outside of a spatial filter. The file is written as {path}.partial
+    and renamed when it is closed, so an interrupted part never looks like a finished file.
+    """
+    def __init__(self, path, columns=None, unique=True, tiles_per_part=None):
+        if pa is None:
+            raise ImportError('GeoParquet export requires pyarrow. Install it with `pip install pyarrow`.')
+        super().__init__(path, columns, unique, tiles_per_part)
+        self._writer = None
+
+    def _get_schema(self):
+        bbox = pa.struct([(name, pa.float64()) for name in ('xmin', 'ymin', 'xmax', 'ymax')])
+        fields = [pa.field('osm_id', pa.int64()), pa.field('osm_type', pa.int8())]
+        fields += [pa.field(column, pa.string()) for column in self.columns + [OTHER_TAGS]]
+        fields += [pa.field('geometry', pa.binary()), pa.field('bbox', bbox)]
+        geo = {
+            'version': '1.1.0',
+            'primary_column': 'geometry',
+            'columns': {
+                'geometry': {
+                    'encoding': 'WKB',
+                    'geometry_types': [],
+                    'covering': {'bbox': {key: ['bbox', key] for key in ('xmin', 'ymin', 'xmax', 'ymax')}}
+                }
+            }
+        }
+        return pa.schema(fields, metadata={b'geo': json.dumps(geo).encode('utf-8')})
+
+    def _write(self, table):
+        if self._writer is None:
+            self._writer = pq.ParquetWriter(f'{self.path}.partial', self._get_schema())
+        geometry = table.pop('geometry')
+        bounds = shapely.bounds(geometry)
+        table['geometry'] = shapely.to_wkb(geometry)
+        table['bbox'] = pa.StructArray.from_arrays(
+            [pa.array(bounds[:, i]) for i in range(4)], names=['xmin', 'ymin', 'xmax', 'ymax']
+        )
+        arrow_table = pa.Table.from_pydict(table, schema=self._writer.schema)
+        self._writer.write_table(arrow_table, row_group_size=max(len(arrow_table), 1))
+
+    def _close(self):
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+            os.replace(f'{self.path}.partial', self.path)
+
+    def _read_keys(self, path):
+        table = pq.read_table(path, columns=['osm_id', 'osm_type'])
+        return table['osm_id'].to_numpy(), table['osm_type'].to_numpy()
+
+class FlatGeobufWriter(TileWriter):
+    """
+    FlatGeobuf writer with a packed Hilbert R-tree spatial index (requires pyogrio).
+
+    A FlatGeobuf file is rewritten on every append, so the tiles are appended to a staging
+    GeoPackage instead and streamed to the indexed FlatGeobuf file in a single pass on close.
+    """
+    def __init__(self, path, columns=None, unique=True, tiles_per_part=None):
+        # pyogrio loads geopandas, it is only imported when a FlatGeobuf file is written
+        try:
+            import pyogrio
+        except ImportError:
+            raise ImportError('FlatGeobuf export requires pyogrio. Install it with `pip install pyogrio`.')
+        self.pyogrio = pyogrio
+        super().__init__(path, columns, unique, tiles_per_part)
+        self._open()
+
+    @property
+    def staging_path(self):
+        return f'{self.path}.staging.gpkg'
+
+    def _open(self):
+        if os.path.exists(self.staging_path):
+            os.remove(self.staging_path)
+
+    def _write(self, table):
+        import geopandas as gpd
+        geometry = table.pop('geometry')
+        gdf = gpd.GeoDataFrame(table, geometry=geometry, crs=DEFAULT_CRS)
+        self.pyogrio.write_dataframe(
+            gdf,
+            self.staging_path,
+            driver='GPKG',
+            layer='features',
+            append=os.path.exists(self.staging_path),
+            geometry_type='Unknown',
+            promote_to_multi=False,
+            layer_options={'SPATIAL_INDEX': 'NO'}
+        )
+
+    def _close(self):
+        if not os.path.exists(self.staging_path):
+            return
+        with self.pyogrio.raw.open_arrow(self.staging_path, layer='features') as (meta, reader):
+            self.pyogrio.write_arrow(
+                reader,
+                self.path,
+                driver='FlatGeobuf',
+                geometry_name=meta['geometry_name'] or 'geometry',
+                geometry_type='Unknown',
+                crs=meta['crs'],
+                encoding=meta['encoding'],
+                layer_options={'SPATIAL_INDEX': 'YES'}
+            )
+        os.remove(self.staging_path)
+
+    def _read_keys(self, path):
+        gdf = self.pyogrio.read_dataframe(path, columns=['osm_id', 'osm_type'], read_geometry=False)
+        return gdf['osm_id'].to_numpy(), gdf['osm_type'].to_numpy()
+
+def _get_keys(osm_ids, osm_types):
+    """
+    Key of every feature from its osm_id and osm_type code (see settings.ELEMENT_TYPE_CODES).
+    """
+    return (np.asarray(osm_ids, dtype=np.int64) * 4 + np.asarray(osm_types, dtype=np.int64)).tolist()
+
+def _to_strings(series):
+    """
+    Convert a tag column to an object array of strings with None for the missing values.
+    """
+    return series.astype(object).where(series.notna(), None).to_numpy()
+
+def get_writer_filename(path, name, driver):
+    """
+    Build the filename of a streaming export. If the file already exists (e.g. a resumed
+    download), a numbered part is used instead so previous tiles are never overwritten.
+    """
+    filename = os.path.join(path, f'{name}.{DEFAULT_FILE_EXTENSIONS[driver]}')
+    part = 0
+    while os.path.exists(filename):
+        part += 1
+        filename = os.path.join(path, f'{name}_{part}.{DEFAULT_FILE_EXTENSIONS[driver]}')
+    return filename
+
+def get_written_files(path, name, driver):
+    """
+    List the finished files of the streaming exports of a name in path, e.g. osm_data.parquet,
+    its parts and the exports of previous runs. Unfinished files are never listed.
+    """
+    extension = DEFAULT_FILE_EXTENSIONS[driver]
+    return sorted(glob.glob(os.path.join(glob.escape(path), f'{glob.escape(name)}*.{extension}')))
+
+def get_part_filename(path, paths=()):
+    """
+    Build the filename of the next part of a streaming export, e.g. osm_data_part1.parquet for
+    osm_data.parquet, skipping the existing files and the given paths.
+    """
+    root, extension = os.path.splitext(path)
+    part = 1
+    filename = f'{root}_part{part}{extension}'
+    while os.path.exists(filename) or filename in paths:
+        part += 1
+        filename = f'{root}_part{part}{extension}'
+    return filename
+
+def get_writer(driver, path, columns=None, unique=True, tiles_per_part=None):
+    """
+    Create the streaming writer of a driver.
+
+    Parameters
+    ----------
+    driver: string
+        'GeoParquet' or 'FlatGeobuf'
+    path: string
+        path of the output file
+    columns: list of strings
+        tag columns of the file. If None, the tag columns of the first tile are used.
+    unique: bool
+        if True, the features are written only once (see TileWriter)
+    tiles_per_part: int
+        if not None, the file is closed and continued in a new part every so many tiles
+    Returns
+    -------
+    writer: TileWriter
+    """
+    writers = {'GeoParquet': GeoParquetWriter, 'FlatGeobuf': FlatGeobufWriter}
+    if driver not in STREAMING_DRIVERS:
+        raise ValueError(f'driver {driver} is not a streaming driver. Try with {STREAMING_DRIVERS}')
+    return writers[driver](path, columns, unique, tiles_per_part)
@@ -27,10 +27,17 @@ setuptools.setup(
         "Operating System :: OS Independent",
     ],
     packages=['osmUtils'],
-    install_requires=['requests>=2.2.0', 'folium==0.8.3'],
+    install_requires=['requests>=2.2.0', 'folium==0.8.3', 'numpy', 'shapely>=2.0'],
+    extras_require={
+        'async': ['aiohttp>=3.6'],
+        'stream': ['ijson>=3.0'],
+        'parquet': ['pyarrow>=8.0'],
+        'flatgeobuf': ['pyogrio>=0.8'],
+    },
     entry_points={
         "console_scripts": [
             "vizzpython=osmUtils.__main__:main",
+            "osmutils=osmUtils.__main__:main",
         ]
     },
 )
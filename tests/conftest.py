@@ -0,0 +1,26 @@
+"""Shared fixtures of the osmUtils tests"""
+import pytest
+from mock_overpass import MockOverpass, make_grid_dataset
+
+
+def pytest_addoption(parser):
+    parser.addoption('--run-huge', action='store_true', default=False, help='run the benchmarks of huge responses')
+
+def pytest_configure(config):
+    config.addinivalue_line('markers', 'huge: benchmark of a huge response, only run with --run-huge')
+
+def pytest_collection_modifyitems(config, items):
+    if config.getoption('--run-huge'):
+        return
+    skip = pytest.mark.skip(reason='huge benchmark, use --run-huge to run it')
+    for item in items:
+        if 'huge' in item.keywords:
+            item.add_marker(skip)
+
+@pytest.fixture
+def overpass():
+    """
+    Mock Overpass API serving a 10x10 street grid within (0, 0, 1, 1).
+    """
+    with MockOverpass(make_grid_dataset(rows=10, columns=10, nodes_per_way=11)) as server:
+        yield server
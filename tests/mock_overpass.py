@@ -0,0 +1,483 @@
+"""Local stand-in of the Overpass API serving synthetic OSM datasets for the tests and benchmarks"""
+import re
+import json
+import time
+import threading
+import datetime as dt
+from collections import deque
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import parse_qs, urlparse
+import numpy as np
+import shapely
+from shapely.geometry import Polygon, box
+
+TIMEOUT_REMARK = 'runtime error: Query timed out in "query" at line 1 after {timeout} seconds.'
+
+_SETTINGS_RE = re.compile(r'\[timeout:(\d+)\]')
+_CSV_RE = re.compile(r'\[out:csv\((.*?)\)\]')
+_UNION_RE = re.compile(r'\]\s*;\s*\((.*)\);\s*(out[^;]*);', re.S)
+_CLAUSE_RE = re.compile(r'(.*?)(\(poly:"[^"]*"\)|\([-\d.]+,[-\d.]+,[-\d.]+,[-\d.]+\));', re.S)
+_TYPES = {
+    'node': {'node'}, 'way': {'way'}, 'relation': {'relation'}, 'rel': {'relation'}, 'nw': {'node', 'way'},
+    'nr': {'node', 'relation'}, 'wr': {'way', 'relation'}, 'nwr': {'node', 'way', 'relation'}
+}
+
+
+def make_grid_dataset(rows=10, columns=10, nodes_per_way=10, bounds=(0.0, 0.0, 1.0, 1.0)):
+    """
+    Build a dataset of a regular street grid: a way with highway=residential for every row
+    and column of the grid, with its nodes evenly spaced along it.
+
+    Parameters
+    ----------
+    rows, columns: int
+        number of horizontal and vertical ways
+    nodes_per_way: int
+        number of nodes of every way
+    bounds: tuple of floats
+        west, south, east and north of the grid
+    Returns
+    -------
+    dataset: dict
+        Overpass API response with all the elements of the grid
+    """
+    west, south, east, north = bounds
+    elements = []
+    ways = []
+    node_id = 1
+    lines = [((west, y), (east, y)) for y in np.linspace(south, north, rows + 2)[1:-1]]
+    lines += [((x, south), (x, north)) for x in np.linspace(west, east, columns + 2)[1:-1]]
+    for way_id, (start, end) in enumerate(lines, start=1):
+        lons = np.linspace(start[0], end[0], nodes_per_way)
+        lats = np.linspace(start[1], end[1], nodes_per_way)
+        node_ids = list(range(node_id, node_id + nodes_per_way))
+        node_id += nodes_per_way
+        elements.extend(
+            {'type': 'node', 'id': i, 'lat': round(float(lat), 7), 'lon': round(float(lon), 7)}
+            for i, lon, lat in zip(node_ids, lons, lats)
+        )
+        ways.append({'type': 'way', 'id': way_id, 'nodes': node_ids, 'tags': {'highway': 'residential'}})
+    return {'version': 0.6, 'generator': 'mock overpass', 'elements': elements + ways}
+
+
+class OverpassDataset:
+    """
+    Index of a synthetic dataset to answer the queries of the mock server.
+
+    The nodes are kept as coordinate arrays and the nodes of every way as a flat array
+    with their offsets, so the elements within an area are selected without a loop over
+    the nodes.
+    """
+    def __init__(self, dataset):
+
+        self.elements = dataset['elements']
+        self.index = {(el['type'], el['id']): el for el in self.elements}
+        self.nodes = [el for el in self.elements if el['type'] == 'node']
+        self.ways = [el for el in self.elements if el['type'] == 'way']
+        self.relations = [el for el in self.elements if el['type'] == 'relation']
+
+        self.node_lons = np.array([el['lon'] for el in self.nodes], dtype=np.float64)
+        self.node_lats = np.array([el['lat'] for el in self.nodes], dtype=np.float64)
+        position = {el['id']: i for i, el in enumerate(self.nodes)}
+        way_nodes = [[position[ref] for ref in el.get('nodes', []) if ref in position] for el in self.ways]
+        self.way_lengths = np.array([len(refs) for refs in way_nodes], dtype=np.int64)
+        self.way_nodes = np.array([ref for refs in way_nodes for ref in refs], dtype=np.int64)
+        self.way_position = {el['id']: i for i, el in enumerate(self.ways)}
+
+    def select(self, area):
+        """
+        Return the nodes, ways and relations within an area, i.e. the nodes inside it, the
+        ways with a node inside it and the relations with a member within it.
+        """
+        inside = shapely.contains_xy(area, self.node_lons, self.node_lats)
+        ways = np.zeros(len(self.ways), dtype=bool)
+        if len(self.way_nodes):
+            starts = np.concatenate([[0], np.cumsum(self.way_lengths)[:-1]])
+            nonempty = self.way_lengths > 0
+            ways[nonempty] = np.logical_or.reduceat(inside[self.way_nodes], starts[nonempty])
+        relations = [
+            el for el in self.relations
+            if any(
+                (member['type'] == 'way' and member['ref'] in self.way_position
+                 and ways[self.way_position[member['ref']]])
+                for member in el.get('members', [])
+            )
+        ]
+        return (
+            [el for el, flag in zip(self.nodes, inside) if flag]
+            + [el for el, flag in zip(self.ways, ways) if flag]
+            + relations
+        )
+
+    def query(self, query_string):
+        """
+        Evaluate a query built by osmUtils: a union of filter and area clauses, with the `>;`
+        recursion and an `out` statement (json or csv output).
+
+        Returns
+        -------
+        elements: list of dict
+            elements of the result in the order of the dataset
+        out: string
+            out statement of the query
+        """
+        match = _UNION_RE.search(query_string)
+        if match is None:
+            raise ValueError(f'Unsupported query {query_string!r}')
+        body, out = match.groups()
+        recurse = body.rstrip().endswith('>;')
+        if recurse:
+            body = body.rstrip()[:-2]
+
+        selected = set()
+        for statement, area_filter in _CLAUSE_RE.findall(body):
+            types, clauses = parse_filter(statement.strip())
+            for el in self.select(get_area(area_filter)):
+                if el['type'] in types and all(match_clause(clause, el.get('tags', {})) for clause in clauses):
+                    selected.add(id(el))
+                    if recurse:
+                        selected.update(id(member) for member in self.references(el))
+        return [el for el in self.elements if id(el) in selected], out
+
+    def references(self, element):
+        """
+        Return the elements added by the `>;` recursion: the nodes of a way, and the member
+        nodes and ways of a relation with the nodes of those ways.
+        """
+        if element['type'] == 'way':
+            return [self.index[('node', ref)] for ref in element.get('nodes', []) if ('node', ref) in self.index]
+        references = []
+        for member in element.get('members', []):
+            el = self.index.get((member['type'], member['ref']))
+            if el is not None and el['type'] in ('node', 'way'):
+                references.append(el)
+                references.extend(self.references(el))
+        return references
+
+    def output(self, elements, out):
+        """
+        Apply the modifiers of the out statement (skel, geom, center) to the elements.
+        """
+        skel = 'skel' in out
+        geom = 'geom' in out
+        center = 'center' in out
+        if not (skel or geom or center):
+            return elements
+        output = []
+        for el in elements:
+            el = {key: value for key, value in el.items() if not (skel and key == 'tags')}
+            if el['type'] == 'way' and (geom or center):
+                coords = [self.index[('node', ref)] for ref in el['nodes'] if ('node', ref) in self.index]
+                if geom:
+                    el['geometry'] = [{'lat': node['lat'], 'lon': node['lon']} for node in coords]
+                if center and coords:
+                    el['center'] = {
+                        'lat': float(np.mean([node['lat'] for node in coords])),
+                        'lon': float(np.mean([node['lon'] for node in coords]))
+                    }
+                    el.pop('nodes')
+            output.append(el)
+        return output
+
+def parse_filter(statement):
+    """
+    Parse a filter statement built by osmUtils into its element types and its tag clauses,
+    e.g. 'way["highway"!~"footway|path"]'. The mock matches the filters on its own, so a bug
+    in osmUtils.utils_filter does not show up identically in the client and the server.
+
+    Returns
+    -------
+    types: set of strings
+        element types of the statement
+    clauses: list of tuples
+        operator, key, value and case insensitive flag of every [...] clause
+    """
+    start = statement.find('[')
+    name = statement if start < 0 else statement[:start]
+    types = _TYPES[name.strip() or 'nwr']
+    clauses = []
+    text, quote, depth = '', None, 0
+    for char in statement[start:] if start >= 0 else '':
+        if quote:
+            text += char
+            if char == quote and not text.endswith('\\' + char):
+                quote = None
+        elif char in '"\'':
+            text += char
+            quote = char
+        elif char == '[':
+            depth += 1
+            text = ''
+        elif char == ']':
+            depth -= 1
+            clauses.append(parse_clause(text.strip()))
+        elif depth:
+            text += char
+        elif not char.isspace():
+            raise ValueError(f'Unsupported filter {statement!r}')
+    return types, clauses
+
+def parse_clause(text):
+    """
+    Parse the text of a [...] tag clause into its operator, key, value and case flag.
+    """
+    ignore_case = text.replace(' ', '').endswith(',i')
+    if ignore_case:
+        text = text[:text.rindex(',')].strip()
+    if text.startswith('!'):
+        return 'missing', unquote(text[1:].strip()), None, ignore_case
+    if text.startswith('~'):
+        key, value = split_operator(text[1:], '~')
+        return 'key~', unquote(key), unquote(value), ignore_case
+    for op in ('!=', '!~', '=', '~'):
+        parts = split_operator(text, op)
+        if parts is not None:
+            return op, unquote(parts[0]), unquote(parts[1]), ignore_case
+    return 'has', unquote(text), None, ignore_case
+
+def split_operator(text, op):
+    """
+    Split a clause on the first operator outside of quotes, None if there is none.
+    """
+    quote = None
+    for i, char in enumerate(text):
+        if quote:
+            if char == quote and text[i - 1] != '\\':
+                quote = None
+        elif char in '"\'':
+            quote = char
+        elif text.startswith(op, i) and not (op in '=~' and text[i - 1:i] == '!'):
+            return text[:i].strip(), text[i + len(op):].strip()
+    return None
+
+def unquote(text):
+    if len(text) >= 2 and text[0] == text[-1] and text[0] in '"\'':
+        return text[1:-1].replace('\\' + text[0], text[0])
+    return text
+
+def match_clause(clause, tags):
+    """
+    Evaluate a parsed tag clause (see parse_clause) on the tags of an element.
+    """
+    op, key, value, ignore_case = clause
+    flags = re.IGNORECASE if ignore_case else 0
+    if op == 'has':
+        return key in tags
+    if op == 'missing':
+        return key not in tags
+    if op == '=':
+        return tags.get(key) == value
+    if op == '!=':
+        return tags.get(key) != value
+    if op == '~':
+        return key in tags and re.search(value, tags[key], flags) is not None
+    if op == '!~':
+        return key not in tags or re.search(value, tags[key], flags) is None
+    return any(re.search(key, k, flags) and re.search(value, v, flags) for k, v in tags.items())
+
+def get_area(area_filter):
+    """
+    Build the polygon of a (poly:"lat lon ...") or (south,west,north,east) area filter.
+    """
+    if area_filter.startswith('(poly:'):
+        values = np.array(area_filter[7:-2].split(), dtype=np.float64).reshape(-1, 2)
+        return Polygon(values[:, ::-1])
+    south, west, north, east = (float(value) for value in area_filter[1:-1].split(','))
+    return box(west, south, east, north)
+
+def to_csv(elements, columns):
+    """
+    Format elements as the tab separated CSV output of the Overpass API with a header.
+    """
+    names = [column.strip().strip('"') for column in columns.split(';')[0].split(',')]
+    rows = ['\t'.join(f'@{name[2:]}' if name.startswith('::') else name for name in names)]
+    for el in elements:
+        center = el.get('center', el)
+        special = {'::type': el['type'], '::id': el['id'], '::lat': center.get('lat', ''),
+                   '::lon': center.get('lon', '')}
+        rows.append('\t'.join(
+            str(special[name]) if name in special else el.get('tags', {}).get(name, '') for name in names
+        ))
+    return '\n'.join(rows) + '\n'
+
+
+class MockOverpass:
+    """
+    Local HTTP server standing in for the Overpass API, serving /api/interpreter and
+    /api/status from a synthetic dataset (see make_grid_dataset).
+
+    Failures are injected in the order they are queued and consumed by the next queries:
+    an HTTP status (e.g. 429 or 504) or 'timeout', a response with a timeout remark. Queries
+    that select more than max_elements elements always time out, like a dense area does on
+    the real server. While slot_wait is set, the status endpoint reports no slot available
+    for that number of seconds.
+
+    Parameters
+    ----------
+    dataset: dict
+        Overpass API response with every element of the dataset
+    rate_limit: int
+        number of slots announced by the status endpoint. The slots taken by the queries being
+        answered are not announced as available, and the most queries answered at the same
+        time are recorded in max_running.
+    max_elements: int
+        if not None, queries selecting more elements time out
+    delay: float
+        seconds to wait before answering every query
+
+    Usage
+    -----
+    with MockOverpass(make_grid_dataset()) as server:
+        retrieve_osm(geometry, filters, overpass_endpoint=server.url, cache=False)
+    """
+    def __init__(self, dataset, rate_limit=2, max_elements=None, delay=0):
+
+        self.dataset = OverpassDataset(dataset)
+        self.rate_limit = rate_limit
+        self.max_elements = max_elements
+        self.delay = delay
+        self.slot_wait = 0
+        self.failures = deque()
+        self.queries = []
+        self.status_requests = 0
+        self.running = 0
+        self.max_running = 0
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0), self._get_handler())
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self):
+        return f'http://127.0.0.1:{self._server.server_address[1]}/api'
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *args):
+        self.stop()
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def inject(self, failure, times=1):
+        """
+        Queue a failure for the next queries: an HTTP status code or 'timeout'.
+        """
+        with self._lock:
+            self.failures.extend([failure] * times)
+
+    def get_status(self):
+        """
+        Body of the status endpoint.
+        """
+        lines = ['Connected as: 1234567', f'Current time: {dt.datetime.utcnow():%Y-%m-%dT%H:%M:%SZ}',
+                 f'Rate limit: {self.rate_limit}']
+        if self.slot_wait:
+            release = dt.datetime.utcnow() + dt.timedelta(seconds=self.slot_wait)
+            lines.append(f'Slot available after: {release:%Y-%m-%dT%H:%M:%SZ}, in {self.slot_wait} seconds.')
+        else:
+            with self._lock:
+                available = max(self.rate_limit - self.running, 0)
+            lines.append(f'{available} slots available now.')
+        lines.append('Currently running queries (pid, space limit, time limit, start time):')
+        return '\n'.join(lines) + '\n'
+
+    def answer(self, query_string):
+        """
+        Evaluate a query and return the status code, content type and body of the response.
+        """
+        with self._lock:
+            self.running += 1
+            self.max_running = max(self.max_running, self.running)
+        try:
+            return self._answer(query_string)
+        finally:
+            with self._lock:
+                self.running -= 1
+
+    def _answer(self, query_string):
+        with self._lock:
+            self.queries.append(query_string)
+            failure = self.failures.popleft() if self.failures else None
+        if self.delay:
+            time.sleep(self.delay)
+        if isinstance(failure, int):
+            return failure, 'text/html', f'<html><body>Error {failure}</body></html>'
+
+        timeout = _SETTINGS_RE.search(query_string)
+        timeout = timeout.group(1) if timeout else 180
+        response = {'version': 0.6, 'generator': 'mock overpass', 'osm3s': {}, 'elements': []}
+        try:
+            elements, out = self.dataset.query(query_string)
+        except ValueError as e:
+            return 400, 'text/html', f'<html><body>Error: {e}</body></html>'
+        if failure == 'timeout' or (self.max_elements is not None and len(elements) > self.max_elements):
+            response['remark'] = TIMEOUT_REMARK.format(timeout=timeout)
+            return 200, 'application/json', json.dumps(response)
+
+        if 'count' in out:
+            counts = {'nodes': 0, 'ways': 0, 'relations': 0}
+            for el in elements:
+                counts[f'{el["type"]}s'] += 1
+            tags = {key: str(value) for key, value in counts.items()}
+            tags['total'] = str(len(elements))
+            response['elements'] = [{'type': 'count', 'id': 0, 'tags': tags}]
+            return 200, 'application/json', json.dumps(response)
+
+        elements = self.dataset.output(elements, out)
+        csv = _CSV_RE.search(query_string)
+        if csv:
+            return 200, 'text/csv', to_csv(elements, csv.group(1))
+        response['elements'] = elements
+        return 200, 'application/json', json.dumps(response)
+
+    def _get_handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, *args):
+                pass
+
+            def _send(self, status, content_type, body):
+                body = body.encode('utf-8')
+                self.send_response(status)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def _interpreter(self, query_string):
+                if query_string is None:
+                    self._send(400, 'text/html', '<html><body>Error: no query</body></html>')
+                else:
+                    self._send(*server.answer(query_string))
+
+            def do_GET(self):
+                url = urlparse(self.path)
+                if url.path.endswith('/status'):
+                    with server._lock:
+                        server.status_requests += 1
+                    self._send(200, 'text/plain', server.get_status())
+                elif url.path.endswith('/interpreter'):
+                    self._interpreter(parse_qs(url.query).get('data', [None])[0])
+                else:
+                    self._send(404, 'text/html', 'Not found')
+
+            def do_POST(self):
+                length = int(self.headers.get('Content-Length', 0))
+                data = parse_qs(self.rfile.read(length).decode('utf-8'))
+                if urlparse(self.path).path.endswith('/interpreter'):
+                    self._interpreter(data.get('data', [None])[0])
+                else:
+                    self._send(404, 'text/html', 'Not found')
+
+        return Handler
@@ -0,0 +1,195 @@
+"""Seedable generator of synthetic Overpass API responses for the tests and benchmarks"""
+import json
+from itertools import chain
+import numpy as np
+
+HIGHWAYS = ['residential', 'service', 'footway', 'track', 'unclassified', 'tertiary', 'secondary', 'primary']
+HIGHWAY_WEIGHTS = [0.35, 0.2, 0.15, 0.1, 0.08, 0.06, 0.04, 0.02]
+LANDUSES = ['residential', 'farmland', 'forest', 'meadow', 'industrial']
+AMENITIES = ['bench', 'waste_basket', 'parking', 'restaurant', 'school']
+
+CHUNK_SIZE = 100000
+NODE_TEMPLATE = '{"type": "node", "id": %d, "lat": %r, "lon": %r}'
+POI_TAGS_TEMPLATE = ', "tags": {"amenity": "%s"}}'
+
+
+class SyntheticOsm:
+    """
+    Synthetic OSM dataset in the format of an Overpass API response to a `out;` query with
+    the `>;` recursion: nodes, ways and multipolygon relations, in that order.
+
+    The ways are random walks starting around a number of cluster centres, so density sets
+    how clustered the data is, and the nodes not used by any way are tagged points of
+    interest. Closed ways are buildings, and some of them are grouped as the outer members
+    of landuse multipolygons. The same parameters and seed always give the same dataset.
+
+    Parameters
+    ----------
+    nodes: int
+        number of nodes
+    way_length: int
+        mean number of nodes of a way (at least 2)
+    way_ratio: float
+        fraction of the nodes that belong to a way
+    closed_ratio: float
+        fraction of the ways that are closed (buildings)
+    relation_ratio: float
+        fraction of the closed ways that are members of a multipolygon relation
+    density: int
+        number of clusters the ways start from, 0 spreads them uniformly
+    bounds: tuple of floats
+        west, south, east and north of the dataset
+    seed: int
+        seed of the random generator
+
+    Usage
+    -----
+    response_json = SyntheticOsm(nodes=10000, seed=1).to_dict()
+    SyntheticOsm(nodes=10000000, seed=1).to_file('osm_10M.json')
+    """
+    def __init__(
+        self,
+        nodes=10000,
+        way_length=10,
+        way_ratio=0.9,
+        closed_ratio=0.2,
+        relation_ratio=0.1,
+        density=10,
+        bounds=(0.0, 0.0, 1.0, 1.0),
+        seed=0
+    ):
+        rng = np.random.default_rng(seed)
+        west, south, east, north = bounds
+        width, height = east - west, north - south
+
+        # split the way nodes in ways with at least 2 nodes
+        way_nodes = int(nodes * way_ratio)
+        lengths = rng.poisson(max(way_length - 2, 0), size=max(way_nodes // max(way_length, 2), 1)) + 2
+        lengths = lengths[np.cumsum(lengths) <= way_nodes]
+        way_nodes = int(lengths.sum())
+        closed = rng.random(len(lengths)) < closed_ratio
+        # a closed way repeats its first node, it needs at least 3 different ones
+        closed &= lengths >= 3
+        self.way_lengths = lengths
+        self.way_closed = closed
+
+        # ways are random walks from their start point, with steps a fraction of the extent
+        if density:
+            centres = rng.random((density, 2)) * [width, height] + [west, south]
+            starts = centres[rng.integers(0, density, len(lengths))]
+            starts += rng.normal(0, 0.05, (len(lengths), 2)) * [width, height]
+        else:
+            starts = rng.random((len(lengths), 2)) * [width, height] + [west, south]
+        steps = rng.normal(0, 1e-3, (way_nodes, 2)) * [width, height]
+        offsets = np.concatenate([[0], np.cumsum(lengths)[:-1]])
+        steps[offsets] = starts
+        way_coords = np.cumsum(steps, axis=0)
+        # restart the cumulative sum at every way
+        way_coords -= np.repeat(way_coords[offsets] - starts, lengths, axis=0)
+
+        poi_coords = rng.random((nodes - way_nodes, 2)) * [width, height] + [west, south]
+        coords = np.concatenate([way_coords, poi_coords])
+        coords[:, 0] = np.clip(coords[:, 0], west, east)
+        coords[:, 1] = np.clip(coords[:, 1], south, north)
+        self.node_coords = np.round(coords, 7)
+        self.node_ids = np.arange(1, nodes + 1, dtype=np.int64)
+        self.way_offsets = offsets
+        self.way_ids = np.arange(1, len(lengths) + 1, dtype=np.int64)
+        self.poi_ids = self.node_ids[way_nodes:]
+
+        self.highways = rng.choice(len(HIGHWAYS), size=len(lengths), p=HIGHWAY_WEIGHTS)
+        self.amenities = rng.integers(0, len(AMENITIES), size=len(self.poi_ids))
+
+        # group the closed ways in relations of 1 to 3 outer members
+        members = np.flatnonzero(closed)
+        members = members[rng.random(len(members)) < relation_ratio]
+        sizes = rng.integers(1, 4, size=len(members))
+        sizes = sizes[np.cumsum(sizes) <= len(members)]
+        self.relation_members = np.split(members[:sizes.sum()], np.cumsum(sizes)[:-1]) if len(sizes) else []
+        self.relation_ids = np.arange(1, len(self.relation_members) + 1, dtype=np.int64)
+        self.landuses = rng.integers(0, len(LANDUSES), size=len(self.relation_members))
+
+    def __len__(self):
+        return len(self.node_ids) + len(self.way_ids) + len(self.relation_ids)
+
+    def iter_nodes(self):
+        first_poi = len(self.node_ids) - len(self.poi_ids)
+        lons, lats = self.node_coords.T.tolist()
+        for i, node_id in enumerate(self.node_ids.tolist()):
+            node = {'type': 'node', 'id': node_id, 'lat': lats[i], 'lon': lons[i]}
+            if i >= first_poi:
+                node['tags'] = {'amenity': AMENITIES[self.amenities[i - first_poi]]}
+            yield node
+
+    def iter_ways(self):
+        for i, way_id in enumerate(self.way_ids.tolist()):
+            start = self.way_offsets[i]
+            node_ids = self.node_ids[start:start + self.way_lengths[i]].tolist()
+            if self.way_closed[i]:
+                node_ids.append(node_ids[0])
+                tags = {'building': 'yes'}
+            else:
+                tags = {'highway': HIGHWAYS[self.highways[i]]}
+            yield {'type': 'way', 'id': way_id, 'nodes': node_ids, 'tags': tags}
+
+    def iter_relations(self):
+        for relation_id, members, landuse in zip(self.relation_ids.tolist(), self.relation_members, self.landuses):
+            yield {
+                'type': 'relation',
+                'id': relation_id,
+                'members': [{'type': 'way', 'ref': int(self.way_ids[i]), 'role': 'outer'} for i in members],
+                'tags': {'type': 'multipolygon', 'landuse': LANDUSES[landuse]}
+            }
+
+    def iter_elements(self):
+        """
+        Iterate over all the elements of the dataset in the order of the response.
+        """
+        return chain(self.iter_nodes(), self.iter_ways(), self.iter_relations())
+
+    def to_dict(self):
+        """
+        Return the dataset as the parsed JSON of an Overpass API response.
+        """
+        return {'version': 0.6, 'generator': 'synthetic osm', 'elements': list(self.iter_elements())}
+
+    def to_file(self, path):
+        """
+        Write the dataset to a JSON file in the format of an Overpass API response, formatting
+        the elements in chunks so the whole response is never held in memory.
+        """
+        first_poi = len(self.node_ids) - len(self.poi_ids)
+        with open(path, 'w') as f:
+            f.write('{"version": 0.6, "generator": "synthetic osm", "elements": [\n')
+            separator = ''
+            # the nodes are most of the file, they are formatted with a template instead of json.dumps
+            for start in range(0, len(self.node_ids), CHUNK_SIZE):
+                stop = min(start + CHUNK_SIZE, len(self.node_ids))
+                ids = self.node_ids[start:stop].tolist()
+                lons, lats = self.node_coords[start:stop].T.tolist()
+                chunk = [NODE_TEMPLATE % values for values in zip(ids, lats, lons)]
+                for i in range(max(first_poi, start), stop):
+                    chunk[i - start] = chunk[i - start][:-1] + POI_TAGS_TEMPLATE % AMENITIES[self.amenities[i - first_poi]]
+                f.write(separator + ',\n'.join(chunk))
+                separator = ',\n'
+            elements = chain(self.iter_ways(), self.iter_relations())
+            while True:
+                chunk = [json.dumps(element) for _, element in zip(range(CHUNK_SIZE), elements)]
+                if not chunk:
+                    break
+                f.write(separator + ',\n'.join(chunk))
+                separator = ',\n'
+            f.write('\n]}\n')
+        return path
+
+def generate_osm_response(seed=0, **kwargs):
+    """
+    Generate a synthetic Overpass API response (see SyntheticOsm for the parameters).
+    """
+    return SyntheticOsm(seed=seed, **kwargs).to_dict()
+
+def write_osm_response(path, seed=0, **kwargs):
+    """
+    Write a synthetic Overpass API response to a JSON file (see SyntheticOsm for the parameters).
+    """
+    return SyntheticOsm(seed=seed, **kwargs).to_file(path)
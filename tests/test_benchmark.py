@@ -0,0 +1,146 @@
+"""Benchmarks of the package import time, of the retrieval and parsing of small, medium and huge responses against the mock Overpass API,
+and of the parsing and export of synthetic responses of 10k, 1M and 10M nodes without any network.
+
+Run them with `python -m pytest tests/test_benchmark.py --benchmark-only` (the huge responses
+with --run-huge) and compare runs with --benchmark-autosave and --benchmark-compare.
+"""
+import sys
+import json
+import subprocess
+import tracemalloc
+import pytest
+from shapely.geometry import box
+from mock_overpass import MockOverpass, make_grid_dataset
+from synthetic_osm import SyntheticOsm
+from osmUtils.utils_osm import retrieve_osm, generate_osm_gdf, OSM_response_to_lines, OSM_response_to_features
+from osmUtils.utils_writer import get_writer
+from osmUtils.utils_parse import ParserPool
+
+pytest.importorskip('pytest_benchmark')
+
+FILTERS = ['way["highway"]']
+SIZES = {
+    # rows, columns and nodes per way of the street grid
+    'small': (10, 10, 10),
+    'medium': (100, 100, 50),
+    'huge': pytest.param((1000, 1000, 500), marks=pytest.mark.huge),
+}
+NODES = {
+    '10k': 10000,
+    '1M': pytest.param(1000000, marks=pytest.mark.huge),
+    '10M': pytest.param(10000000, marks=pytest.mark.huge),
+}
+
+
+@pytest.fixture(scope='module', params=list(SIZES.values()), ids=list(SIZES))
+def dataset(request):
+    rows, columns, nodes_per_way = request.param
+    return make_grid_dataset(rows=rows, columns=columns, nodes_per_way=nodes_per_way)
+
+@pytest.fixture(scope='module')
+def server(dataset):
+    with MockOverpass(dataset, rate_limit=0) as server:
+        yield server
+
+def get_peak_memory(func, *args):
+    """
+    Peak memory in MB allocated while running a function.
+    """
+    tracemalloc.start()
+    try:
+        func(*args)
+        return tracemalloc.get_traced_memory()[1] / 1024 ** 2
+    finally:
+        tracemalloc.stop()
+
+def test_benchmark_retrieve(benchmark, server, dataset):
+    def retrieve():
+        response_json = retrieve_osm(box(0, 0, 1, 1), FILTERS, overpass_endpoint=server.url, cache=False,
+                                     pause_duration=0)
+        return generate_osm_gdf(response_json)
+
+    gdf = benchmark.pedantic(retrieve, rounds=3, iterations=1)
+    elements = len(dataset['elements'])
+    assert len(gdf) == sum(el['type'] == 'way' for el in dataset['elements'])
+    benchmark.extra_info['elements'] = elements
+    benchmark.extra_info['bytes'] = len(json.dumps(dataset))
+    # there are no stats with --benchmark-disable
+    if benchmark.stats:
+        benchmark.extra_info['elements_per_second'] = elements / benchmark.stats.stats.mean
+
+def test_benchmark_parse(benchmark, dataset):
+    gdf = benchmark.pedantic(generate_osm_gdf, args=([dataset],), rounds=3, iterations=1)
+    assert len(gdf) == sum(el['type'] == 'way' for el in dataset['elements'])
+    benchmark.extra_info['elements'] = len(dataset['elements'])
+    benchmark.extra_info['peak_memory_mb'] = get_peak_memory(generate_osm_gdf, [dataset])
+
+@pytest.fixture(scope='module', params=list(NODES.values()), ids=list(NODES))
+def synthetic(request):
+    return SyntheticOsm(nodes=request.param, seed=0)
+
+@pytest.fixture(scope='module')
+def synthetic_file(synthetic, tmp_path_factory):
+    return synthetic.to_file(tmp_path_factory.mktemp('synthetic') / 'response.json')
+
+@pytest.fixture(scope='module')
+def synthetic_features(synthetic_file):
+    return read_features(synthetic_file)
+
+def read_features(path):
+    """
+    Parse the features of a response file streaming its elements (requires ijson), so the
+    elements are never held in memory at once.
+    """
+    ijson = pytest.importorskip('ijson')
+    with open(path, 'rb') as f:
+        return OSM_response_to_features({'elements': ijson.items(f, 'elements.item', use_float=True)})
+
+def test_benchmark_synthetic_lines(benchmark, synthetic):
+    response_json = synthetic.to_dict()
+    lines = benchmark.pedantic(OSM_response_to_lines, args=(response_json,), rounds=3, iterations=1)
+    assert len(lines) == len(synthetic.way_ids) + len(synthetic.relation_ids)
+    benchmark.extra_info['nodes'] = len(synthetic.node_ids)
+
+def test_benchmark_synthetic_gdf(benchmark, synthetic):
+    response_json = synthetic.to_dict()
+    gdf = benchmark.pedantic(generate_osm_gdf, args=([response_json],), rounds=3, iterations=1)
+    assert len(gdf) == len(synthetic.way_ids) + len(synthetic.relation_ids)
+    benchmark.extra_info['nodes'] = len(synthetic.node_ids)
+    benchmark.extra_info['peak_memory_mb'] = get_peak_memory(generate_osm_gdf, [response_json])
+
+def test_benchmark_synthetic_file(benchmark, synthetic, synthetic_file):
+    gdf = benchmark.pedantic(read_features, args=(synthetic_file,), rounds=1, iterations=1)
+    assert len(gdf) == len(synthetic.way_ids) + len(synthetic.relation_ids)
+    benchmark.extra_info['nodes'] = len(synthetic.node_ids)
+    benchmark.extra_info['bytes'] = synthetic_file.stat().st_size
+
+def test_benchmark_synthetic_pool(benchmark, synthetic, synthetic_file):
+    content = synthetic_file.read_bytes()
+    with ParserPool(workers=2) as parser:
+        # start the workers before timing
+        parser.parse([{'content': b'{"elements": []}'}])
+        gdf = benchmark.pedantic(parser.parse, args=([{'content': content}],), rounds=1, iterations=1)
+    assert len(gdf) == len(synthetic.way_ids) + len(synthetic.relation_ids)
+    benchmark.extra_info['nodes'] = len(synthetic.node_ids)
+    benchmark.extra_info['bytes'] = len(content)
+
+@pytest.mark.parametrize('driver', ['GeoParquet', 'FlatGeobuf'])
+def test_benchmark_synthetic_export(benchmark, synthetic_features, driver, tmp_path):
+    pytest.importorskip({'GeoParquet': 'pyarrow', 'FlatGeobuf': 'pyogrio'}[driver])
+    paths = iter(tmp_path / f'features_{i}' for i in range(10))
+
+    def export():
+        with get_writer(driver, str(next(paths))) as writer:
+            writer.write(synthetic_features)
+        return writer
+
+    writer = benchmark.pedantic(export, rounds=1, iterations=1)
+    assert writer.features == len(synthetic_features)
+    benchmark.extra_info['features'] = len(synthetic_features)
+
+@pytest.mark.parametrize('module', ['osmUtils', 'osmUtils.utils_osm', 'osmUtils.collectionOsm'])
+def test_benchmark_import(benchmark, module):
+    # every round imports the module in a new interpreter
+    benchmark.pedantic(subprocess.run, args=([sys.executable, '-c', f'import {module}'],), kwargs={'check': True},
+                       rounds=5, iterations=1)
+    benchmark.extra_info['module'] = module
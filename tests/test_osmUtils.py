@@ -1,23 +1,546 @@
 """Tests for osmUtils"""
+import sys
+import time
+import subprocess
+import pytest
+from shapely import wkt
+from shapely.geometry import box, MultiPolygon, Polygon
+from input_data import settings
+from osmUtils.collectionOsm import CollectionOsm
+from osmUtils.osmDownload import OsmDownload
+from osmUtils.utils_geo import geometry_to_gdf, generate_tiles, generate_tile_cover
+from osmUtils.utils_osm import overpass_request, get_query_strings, retrieve_osm, generate_osm_gdf, get_cut_dfs
+from osmUtils.utils_parse import ParserPool
+from osmUtils.utils_metrics import get_metrics, StatsdExporter
 
-#definequeries to use throughout test
+#define queries to use throughout test
+FILTERS = ['way["highway"]']
 
-#todo
 
+def get_query(geometry, output='body'):
+    return get_query_strings(geometry, FILTERS, timeout=25, output=output)[0]
 
-from input_data import settings
-from shapely import wkt
-import datatest
+def test_geom_valid():
+    #define queries to use for testing
+    geometry = wkt.loads(settings.geometry)
+    assert geometry.is_valid
+    assert isinstance(geometry, MultiPolygon)
 
+def test_tile_cover():
+    geometry = geometry_to_gdf(wkt.loads(settings.geometry), 'EPSG:4326')
+    cover = generate_tile_cover(geometry, 'EPSG:4326', 10)
+    tiles = generate_tiles('EPSG:4326', 10, geometry.total_bounds)
+    intersecting = tiles[tiles.intersection(geometry.union_all()).area > 0]
+    assert list(cover.tile_id) == list(intersecting.tile_id)
+    assert cover.interior.sum() > 0
+    assert abs(cover.area.sum() - geometry.area.sum()) < 1e-9
 
+def test_lazy_constructors():
+    download = OsmDownload(box(0, 0, 1, 1), osm_type='all_roads')
+    assert not download.fetched
+    collection = CollectionOsm(zoom=3)
+    assert 'manifest' not in vars(collection)
+    manifest = collection.plan()
+    assert manifest is collection.manifest
+    assert len(manifest) == 64
+    assert 'vizzualise' not in vars(collection)
 
-def test_geom_valid():
-    #define queries to use for testing
-geometry = wkt.loads(settings.geometry)
+def test_import_defers_heavy_dependencies():
+    code = ('import sys, osmUtils.utils_osm, osmUtils.utils_collection; '
+            'print(*[name in sys.modules for name in ("geopandas", "pandas", "folium")])')
+    result = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True, check=True)
+    assert result.stdout.split() == ['False', 'False', 'False']
+
+def test_bbox_query_for_rectangles():
+    assert '(0.000000,0.000000,0.500000,0.500000)' in get_query(box(0, 0, 0.5, 0.5))
+    assert '(poly:"' in get_query(box(0, 0, 0.5, 0.5).union(box(0.5, 0, 0.6, 0.2)))
+
+def test_simplify_to_budget():
+    from shapely.geometry import Point
+    from osmUtils.utils_osm import simplify_to_budget, simplify_geometry
+    polygon = Point(0, 0).buffer(1, quad_segs=256)
+    simplified = simplify_to_budget(polygon, 20)
+    assert len(simplified.exterior.coords) <= 20
+    assert simplified.covers(polygon)
+    assert simplified.area < polygon.envelope.area
+    # the budget is shared by the parts of a multipolygon
+    multipolygon = MultiPolygon([polygon, Point(3, 0).buffer(1, quad_segs=128)])
+    simplified = simplify_geometry(multipolygon, 40)
+    assert sum(len(part.exterior.coords) for part in simplified.geoms) <= 40
+    assert simplified.covers(multipolygon)
+    # a budget too small for any polygon falls back to the bounding box
+    assert simplify_to_budget(polygon, 4).equals(polygon.envelope)
+
+def test_overpass_request(overpass):
+    response_json = overpass_request(get_query(box(0, 0, 1, 1)), pause_duration=0, overpass_endpoint=overpass.url,
+                                     cache=False)
+    types = [el['type'] for el in response_json['elements']]
+    assert types.count('way') == 20
+    assert types.count('node') == 220
+    assert 'remark' not in response_json
+
+@pytest.mark.parametrize('status', [429, 504])
+def test_overpass_request_retries(overpass, status):
+    overpass.inject(status)
+    response_json = overpass_request(get_query(box(0, 0, 0.5, 1)), pause_duration=0, overpass_endpoint=overpass.url,
+                                     cache=False)
+    assert len(overpass.queries) == 2
+    assert overpass.status_requests == 1
+    assert sum(el['type'] == 'way' for el in response_json['elements']) == 15
+
+def test_overpass_request_gives_up(overpass):
+    overpass.inject(429, times=3)
+    response_json = overpass_request(get_query(box(0, 0, 0.5, 1)), pause_duration=0, overpass_endpoint=overpass.url,
+                                     cache=False, max_retries=1)
+    assert response_json is None
+    assert len(overpass.queries) == 2
+
+def test_overpass_request_metrics(overpass):
+    metrics = get_metrics()
+    metrics.reset()
+    overpass.inject(429)
+    overpass_request(get_query(box(0, 0, 0.5, 1)), pause_duration=0, overpass_endpoint=overpass.url, cache=False)
+    assert metrics.get_counter('request_retries') == 1
+    assert metrics.get_counter('requests', status=200) == 1
+    assert metrics.get_counter('request_bytes') > 0
+    assert metrics.get_summary()['observations']['request_elements']['sum'] == 15 + 15 * 11
+    assert 'osmutils_request_retries_total{status="429"} 1' in metrics.to_prometheus()
+
+def test_download_metrics_per_call(overpass, tmp_path):
+    metrics = get_metrics()
+    collection = CollectionOsm(geometry=box(0, 0, 1, 1), zoom=8)
+    for i in range(2):
+        collection.manifest['exported'] = 0
+        collection.download_tiles(custom_filter=FILTERS, path=str(tmp_path / str(i)), driver='GeoJSON',
+                                  overpass_endpoint=overpass.url, endpoint_slots={overpass.url: 2}, cache=False)
+        # the registry only covers the last download
+        assert metrics.get_counter('tiles', status='exported') == 1
+
+def test_statsd_exporter():
+    import socket
+    from osmUtils.utils_metrics import Metrics
+    server = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    server.bind(('127.0.0.1', 0))
+    server.settimeout(5)
+    exporter = StatsdExporter('127.0.0.1', server.getsockname()[1])
+    metrics = Metrics()
+    metrics.add_callback(exporter)
+    metrics.increment('requests', status=200)
+    metrics.observe('parse_seconds', 0.5)
+    exporter.close()
+    assert server.recv(1024) == b'osmutils.requests:1|c|#status:200'
+    assert server.recv(1024) == b'osmutils.parse:500.000|ms'
+    server.close()
+
+def test_overpass_request_waits_for_slot(overpass):
+    overpass.slot_wait = 1
+    start = time.time()
+    overpass_request(get_query(box(0, 0, 1, 1)), pause_duration=None, overpass_endpoint=overpass.url, cache=False)
+    assert time.time() - start >= 1
+    assert overpass.status_requests == 1
+
+@pytest.mark.parametrize('output', ['body', 'skel', 'geom', 'center', 'csv'])
+def test_retrieve_osm_outputs(overpass, output):
+    response_json = retrieve_osm(box(0, 0, 1, 1), FILTERS, overpass_endpoint=overpass.url, cache=False,
+                                 pause_duration=0, output=output)
+    gdf = generate_osm_gdf(response_json, output)
+    assert len(gdf) == 20
+    assert gdf.osm_id.is_unique
+    expected = 'Point' if output in ('center', 'csv') else 'LineString'
+    assert set(gdf.geom_type) == {expected}
+
+def test_parser_pool(overpass):
+    kwargs = dict(overpass_endpoint=overpass.url, cache=False, pause_duration=0)
+    response_json = retrieve_osm(box(0, 0, 1, 1), FILTERS, raw=True, **kwargs)
+    assert isinstance(response_json[0]['content'], bytes)
+    with ParserPool(workers=1) as parser:
+        gdf = parser.parse(response_json)
+    expected = generate_osm_gdf(retrieve_osm(box(0, 0, 1, 1), FILTERS, **kwargs))
+    assert gdf.osm_id.tolist() == expected.osm_id.tolist()
+    assert list(gdf.columns) == list(expected.columns)
+    assert gdf.geometry.geom_equals(expected.geometry).all()
+
+def test_retrieve_osm_cuts_on_timeout(overpass):
+    # the whole grid (20 ways and 220 nodes) times out, a quarter does not
+    overpass.max_elements = 150
+    response_json = retrieve_osm(box(0, 0, 1, 1), FILTERS, overpass_endpoint=overpass.url, cache=False,
+                                 pause_duration=0)
+    gdf = generate_osm_gdf(response_json)
+    assert len(gdf) == 20
+    assert gdf.osm_id.is_unique
+    assert any('out count;' in query for query in overpass.queries)
+
+def test_get_cut_dfs_splits_timed_out_parts(overpass):
+    overpass.inject('timeout')
+    gdf = get_cut_dfs([box(0, 0, 1, 1)], FILTERS, overpass_endpoint=overpass.url, cache=False, pause_duration=0)
+    assert len(gdf) == 20
+    # the 2x2 parts are queried by bbox
+    assert len(overpass.queries) == 5
+    assert all('poly:' not in query for query in overpass.queries)
+
+def test_osm_download_stream(overpass, monkeypatch):
+    monkeypatch.setattr('osmUtils.osmDownload.DEFAULT_OVERPASS_ENDPOINT', overpass.url)
+    download = OsmDownload(box(0, 0, 1, 1), custom_filter=FILTERS, cache=False, stream=True)
+    gdf = download.fetch()
+    assert len(gdf) == 20
+    assert len(overpass.queries) == 1
+
+def test_stream_cuts_on_timeout(overpass):
+    overpass.inject('timeout')
+    gdf = retrieve_osm(box(0, 0, 1, 1), FILTERS, overpass_endpoint=overpass.url, cache=False, pause_duration=0,
+                       stream=True)
+    assert len(gdf) == 20
+    assert gdf.osm_id.is_unique
+
+def test_streamed_remark_stops_elements():
+    import io
+    import json
+    from osmUtils.utils_osm import iter_response_elements, IncompleteResponseError
+
+    class Response:
+        def __init__(self, body):
+            self.raw = io.BytesIO(body)
+
+        def close(self):
+            pass
+
+    elements = [{'type': 'node', 'id': i, 'lat': 0.0, 'lon': 0.0} for i in range(10)]
+    body = json.dumps({'elements': elements, 'remark': 'runtime error: Query timed out'}).encode()
+    response_json = {}
+    consumed = []
+    with pytest.raises(IncompleteResponseError):
+        for element in iter_response_elements(Response(body), response_json):
+            consumed.append(element)
+    # the whole body is read at once, none of its elements is parsed after the remark
+    assert consumed == []
+    assert response_json['remark'] == 'runtime error: Query timed out'
+
+def test_response_parse_errors(caplog):
+    from osmUtils.utils_osm import OSM_response_to_features
+    # a way without its node ids is logged and skipped
+    response_json = {'elements': [{'type': 'way', 'id': 1}]}
+    assert OSM_response_to_features(response_json) is None
+    assert 'Unable to parse the response' in caplog.text
+    # anything else is a bug and is raised
+    with pytest.raises(TypeError):
+        OSM_response_to_features({'elements': [None]})
+
+def test_cli_download_and_resume(overpass, tmp_path, capsys):
+    import geopandas as gpd
+    from osmUtils.__main__ import main
+    geometry = tmp_path / 'geometry.geojson'
+    gpd.GeoDataFrame(geometry=[box(0, 0, 1, 1)], crs='EPSG:4326').to_file(geometry)
+    manifest = str(tmp_path / 'manifest.sqlite')
+    assert main(['plan', str(geometry), '--zoom', '8', '--manifest', manifest]) == 0
+    assert main(['download', '--manifest', manifest, '--filter', FILTERS[0], '--endpoint', overpass.url,
+                 '--driver', 'GeoParquet', '--path', str(tmp_path / 'out'), '--no-cache', '--workers', '2',
+                 '--prometheus', str(tmp_path / 'osmutils.prom')]) == 0
+    out = capsys.readouterr().out
+    assert 'tiles/s' in out and 'elements/s' in out
+    assert 'osmutils_tiles_total{status="exported"} 1' in (tmp_path / 'osmutils.prom').read_text()
+    gdf = gpd.read_parquet(tmp_path / 'out' / 'osm_data.parquet')
+    assert len(gdf) == 20
+    queries = len(overpass.queries)
+    # the saved parameters are used and the finished tiles are not queried again
+    assert main(['resume', '--manifest', manifest]) == 0
+    assert len(overpass.queries) == queries
+    assert main(['status', '--manifest', manifest]) == 0
+
+def test_streaming_writer_parts(tmp_path):
+    import geopandas as gpd
+    from osmUtils.utils_writer import get_writer
+    tiles = [gpd.GeoDataFrame({'osm_id': [i], 'osm_type': [1], 'highway': ['residential']},
+                              geometry=[box(i, 0, i + 1, 1).exterior], crs='EPSG:4326') for i in range(3)]
+    writer = get_writer('GeoParquet', str(tmp_path / 'osm_data.parquet'), ['highway'], tiles_per_part=2)
+    for i, gdf in enumerate(tiles):
+        writer.write(gdf, f'tile-{i}')
+    # the first part is closed and readable, the open one is not finished yet
+    assert writer.pop_committed() == ['tile-0', 'tile-1']
+    assert gpd.read_parquet(tmp_path / 'osm_data.parquet').osm_id.tolist() == [0, 1]
+    assert not (tmp_path / 'osm_data_part1.parquet').exists()
+    writer.close()
+    assert writer.pop_committed() == ['tile-2']
+    assert gpd.read_parquet(tmp_path / 'osm_data_part1.parquet').osm_id.tolist() == [2]
+
+def test_streaming_writer_resume(tmp_path):
+    import geopandas as gpd
+    from osmUtils.utils_writer import get_writer, get_writer_filename, get_written_files
+    tiles = [gpd.GeoDataFrame({'osm_id': [i, 10], 'osm_type': [1, 1]},
+                              geometry=[box(i, 0, i + 1, 1).exterior] * 2, crs='EPSG:4326') for i in range(3)]
+    with get_writer('GeoParquet', str(tmp_path / 'osm_data.parquet'), tiles_per_part=1) as writer:
+        writer.write(tiles[0], 'tile-0')
+        writer.write(tiles[1], 'tile-1')
+    assert get_written_files(str(tmp_path), 'osm_data', 'GeoParquet') == [
+        str(tmp_path / 'osm_data.parquet'), str(tmp_path / 'osm_data_part1.parquet')
+    ]
+    # the resumed download does not write the features of the interrupted one again
+    with get_writer('GeoParquet', get_writer_filename(str(tmp_path), 'osm_data', 'GeoParquet')) as writer:
+        writer.add_seen(get_written_files(str(tmp_path), 'osm_data', 'GeoParquet'))
+        writer.write(tiles[1], 'tile-1')
+        writer.write(tiles[2], 'tile-2')
+    assert gpd.read_parquet(writer.path).osm_id.tolist() == [2]
+
+def test_pause_duration_is_bounded(monkeypatch):
+    import osmUtils.utils_osm as utils_osm
+    checks = []
+    # the server is only running queries, without any slot time
+    monkeypatch.setattr(utils_osm, 'get_status', lambda *args: checks.append(args) or {
+        'rate_limit': 2, 'available_slots': 0, 'slot_times': []
+    })
+    monkeypatch.setattr(utils_osm.time, 'sleep', lambda seconds: None)
+    assert utils_osm.get_pause_duration(default_duration=5, max_checks=3) == 5
+    assert len(checks) == 3
+
+def test_default_session_per_thread():
+    from concurrent.futures import ThreadPoolExecutor
+    from osmUtils.utils_http import get_session
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        sessions = list(executor.map(lambda _: get_session(), range(2)))
+    assert get_session() is get_session()
+    assert get_session() not in sessions
+
+def test_response_cache_ttl(tmp_path):
+    import os
+    from osmUtils.utils_cache import ResponseCache
+    cache = ResponseCache(str(tmp_path), ttl=60, max_size=None)
+    cache.put('[out:json]; out;', 'http://a/api', {'elements': [1]})
+    assert cache.get('[out:json];\n  out;', 'http://a/api/') == {'elements': [1]}
+    assert cache.get('[out:json]; out;', 'http://b/api') is None
+    # an entry written over ttl seconds ago is expired and removed
+    filename = cache._get_filename(cache.get_key('[out:json]; out;', 'http://a/api'))
+    os.utime(filename, (time.time(), time.time() - 61))
+    assert cache.get('[out:json]; out;', 'http://a/api') is None
+    assert not os.path.exists(filename)
+    assert cache.get_size() == 0
+
+def test_response_cache_lru(tmp_path):
+    import os
+    from osmUtils.utils_cache import ResponseCache
+    cache = ResponseCache(str(tmp_path), ttl=None, max_size=None)
+    now = time.time()
+    for i, query in enumerate(['a', 'b']):
+        cache.put(query, 'http://a/api', {'elements': [query]})
+        os.utime(cache._get_filename(cache.get_key(query, 'http://a/api')), (now - 100 + i, now - 100))
+    # reading a refreshes its access time, so b is the least recently used entry
+    assert cache.get('a', 'http://a/api') == {'elements': ['a']}
+    cache.max_size = cache.get_size() + 1
+    cache.put('c', 'http://a/api', {'elements': ['c']})
+    assert cache.get('b', 'http://a/api') is None
+    assert cache.get('a', 'http://a/api') == {'elements': ['a']}
+    assert cache.get('c', 'http://a/api') == {'elements': ['c']}
+    assert cache.get_size() <= cache.max_size
+
+def test_response_cache_put_and_clear(tmp_path):
+    from osmUtils.utils_cache import ResponseCache, get_cache
+    cache = ResponseCache(str(tmp_path), ttl=None, max_size=None)
+    cache.put('a', 'http://a/api', {'elements': [1]})
+    cache.put('a', 'http://a/api', b'{"elements": [2]}')
+    # the entry is replaced at once, without leftover temporary files
+    assert cache.get('a', 'http://a/api') == {'elements': [2]}
+    assert cache.get('a', 'http://a/api', raw=True) == {'content': b'{"elements": [2]}'}
+    files = [path.name for path in tmp_path.rglob('*') if path.is_file()]
+    assert files == [f"{cache.get_key('a', 'http://a/api')}.json.gz"]
+    cache.clear()
+    assert cache.get('a', 'http://a/api') is None
+    assert cache.get_size() == 0
+    assert get_cache(False) is None
+    assert get_cache(cache) is cache
+
+def test_async_client_slot_limit(overpass):
+    pytest.importorskip('aiohttp')
+    from osmUtils.utils_async import run_queries
+    overpass.delay = 0.2
+    responses = run_queries([get_query(box(0, 0, 1, 1))] * 6, overpass_endpoint=overpass.url, cache=False)
+    assert [sum(el['type'] == 'way' for el in response['elements']) for response in responses] == [20] * 6
+    # the mock announces two slots, the client never runs more queries at once
+    assert overpass.max_running == 2
+    # the status is only queried again when no slot is known to be free
+    assert overpass.status_requests < 1 + 6
+
+def test_async_client_retries(overpass):
+    pytest.importorskip('aiohttp')
+    from osmUtils.utils_async import run_queries
+    kwargs = dict(overpass_endpoint=overpass.url, cache=False, backoff=0.1)
+    overpass.inject(429)
+    responses = run_queries([get_query(box(0, 0, 0.5, 1))], **kwargs)
+    assert len(overpass.queries) == 2
+    assert sum(el['type'] == 'way' for el in responses[0]['elements']) == 15
+    overpass.inject(504, times=2)
+    responses = run_queries([get_query(box(0, 0, 0.5, 1))], max_retries=1, **kwargs)
+    assert responses == [None]
+    # a query rejected by the server is not retried
+    overpass.inject(400)
+    responses = run_queries([get_query(box(0, 0, 0.5, 1))], **kwargs)
+    assert responses == [None]
+    assert len(overpass.queries) == 2 + 2 + 1
+
+FILTER_ELEMENTS = [
+    {'type': 'way', 'id': 1, 'nodes': [10, 11], 'tags': {'highway': 'residential', 'name': 'Main'}},
+    {'type': 'way', 'id': 2, 'nodes': [11, 12], 'tags': {'highway': 'footway'}},
+    {'type': 'way', 'id': 3, 'nodes': [12, 13], 'tags': {'building': 'yes'}},
+    {'type': 'way', 'id': 4, 'nodes': [13, 10], 'tags': {'highway': 'Primary'}},
+    {'type': 'node', 'id': 10, 'lat': 0, 'lon': 0, 'tags': {'highway': 'crossing'}},
+    {'type': 'node', 'id': 11, 'lat': 0, 'lon': 1},
+    {'type': 'node', 'id': 12, 'lat': 1, 'lon': 1},
+    {'type': 'node', 'id': 13, 'lat': 1, 'lon': 0},
+]
+
+@pytest.mark.parametrize('statement, expected', [
+    ('way["highway"]', [1, 2, 4]),
+    ('way[!"highway"]', [3]),
+    ('way["highway"="footway"]', [2]),
+    ('way["highway"!="footway"]', [1, 3, 4]),
+    ('way["highway"~"^(residential|primary)$"]', [1]),
+    ('way["highway"~"^(residential|primary)$",i]', [1, 4]),
+    ('way["highway"!~"foot|Prim"]', [1, 3]),
+    ("way[highway]['name'='Main']", [1]),
+    ('nwr["highway"]', [1, 2, 4, 10]),
+    ('node["highway"]', [10]),
+    ('[~"^high"~"cross"]', [10]),
+])
+def test_overpass_filter(statement, expected):
+    from osmUtils.utils_filter import OverpassFilter
+    from mock_overpass import parse_filter, match_clause
+    matcher = OverpassFilter(statement)
+    assert [el['id'] for el in FILTER_ELEMENTS if matcher.match(el)] == expected
+    # the mock server has its own matcher
+    types, clauses = parse_filter(statement)
+    assert [
+        el['id'] for el in FILTER_ELEMENTS
+        if el['type'] in types and all(match_clause(clause, el.get('tags', {})) for clause in clauses)
+    ] == expected
+
+def test_split_response():
+    from osmUtils.utils_filter import get_filters, split_response
+    response_json = {'version': 0.6, 'elements': FILTER_ELEMENTS}
+    residential, footway = split_response(response_json, ['way["highway"="residential"]', 'way["highway"="footway"]'])
+    # the matching ways keep their nodes from the `>;` recursion, in the order of the response
+    assert [(el['type'], el['id']) for el in residential['elements']] == [('way', 1), ('node', 10), ('node', 11)]
+    assert [(el['type'], el['id']) for el in footway['elements']] == [('way', 2), ('node', 11), ('node', 12)]
+    assert residential['version'] == 0.6
+    # filters with other clauses cannot be split on the client side
+    assert get_filters(['way["highway"](around:10,0,0)']) is None
+    assert split_response(response_json, ['way["highway"]', 'way(around:10,0,0)']) is None
+
+def ring_ways(*coords):
+    import numpy as np
+    return [np.array(way, dtype=np.float64) for way in coords]
+
+def test_assemble_rings_unordered_and_reversed():
+    from osmUtils.utils_polygon import assemble_rings
+    # a 10x10 square split in three ways, out of order and one of them reversed
+    ways = ring_ways([(10, 0), (10, 10), (0, 10)], [(0, 0), (10, 0)], [(0, 0), (0, 10)])
+    rings = assemble_rings(ways)
+    assert len(rings) == 1
+    assert Polygon(rings[0]).is_valid
+    assert Polygon(rings[0]).area == 100
+    # the segments that do not close a ring are dropped
+    assert assemble_rings(ring_ways([(0, 0), (10, 0), (10, 10)], [(10, 10), (0, 10)])) == []
+
+def test_assemble_multipolygon():
+    from osmUtils.utils_polygon import assemble_multipolygon
+    outer = ring_ways([(0, 0), (10, 0), (10, 10)], [(0, 0), (0, 10), (10, 10)])
+    second_outer = ring_ways([(20, 0), (30, 0), (30, 10), (20, 10), (20, 0)])
+    inner = ring_ways([(2, 2), (4, 2), (4, 4)], [(4, 4), (2, 4), (2, 2)])
+    second_inner = ring_ways([(22, 2), (28, 2), (28, 8), (22, 8), (22, 2)])
+    members = ([('outer', way) for way in outer] + [('inner', way) for way in inner + second_inner]
+               + [('', way) for way in second_outer])
+    multipolygon = assemble_multipolygon(members)
+    assert multipolygon.is_valid
+    assert len(multipolygon.geoms) == 2
+    # every inner ring is a hole of the outer ring that contains it
+    assert sorted(polygon.area for polygon in multipolygon.geoms) == [100 - 36, 100 - 4]
+    assert all(len(polygon.interiors) == 1 for polygon in multipolygon.geoms)
+    # an outer ring that cannot be closed gives no multipolygon
+    assert assemble_multipolygon([('outer', outer[0]), ('inner', second_inner[0])]) is None
 
+def make_features(osm_ids, osm_types, geoms):
+    import geopandas as gpd
+    return gpd.GeoDataFrame({'osm_id': osm_ids, 'osm_type': osm_types}, geometry=geoms, crs='EPSG:4326')
 
+def test_clip_features():
+    from shapely.geometry import LineString, Point
+    from osmUtils.utils_osm import clip_features, filter_features
+    tile = box(0, 0, 1, 1)
+    inside = LineString([(0.2, 0.2), (0.8, 0.2)])
+    gdf = make_features([1, 2, 3, 4, 5], [1, 1, 1, 1, 0], [
+        inside,
+        LineString([(0.5, 0.5), (1.5, 0.5)]),
+        LineString([(2, 2), (3, 3)]),
+        LineString([(1, 0.2), (2, 0.2)]),
+        Point(1, 0.5),
+    ])
+    clipped = clip_features(gdf, tile)
+    # the way crossing the edge is cut at it, the one outside and the one touching the edge are dropped
+    assert clipped.osm_id.tolist() == [1, 2, 5]
+    assert clipped.geometry[0].equals(inside)
+    assert clipped.geometry[1].equals(LineString([(0.5, 0.5), (1, 0.5)]))
+    # a point exactly on the boundary belongs to the tile
+    assert clipped.geometry[2].equals(Point(1, 0.5))
+    assert filter_features(gdf, tile).osm_id.tolist() == [1, 2, 4, 5]
 
+def test_merge_features_across_tiles():
+    from shapely.geometry import LineString, Point
+    from osmUtils.utils_osm import merge_features
+    way = LineString([(0.5, 0.5), (1.5, 0.5)])
+    west = make_features([7, 8, 7], [1, 1, 0], [way, LineString([(0.1, 0.1), (0.2, 0.1)]), Point(1, 0.5)])
+    east = make_features([7, 7], [1, 0], [way, Point(1, 0.5)])
+    # the way and the node in both tiles are kept once, a node and a way with the same id are different features
+    merged = merge_features([west, east])
+    assert sorted(zip(merged.osm_type, merged.osm_id)) == [(0, 7), (1, 7), (1, 8)]
+    # clipped to the union of the tiles, the way is not cut
+    merged = merge_features([west, east], box(0, 0, 2, 1))
+    assert [geom.length for geom in merged.geometry[merged.osm_type == 1]] == [1.0, 0.1]
 
+def test_partition_record(tmp_path):
+    from osmUtils.utils_partition import save_partition, load_partition
+    geometry = box(0, 0, 1, 1)
+    partition = [{'geometry': box(0, 0, 0.5, 1), 'count': 10, 'depth': 1},
+                 {'geometry': box(0.5, 0, 1, 1), 'count': 0, 'depth': 1}]
+    save_partition(geometry, FILTERS, partition, str(tmp_path), 'body', 'http://a/api')
+    loaded = load_partition(geometry, FILTERS, str(tmp_path), 'body', 'http://a/api/')
+    assert [(part['count'], part['depth']) for part in loaded] == [(10, 1), (0, 1)]
+    assert all(part['geometry'].equals(expected['geometry']) for part, expected in zip(loaded, partition))
+    # the partition is only reused for the same filters, output profile and endpoint
+    assert load_partition(geometry, ['way["building"]'], str(tmp_path), 'body', 'http://a/api') is None
+    assert load_partition(geometry, FILTERS, str(tmp_path), 'center', 'http://a/api') is None
+    assert load_partition(geometry, FILTERS, str(tmp_path), 'body', 'http://b/api') is None
+    assert load_partition(geometry, FILTERS, None) is None
 
+def test_retrieve_osm_vertex_budget(overpass):
+    kwargs = dict(overpass_endpoint=overpass.url, cache=False, pause_duration=0)
+    # a C shape around the end of the way at y=6/11, which crosses its envelope only
+    geometry = Polygon([(0.95, 0.52), (1.2, 0.52), (1.2, 0.57), (0.95, 0.57), (0.95, 0.56), (1.1, 0.56),
+                        (1.1, 0.53), (0.95, 0.53)])
+    assert len(generate_osm_gdf(retrieve_osm(geometry.envelope, FILTERS, **kwargs))) == 1
+    gdf = retrieve_osm(geometry, FILTERS, max_vertices=4, **kwargs)
+    assert gdf.empty
+    assert overpass.queries[-1] == overpass.queries[0]
 
+def test_adaptive_partition_failures(overpass):
+    from osmUtils.utils_partition import adaptive_partition
+    kwargs = dict(overpass_endpoint=overpass.url, cache=False, pause_duration=0)
+    # a server error is not a timeout, the part is not split
+    overpass.inject(500)
+    partition = adaptive_partition(box(0, 0, 1, 1), FILTERS, **kwargs)
+    assert [(part['count'], part['depth']) for part in partition] == [(None, 0)]
+    assert len(overpass.queries) == 1
+    # every count times out, the partition stops growing at max_parts
+    overpass.max_elements = 0
+    partition = adaptive_partition(box(0, 0, 1, 1), FILTERS, max_parts=10, **kwargs)
+    assert len(partition) == 10
+    # one count query for every part and every part split on the way
+    assert len(overpass.queries) == 1 + 13
 
+def test_retrieve_osm_partition_path(overpass, tmp_path):
+    overpass.max_elements = 150
+    kwargs = dict(overpass_endpoint=overpass.url, cache=False, pause_duration=0)
+    retrieve_osm(box(0, 0, 1, 1), FILTERS, **kwargs)
+    queries = len(overpass.queries)
+    # the partition is only recorded where the caller asks
+    retrieve_osm(box(0, 0, 1, 1), FILTERS, partition_path=str(tmp_path), **kwargs)
+    assert len(overpass.queries) == 2 * queries
+    gdf = generate_osm_gdf(retrieve_osm(box(0, 0, 1, 1), FILTERS, partition_path=str(tmp_path), **kwargs))
+    assert len(gdf) == 20
+    # the recorded parts are queried straight away
+    assert len(overpass.queries) < 3 * queries
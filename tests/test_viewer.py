@@ -0,0 +1,17 @@
+"""Tests for the folium viewer of osmUtils"""
+import folium
+import geopandas as gpd
+from shapely.geometry import LineString, box
+from osmUtils.utils_map import generate_folium_map, get_html_iframe
+from osmUtils.utils_geo import generate_folium_choropleth_map
+
+
+def test_generate_folium_map():
+    gdf = gpd.GeoDataFrame(geometry=[LineString([(0, 0), (1, 1)]), LineString([(1, 0), (0, 1)])])
+    folium_map = generate_folium_map(gdf, {'zoom_start': 5, 'color': '#000000'})
+    assert isinstance(folium_map, folium.Map)
+    assert 'leaflet' in get_html_iframe(folium_map).lower()
+
+def test_generate_folium_choropleth_map():
+    manifest = gpd.GeoDataFrame({'id': ['1_0_0']}, geometry=[box(0, 0, 1, 1)], crs='EPSG:4326')
+    assert isinstance(generate_folium_choropleth_map(manifest), folium.Map)